@@ -0,0 +1,85 @@
+"""
+Compares analyzing a PBF file with the osmium node callbacks of OSMFileAnalyzer,
+with the blob by blob decoding of the node locations, and with the blobs decoded
+in parallel by a pool of worker processes.
+
+    $ python benchmarks/bench_analyze.py <path_to_osm_pbf_file> --workers 4
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from osm_feature_extractor.feature_extraction.osm_analyzer import (
+    OSMFileAnalyzer,
+    analyze_pbf_blobs,
+    analyze_pbf_blobs_parallel,
+    analyze_osm_header,
+)
+from osm_feature_extractor.feature_extraction.pbf_reader import read_blob_index
+
+
+def analyze_with_callbacks(osm_file):
+
+    osm_handler = OSMFileAnalyzer()
+    osm_handler.apply_file(osm_file)
+    osm_handler.finish()
+
+    return osm_handler.statistics, osm_handler.ways_counter
+
+
+def timed(function, *args):
+
+    start = time.perf_counter()
+    result = function(*args)
+
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("osm_file")
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    callbacks_seconds, (statistics, ways) = timed(analyze_with_callbacks, args.osm_file)
+    blobs_seconds, (blob_statistics, blob_ways) = timed(
+        lambda osm_file: analyze_pbf_blobs(osm_file, read_blob_index(osm_file)), args.osm_file
+    )
+    parallel_seconds, (parallel_statistics, parallel_ways) = timed(
+        lambda osm_file: analyze_pbf_blobs_parallel(osm_file, read_blob_index(osm_file), args.workers),
+        args.osm_file,
+    )
+    header_seconds, _ = timed(analyze_osm_header, args.osm_file)
+
+    results = {
+        "nodes": statistics[0],
+        "ways": ways,
+        "callbacks_seconds": round(callbacks_seconds, 3),
+        "blobs_seconds": round(blobs_seconds, 3),
+        "parallel_seconds": round(parallel_seconds, 3),
+        "workers": args.workers,
+        "header_only_seconds": round(header_seconds, 3),
+        "speedup": round(callbacks_seconds / blobs_seconds, 1),
+        "parallel_speedup": round(blobs_seconds / parallel_seconds, 1),
+        "same_counts": statistics[0] == blob_statistics[0] == parallel_statistics[0]
+        and ways == blob_ways == parallel_ways,
+        "same_bbox": bool(
+            np.array_equal(statistics[3], blob_statistics[3])
+            and np.array_equal(statistics[3], parallel_statistics[3])
+        ),
+        "max_centroid_difference": float(max(
+            np.max(np.abs(statistics[1] - blob_statistics[1])),
+            np.max(np.abs(statistics[1] - parallel_statistics[1])),
+        )),
+        "max_variance_relative_difference": float(
+            np.max(np.abs(statistics[2] - parallel_statistics[2]) / statistics[2])
+        ),
+    }
+
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Compares the per object turf length and area with the vectorized geodesy kernels
+on random ways of 2 to 50 points and random areas of 5 to 100 points.
+
+    $ python benchmarks/bench_geodesy.py [--objects 20000] [--seed 0]
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+import shapely
+from turf import length, area as turf_area
+
+from osm_feature_extractor.feature_augmenting.geodesy import lines_lengths, polygons_areas
+
+
+def random_lines(rng, n_objects):
+
+    lines = []
+
+    for _ in range(n_objects):
+        start = rng.uniform([-10, 35], [30, 60])
+        steps = rng.normal(0, 0.0005, size=(rng.integers(2, 51) - 1, 2))
+        lines.append(shapely.LineString(np.vstack([start, start + np.cumsum(steps, axis=0)])))
+
+    return np.array(lines, dtype=object)
+
+
+def random_polygons(rng, n_objects):
+
+    polygons = []
+
+    for _ in range(n_objects):
+        n_points = rng.integers(4, 100)
+        center = rng.uniform([-10, 35], [30, 60])
+        angles = np.sort(rng.uniform(0, 2 * np.pi, n_points))
+        radius = rng.uniform(0.0001, 0.002) * rng.uniform(0.5, 1, n_points)
+        polygons.append(shapely.Polygon(center + np.c_[np.cos(angles), np.sin(angles)] * radius[:, None]))
+
+    return np.array(polygons, dtype=object)
+
+
+def timed(function, geometries):
+
+    start = time.perf_counter()
+    values = function(geometries)
+
+    return time.perf_counter() - start, np.asarray(values, dtype=np.float64)
+
+
+def compare(turf_function, kernel, geometries):
+
+    turf_seconds, turf_values = timed(
+        lambda geoms: [turf_function(geom) for geom in geoms], geometries
+    )
+    kernel_seconds, kernel_values = timed(kernel, geometries)
+
+    return {
+        "objects": len(geometries),
+        "turf_seconds": round(turf_seconds, 3),
+        "kernel_seconds": round(kernel_seconds, 3),
+        "speedup": round(turf_seconds / kernel_seconds, 1),
+        "max_relative_difference": float(np.max(np.abs(kernel_values - turf_values) / turf_values)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--objects", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+
+    results = {
+        "length": compare(
+            lambda geom: length([list(coord) for coord in geom.coords], {"units": "meters"}),
+            lines_lengths,
+            random_lines(rng, args.objects),
+        ),
+        "area": compare(
+            lambda geom: turf_area([[list(coord) for coord in geom.exterior.coords]]),
+            polygons_areas,
+            random_polygons(rng, args.objects),
+        ),
+    }
+
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
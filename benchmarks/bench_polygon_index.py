@@ -0,0 +1,69 @@
+"""
+Compares the build and query times of the STRtree of the PolygonIndex with different
+node capacities, over a grid of square cells queried with random points and short lines.
+
+    $ python benchmarks/bench_polygon_index.py [--cells 250000] [--queries 200000] [--capacities 4 10 16 32 64]
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+import shapely
+
+from osm_feature_extractor.feature_augmenting.polygon_index import PolygonIndex
+
+
+def grid_cells(n_cells, cell_size=0.01):
+
+    side = int(np.sqrt(n_cells))
+    x, y = np.meshgrid(np.arange(side) * cell_size, np.arange(side) * cell_size)
+
+    return shapely.box(x.ravel(), y.ravel(), x.ravel() + cell_size, y.ravel() + cell_size), side * cell_size
+
+
+def timed(function):
+
+    start = time.perf_counter()
+    result = function()
+
+    return round(time.perf_counter() - start, 3), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--cells", type=int, default=250000)
+    parser.add_argument("--queries", type=int, default=200000)
+    parser.add_argument("--capacities", type=int, nargs="+", default=[4, 10, 16, 32, 64])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    cells, extent = grid_cells(args.cells)
+
+    rng = np.random.default_rng(args.seed)
+    points = rng.uniform(0, extent, size=(args.queries, 2))
+    lines = shapely.linestrings(np.stack([points, points + rng.normal(0, 0.005, size=points.shape)], axis=1))
+
+    results = {"cells": len(cells), "queries": args.queries, "capacities": {}}
+
+    for node_capacity in args.capacities:
+
+        build_seconds, polygon_index = timed(
+            lambda: PolygonIndex(np.arange(len(cells)), cells, node_capacity=node_capacity)
+        )
+        points_seconds, (point_idxs, _) = timed(lambda: polygon_index.query_points(points))
+        lines_seconds, matches = timed(lambda: polygon_index.query(lines, predicate="intersects"))
+
+        results["capacities"][node_capacity] = {
+            "build_seconds": build_seconds,
+            "points_query_seconds": points_seconds,
+            "lines_query_seconds": lines_seconds,
+            "point_hits": len(point_idxs),
+            "line_hits": matches.shape[1],
+        }
+
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
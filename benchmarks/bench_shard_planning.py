@@ -0,0 +1,65 @@
+"""
+Compares the balance of the shards planned with the normal distribution of split_bounds
+and with the quantiles of the node density histogram, by counting the nodes of each cell.
+
+    $ python benchmarks/bench_shard_planning.py <path_to_osm_file> --shards 16
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from osm_feature_extractor.feature_extraction.density_histogram import (
+    DensityHistogram,
+    count_shard_nodes,
+    split_bounds_by_density,
+)
+from osm_feature_extractor.feature_extraction.osm_analyzer import analyze_osm_file, split_bounds
+
+
+def get_balance(shard_counts, max_nodes_box):
+
+    return {
+        "shards": len(shard_counts),
+        "empty_shards": int(np.sum(shard_counts == 0)),
+        "max_nodes": int(shard_counts.max()),
+        "mean_nodes": round(float(shard_counts.mean()), 1),
+        "max_over_mean": round(float(shard_counts.max() / shard_counts.mean()), 2),
+        "max_over_target": round(float(shard_counts.max() / max_nodes_box), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("osm_file")
+    parser.add_argument("--shards", type=int, default=16)
+    args = parser.parse_args()
+
+    histogram = DensityHistogram()
+
+    start = time.perf_counter()
+    number_nodes, _, bbox, centroid, std = analyze_osm_file(args.osm_file, histogram)
+    analyze_seconds = time.perf_counter() - start
+
+    max_nodes_box = max(number_nodes / args.shards, 1)
+
+    x_divisions, y_divisions = split_bounds(number_nodes, bbox, centroid, std, max_nodes_box=max_nodes_box)
+    normal_divisions = [x_divisions, [y_divisions] * (len(x_divisions) - 1)]
+    density_divisions = split_bounds_by_density(histogram, max_nodes_box=max_nodes_box)
+
+    results = {
+        "nodes": number_nodes,
+        "histogram_cells": len(histogram.keys),
+        "analyze_seconds": round(analyze_seconds, 3),
+        "split_bounds": get_balance(count_shard_nodes(histogram, normal_divisions), max_nodes_box),
+        "split_bounds_by_density": get_balance(
+            count_shard_nodes(histogram, density_divisions), max_nodes_box
+        ),
+    }
+
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Measures the cost of the python callbacks of OSMFileHandler with and without the
+osmium tag filters.
+
+    $ python benchmarks/bench_tag_filter.py <path_to_osm_file> <path_to_polygons_file>
+"""
+import argparse
+import json
+import time
+
+from osm_feature_extractor.feature_augmenting.polygon_index import load_polygon_index
+from osm_feature_extractor.feature_extraction.osm_extractor_augmenter import (
+    OSMFileHandler,
+    get_tag_filters,
+)
+
+
+class CountingHandler(OSMFileHandler):
+    """
+    OSMFileHandler that counts every object delivered to the python callbacks
+    """
+
+    def __init__(self, polygon_index):
+        OSMFileHandler.__init__(self, polygon_index)
+
+        self.callbacks = 0
+
+    def node(self, n):
+        self.callbacks += 1
+        OSMFileHandler.node(self, n)
+
+    def way(self, w):
+        self.callbacks += 1
+        OSMFileHandler.way(self, w)
+
+
+def run(osm_file, polygon_index, filters):
+
+    osm_handler = CountingHandler(polygon_index)
+
+    start = time.perf_counter()
+
+    osm_handler.apply_file(osm_file, locations=True, idx='flex_mem', filters=filters)
+    osm_handler.flush()
+
+    return {"seconds": round(time.perf_counter() - start, 3), "callbacks": osm_handler.callbacks}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("osm_file")
+    parser.add_argument("polygons_file")
+    args = parser.parse_args()
+
+    with open(args.polygons_file) as f:
+        polygons = {str(i): feature for i, feature in enumerate(json.load(f)["features"])}
+
+    polygon_index = load_polygon_index(polygons)
+
+    results = {
+        "without_filters": run(args.osm_file, polygon_index, []),
+        "with_filters": run(args.osm_file, polygon_index, get_tag_filters()),
+    }
+
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
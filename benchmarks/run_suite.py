@@ -0,0 +1,228 @@
+"""
+Runs the analyze and extract hot paths over a synthetic OSM file and polygon grid, and
+stores the rates and the peak memory of each one in a JSON file named after the current
+commit, so that the results can be compared between commits.
+
+Each benchmark runs in a fresh process, so that its peak RSS is not shared with the
+fixture generation or the other benchmarks, and the best of --repeat runs is kept.
+
+    $ python benchmarks/run_suite.py [--nodes 200000] [--ways 20000] [--cells 400]
+    $ python benchmarks/run_suite.py --compare benchmarks/results/<commit>.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+import osmium.version
+
+from synthetic_data import write_synthetic_osm_file, write_polygon_grid
+
+from osm_feature_extractor.feature_augmenting.polygon_index import load_polygon_index
+from osm_feature_extractor.feature_extraction.osm_analyzer import analyze_osm_file
+from osm_feature_extractor.feature_extraction.osm_extractor_augmenter import extract_features_augment
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+# Rates compared between two result files
+RATES = ["nodes_per_second", "ways_per_second", "matches_per_second"]
+
+
+def benchmark_analyze(osm_file, polygons_file, workers):
+
+    start = time.perf_counter()
+    nodes, ways, *_ = analyze_osm_file(osm_file, workers=workers)
+    seconds = time.perf_counter() - start
+
+    return {
+        "seconds": seconds,
+        "nodes_per_second": nodes / seconds,
+        "ways_per_second": ways / seconds,
+    }
+
+
+def benchmark_extract(osm_file, polygons_file, workers):
+
+    with open(polygons_file) as f:
+        polygons = {str(i): feature for i, feature in enumerate(json.load(f)["features"])}
+
+    start = time.perf_counter()
+    polygon_index = load_polygon_index(polygons)
+    index_seconds = time.perf_counter() - start
+
+    nodes, ways, *_ = analyze_osm_file(osm_file)
+
+    start = time.perf_counter()
+    accumulator = extract_features_augment(osm_file, polygon_index)
+    seconds = time.perf_counter() - start
+
+    matches = sum(
+        accumulator.counters[counter]
+        for counter in ["nodes_matched", "ways_inside", "ways_clipped", "areas_inside", "areas_clipped"]
+    )
+
+    return {
+        "seconds": seconds,
+        "index_seconds": index_seconds,
+        "matches": matches,
+        "nodes_per_second": nodes / seconds,
+        "ways_per_second": ways / seconds,
+        "matches_per_second": matches / seconds,
+    }
+
+
+BENCHMARKS = {
+    "analyze": benchmark_analyze,
+    "extract": benchmark_extract,
+}
+
+
+def _measure(benchmark, *args):
+
+    result = BENCHMARKS[benchmark](*args)
+
+    # ru_maxrss is in kilobytes on Linux
+    result["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    return result
+
+
+def run_benchmark(benchmark, repeat, *args):
+    """
+    Runs a benchmark repeat times, each one in a new process
+
+    :param benchmark: name of the benchmark
+    :param repeat: number of runs
+    :param args: arguments of the benchmark
+    :return: results of the fastest run, with the largest peak RSS of all runs
+    """
+
+    runs = []
+
+    for _ in range(repeat):
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            runs.append(executor.submit(_measure, benchmark, *args).result())
+
+    best = min(runs, key=lambda run: run["seconds"])
+    best["peak_rss_mb"] = max(run["peak_rss_mb"] for run in runs)
+
+    return {key: round(value, 3) if isinstance(value, float) else value for key, value in best.items()}
+
+
+def get_commit():
+
+    def git(*args):
+        return subprocess.run(
+            ["git", *args], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+
+    commit = git("rev-parse", "--short", "HEAD") or "unknown"
+    dirty = git("status", "--porcelain", "--untracked-files=no") != ""
+
+    return commit, dirty
+
+
+def get_fixtures(fixtures_dir, nodes, ways, cells, seed):
+    """
+    Generates the synthetic osm file and polygon grid, unless they are already in fixtures_dir
+
+    :return: (osm file, polygons file, dict with the size of the fixtures)
+    """
+
+    os.makedirs(fixtures_dir, exist_ok=True)
+
+    osm_file = os.path.join(fixtures_dir, f"synthetic_{nodes}_{ways}_{seed}.osm.pbf")
+    polygons_file = os.path.join(fixtures_dir, f"grid_{cells}.geojson")
+
+    if not os.path.exists(osm_file):
+        write_synthetic_osm_file(osm_file, nodes, ways, seed=seed)
+
+    if not os.path.exists(polygons_file):
+        write_polygon_grid(polygons_file, cells)
+
+    with open(polygons_file) as f:
+        polygons = len(json.load(f)["features"])
+
+    return osm_file, polygons_file, {"osm_file_bytes": os.path.getsize(osm_file), "polygons": polygons}
+
+
+def compare(results, previous):
+    """
+    :return: ratio of each rate of the results to the one of the previous results
+    """
+
+    return {
+        benchmark: {
+            rate: round(values[rate] / previous["benchmarks"][benchmark][rate], 3)
+            for rate in RATES
+            if rate in values and rate in previous["benchmarks"].get(benchmark, {})
+        }
+        for benchmark, values in results["benchmarks"].items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=int, default=200000, help="Number of standalone nodes")
+    parser.add_argument("--ways", type=int, default=20000, help="Number of ways")
+    parser.add_argument("--cells", type=int, default=400, help="Number of cells of the polygon grid")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=1, help="Number of workers of analyze")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--benchmarks", nargs="+", choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument("--fixtures-dir", default=os.path.join(RESULTS_DIR, "fixtures"))
+    parser.add_argument("--output-dir", default=RESULTS_DIR)
+    parser.add_argument("--compare", help="Results file of a previous run to compare the rates with")
+    args = parser.parse_args()
+
+    osm_file, polygons_file, fixtures = get_fixtures(
+        args.fixtures_dir, args.nodes, args.ways, args.cells, args.seed
+    )
+
+    commit, dirty = get_commit()
+
+    results = {
+        "commit": commit,
+        "dirty": dirty,
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "pyosmium": osmium.version.pyosmium_release,
+        "cpus": os.cpu_count(),
+        "parameters": {
+            "nodes": args.nodes,
+            "ways": args.ways,
+            "cells": args.cells,
+            "seed": args.seed,
+            "workers": args.workers,
+            "repeat": args.repeat,
+        },
+        "fixtures": fixtures,
+        "benchmarks": {
+            benchmark: run_benchmark(benchmark, args.repeat, osm_file, polygons_file, args.workers)
+            for benchmark in args.benchmarks
+        },
+    }
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            results["compared_to"] = os.path.basename(args.compare)
+            results["ratios"] = compare(results, json.load(f))
+
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    output_file = os.path.join(args.output_dir, f"{commit}{'-dirty' if dirty else ''}.json")
+
+    with open(output_file, "w") as f:
+        json.dump(results, f, indent=4)
+
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""
+Generates synthetic OSM files and polygon grids for the benchmarks.
+
+The nodes are spread uniformly over a bounding box, a share of them tagged with node
+features. Each way has its own nodes: lines are random walks tagged with way features,
+and areas are closed squares tagged with area features.
+
+    $ python benchmarks/synthetic_data.py <output_osm_file> <output_polygons_file> [--nodes 100000]
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+import osmium
+from osmium.osm.mutable import Node, Way
+
+from osm_feature_extractor.feature_augmenting.features_to_tags import (
+    amenity_tags,
+    building_tags,
+    highway_tags,
+    landuse_tags,
+    shop_tags,
+)
+
+# [west, south, east, north] of the generated data
+DEFAULT_BBOX = (-1.5, 50.5, -0.5, 50.9)
+
+NODE_TAGS = {
+    "highway": ["bus_stop", "crossing", "traffic_signals", "street_lamp"],
+    "amenity": sorted(amenity_tags),
+    "shop": sorted(shop_tags),
+}
+
+WAY_TAGS = {
+    "highway": ["primary", "secondary", "residential", "service", "footway", "cycleway"],
+}
+
+AREA_TAGS = {
+    "building": sorted(building_tags),
+    "landuse": sorted(landuse_tags),
+    "amenity": sorted(amenity_tags),
+    "shop": sorted(shop_tags),
+}
+
+# Share of the standalone nodes with tags
+TAGGED_NODES_SHARE = 0.1
+
+# Share of the ways that are closed areas
+AREAS_SHARE = 0.4
+
+# Size of the output buffer of the osmium writer
+WRITER_BUFFER_SIZE = 1 << 22
+
+
+def _random_tags(rng, tags):
+
+    key = list(tags)[rng.integers(len(tags))]
+
+    return {key: tags[key][rng.integers(len(tags[key]))]}
+
+
+def write_synthetic_osm_file(osm_file, nodes=100000, ways=10000, bbox=DEFAULT_BBOX, seed=0):
+    """
+    Writes a synthetic osm file with tagged nodes, lines and areas
+
+    :param osm_file: path of the osm file, whose format is given by its extension
+    :param nodes: number of standalone nodes
+    :param ways: number of ways, each one with its own nodes
+    :param bbox: bounding box of the nodes [west, south, east, north]
+    :param seed: seed of the random generator
+    :return: (total number of nodes, number of ways)
+    """
+
+    rng = np.random.default_rng(seed)
+
+    west, south, east, north = bbox
+
+    if os.path.exists(osm_file):
+        os.remove(osm_file)
+
+    writer = osmium.SimpleWriter(osm_file, WRITER_BUFFER_SIZE)
+
+    try:
+        node_id = 1
+
+        for lon, lat in rng.uniform([west, south], [east, north], size=(nodes, 2)):
+
+            tags = _random_tags(rng, NODE_TAGS) if rng.random() < TAGGED_NODES_SHARE else {}
+
+            writer.add_node(Node(id=node_id, location=(lon, lat), tags=tags, version=1))
+            node_id += 1
+
+        way_nodes = []
+
+        for start in rng.uniform([west, south], [east, north], size=(ways, 2)):
+
+            if rng.random() < AREAS_SHARE:
+                side = rng.uniform(0.0001, 0.002)
+                points = start + np.array([[0, 0], [side, 0], [side, side], [0, side]])
+                tags = _random_tags(rng, AREA_TAGS)
+            else:
+                steps = rng.normal(0, 0.001, size=(rng.integers(1, 10), 2))
+                points = np.vstack([start, start + np.cumsum(steps, axis=0)])
+                tags = _random_tags(rng, WAY_TAGS)
+
+            node_ids = []
+
+            for lon, lat in np.clip(points, [west, south], [east, north]):
+                writer.add_node(Node(id=node_id, location=(lon, lat), version=1))
+                node_ids.append(node_id)
+                node_id += 1
+
+            if "highway" not in tags:
+                node_ids.append(node_ids[0])
+
+            way_nodes.append((node_ids, tags))
+
+        for way_id, (node_ids, tags) in enumerate(way_nodes, 1):
+            writer.add_way(Way(id=way_id, nodes=node_ids, tags=tags, version=1))
+
+    finally:
+        writer.close()
+
+    return node_id - 1, ways
+
+
+def write_polygon_grid(polygons_file, cells=100, bbox=DEFAULT_BBOX):
+    """
+    Writes a GeoJSON grid of about cells square polygons covering the bounding box
+
+    :param polygons_file: path of the GeoJSON file
+    :param cells: number of cells of the grid
+    :param bbox: bounding box covered by the grid [west, south, east, north]
+    :return: number of polygons of the grid
+    """
+
+    west, south, east, north = bbox
+
+    x_cells = max(int(np.round(np.sqrt(cells * (east - west) / (north - south)))), 1)
+    y_cells = max(int(np.round(cells / x_cells)), 1)
+
+    xs = np.linspace(west, east, x_cells + 1)
+    ys = np.linspace(south, north, y_cells + 1)
+
+    features = [
+        {
+            "type": "Feature",
+            "properties": {"name": f"cell_{i}_{j}"},
+            "geometry": {
+                "type": "Polygon",
+                "coordinates": [[
+                    [xs[i], ys[j]], [xs[i + 1], ys[j]], [xs[i + 1], ys[j + 1]], [xs[i], ys[j + 1]], [xs[i], ys[j]]
+                ]],
+            },
+        }
+        for i in range(x_cells)
+        for j in range(y_cells)
+    ]
+
+    with open(polygons_file, "w") as f:
+        json.dump({"type": "FeatureCollection", "features": features}, f)
+
+    return len(features)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("osm_file")
+    parser.add_argument("polygons_file")
+    parser.add_argument("--nodes", type=int, default=100000)
+    parser.add_argument("--ways", type=int, default=10000)
+    parser.add_argument("--cells", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    nodes, ways = write_synthetic_osm_file(args.osm_file, args.nodes, args.ways, seed=args.seed)
+    polygons = write_polygon_grid(args.polygons_file, args.cells)
+
+    print(json.dumps({"nodes": nodes, "ways": ways, "polygons": polygons}, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import hashlib
+import logging
+import os
+import shutil
+
+from osm_feature_extractor.feature_augmenting.features_table import feature_names
+
+# Increased whenever the layout of the cached files changes
+CACHE_FORMAT_VERSION = 3
+
+CACHE_DIR_NAME = "base_data_cache"
+
+# Files of a cache entry
+POLYGON_INDEX_FILE = "polygon_index"
+FEATURES_FILE = "features.json"
+
+# Marks a cache entry as complete, and its modification time as the last time it was used
+LAST_USED_FILE = "last_used"
+
+
+def get_schema_version():
+    """
+    Gets a version of the schema of the prepared base data, which changes whenever
+    the extracted features or the format of the cached files change
+
+    :return: hex digest of the schema
+    """
+
+    schema = "\n".join([str(CACHE_FORMAT_VERSION), *feature_names])
+
+    return hashlib.sha256(schema.encode()).hexdigest()[:16]
+
+
+def get_cache_key(input_polygons_file, polygons_file, max_polygon_vertices=None):
+    """
+    Computes the key of the prepared base data of an input polygons file, from the hash
+    of its content, the schema version, the name of the file the entry is written to and
+    the preprocessing options
+
+    :param input_polygons_file: Path to file with the polygon geojson features to be mapped
+    :param polygons_file: name of the file of the entry with the input properties of the polygons
+    :param max_polygon_vertices: polygons with more vertices are tiled in the spatial index
+    :return: cache key
+    """
+
+    digest = hashlib.sha256()
+
+    if os.path.isfile(input_polygons_file):
+        with open(input_polygons_file, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    else:
+        digest.update(input_polygons_file.encode())
+
+    digest.update(f"{get_schema_version()}|{polygons_file}|{max_polygon_vertices}".encode())
+
+    return digest.hexdigest()[:32]
+
+
+def get_cache_entry_dir(osm_extractor_files_dir, cache_key):
+    """
+    Gets the directory of a cache entry
+
+    :param osm_extractor_files_dir: path to extractor files data directory
+    :param cache_key: key of the cache entry
+    :return: path of the cache entry directory
+    """
+
+    return os.path.join(osm_extractor_files_dir, CACHE_DIR_NAME, cache_key)
+
+
+def is_cache_entry_complete(entry_dir):
+    """
+    :param entry_dir: path of the cache entry directory
+    :return: True if the cache entry was completely written, False otherwise
+    """
+
+    return os.path.exists(os.path.join(entry_dir, LAST_USED_FILE))
+
+
+def create_cache_entry(entry_dir, write_entry):
+    """
+    Writes a cache entry into a temporary directory, which is only renamed to the
+    entry directory once complete, so that interrupted runs never leave partial entries
+
+    :param entry_dir: path of the cache entry directory
+    :param write_entry: function that writes the files of the entry into the directory it is given
+    :return: None
+    """
+
+    tmp_dir = f"{entry_dir}.tmp-{os.getpid()}"
+
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    write_entry(tmp_dir)
+
+    open(os.path.join(tmp_dir, LAST_USED_FILE), "w").close()
+
+    shutil.rmtree(entry_dir, ignore_errors=True)
+    os.replace(tmp_dir, entry_dir)
+
+
+def touch_cache_entry(entry_dir):
+    """
+    Marks a cache entry as used now
+
+    :param entry_dir: path of the cache entry directory
+    :return: None
+    """
+
+    os.utime(os.path.join(entry_dir, LAST_USED_FILE))
+
+
+def evict_cache_entries(osm_extractor_files_dir, max_entries):
+    """
+    Removes the least recently used cache entries, keeping at most max_entries
+
+    :param osm_extractor_files_dir: path to extractor files data directory
+    :param max_entries: maximum number of cache entries kept
+    :return: None
+    """
+
+    cache_dir = os.path.join(osm_extractor_files_dir, CACHE_DIR_NAME)
+
+    entries = [
+        os.path.join(cache_dir, name) for name in os.listdir(cache_dir)
+        if is_cache_entry_complete(os.path.join(cache_dir, name))
+    ]
+
+    entries.sort(key=lambda entry: os.path.getmtime(os.path.join(entry, LAST_USED_FILE)), reverse=True)
+
+    for entry in entries[max_entries:]:
+        logging.info(f"\tEvicting base data cache entry {entry}...")
+        shutil.rmtree(entry, ignore_errors=True)
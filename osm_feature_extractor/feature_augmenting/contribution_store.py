@@ -0,0 +1,254 @@
+import json
+import logging
+import os
+import sqlite3
+
+import numpy as np
+
+from osm_feature_extractor.feature_augmenting.features_table import feature_names
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS features (
+    feature_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS polygons (
+    polygon_row INTEGER PRIMARY KEY,
+    polygon_id TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS contributions (
+    osm_type TEXT NOT NULL,
+    osm_id INTEGER NOT NULL,
+    version INTEGER NOT NULL,
+    polygon_row INTEGER NOT NULL,
+    feature_id INTEGER NOT NULL,
+    value REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS contributions_object ON contributions (osm_type, osm_id);
+CREATE INDEX IF NOT EXISTS contributions_polygon ON contributions (polygon_row);
+CREATE TABLE IF NOT EXISTS changed_nodes (
+    osm_id INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL,
+    lon REAL,
+    lat REAL
+);
+CREATE TABLE IF NOT EXISTS changed_ways (
+    osm_id INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL,
+    tags TEXT,
+    node_ids TEXT
+);
+"""
+
+
+def get_contribution_store_path(osm_extractor_files_dir, contribution_store):
+    """
+    Gets the path of the contribution store file
+
+    :param osm_extractor_files_dir: path to extractor files data directory
+    :param contribution_store: name of the contribution store file
+    :return: path of the contribution store file
+    """
+
+    return os.path.join(osm_extractor_files_dir, contribution_store)
+
+
+class ContributionStore:
+    """
+    SQLite store with one row (osm type, osm id, version, polygon, feature, value) for every
+    value added to the polygon features by the matchers, so that contributions can be
+    subtracted by later updates and queried by polygon.
+
+    The latest versions of the nodes and ways changed by the applied change files are also
+    stored, since the osm file the features were extracted from only has their old versions.
+    Deleted objects are stored without location or nodes.
+
+    Several processes can write to the same store, each with its own connection.
+
+    Attributes:
+        path (str): path of the SQLite file
+        connection (sqlite3.Connection): connection to the store
+    """
+
+    def __init__(self, path):
+
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=600)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def reset(self, polygon_ids):
+        """
+        Removes all contributions and stores the ids of the polygons of a new extraction
+
+        :param polygon_ids: ids of the polygons, aligned with the accumulator rows
+        :return: None
+        """
+
+        with self.connection:
+            self.connection.execute("DELETE FROM contributions")
+            self.connection.execute("DELETE FROM changed_nodes")
+            self.connection.execute("DELETE FROM changed_ways")
+            self.connection.execute("DELETE FROM polygons")
+            self.connection.execute("DELETE FROM features")
+            self.connection.executemany(
+                "INSERT INTO polygons VALUES (?, ?)", enumerate(map(str, polygon_ids))
+            )
+            self.connection.executemany("INSERT INTO features VALUES (?, ?)", enumerate(feature_names))
+
+    def check_polygons(self, polygon_ids):
+        """
+        Checks that the store was written for the same polygons, in the same order
+
+        :param polygon_ids: ids of the polygons, aligned with the accumulator rows
+        :return: None
+        """
+
+        stored_ids = [
+            polygon_id for polygon_id, in
+            self.connection.execute("SELECT polygon_id FROM polygons ORDER BY polygon_row")
+        ]
+
+        if stored_ids != list(map(str, polygon_ids)):
+            raise ValueError(f"The contribution store {self.path} was written for different polygons")
+
+    def write(self, osm_type, osm_ids, versions, rows, columns, values):
+        """
+        Writes a batch of contributions in a single transaction
+
+        :param osm_type: node or way
+        :param osm_ids: array with the osm id of each contribution
+        :param versions: array with the osm version of each contribution
+        :param rows: array with the polygon row of each contribution
+        :param columns: array with the feature column of each contribution
+        :param values: array with the value of each contribution
+        :return: None
+        """
+
+        with self.connection:
+            self.connection.executemany(
+                "INSERT INTO contributions VALUES (?, ?, ?, ?, ?, ?)",
+                zip(
+                    [osm_type] * len(osm_ids),
+                    osm_ids.tolist(),
+                    versions.tolist(),
+                    rows.tolist(),
+                    columns.tolist(),
+                    values.tolist(),
+                ),
+            )
+
+    def _select_objects(self, osm_type, osm_ids):
+
+        self.connection.execute("CREATE TEMP TABLE IF NOT EXISTS selected_ids (osm_id INTEGER PRIMARY KEY)")
+        self.connection.execute("DELETE FROM selected_ids")
+        self.connection.executemany("INSERT OR IGNORE INTO selected_ids VALUES (?)", ((i,) for i in osm_ids))
+
+        return f"osm_type = '{osm_type}' AND osm_id IN (SELECT osm_id FROM selected_ids)"
+
+    def get_versions(self, osm_type, osm_ids):
+        """
+        Gets the stored versions of osm objects
+
+        :param osm_type: node or way
+        :param osm_ids: ids of the osm objects
+        :return: dict with the version of each object with contributions
+        """
+
+        condition = self._select_objects(osm_type, osm_ids)
+
+        return dict(self.connection.execute(
+            f"SELECT osm_id, MAX(version) FROM contributions WHERE {condition} GROUP BY osm_id"
+        ).fetchall())
+
+    def pop(self, osm_type, osm_ids):
+        """
+        Removes the contributions of osm objects from the store
+
+        :param osm_type: node or way
+        :param osm_ids: ids of the osm objects
+        :return: (polygon rows, feature columns, values) of the removed contributions
+        """
+
+        with self.connection:
+
+            condition = self._select_objects(osm_type, osm_ids)
+
+            contributions = np.array(self.connection.execute(
+                f"SELECT polygon_row, feature_id, value FROM contributions WHERE {condition}"
+            ).fetchall(), dtype=np.float64).reshape(-1, 3)
+
+            self.connection.execute(f"DELETE FROM contributions WHERE {condition}")
+
+        logging.info(f"\t\tRemoved {len(contributions)} stored contributions of changed {osm_type}s")
+
+        return contributions[:, 0].astype(np.int64), contributions[:, 1].astype(np.int64), contributions[:, 2]
+
+    def write_changed_objects(self, nodes, ways):
+        """
+        Stores the latest versions of the nodes and ways of an applied change file
+
+        :param nodes: dict with the (version, coordinates) of each node, coordinates None if deleted
+        :param ways: dict with the (version, tags, node ids) of each way, tags and node ids None if deleted
+        :return: None
+        """
+
+        node_rows = [
+            (node_id, version, *(coords if coords is not None else (None, None)))
+            for node_id, (version, coords) in nodes.items()
+        ]
+
+        way_rows = [
+            (way_id, version, *(map(json.dumps, (tags, node_ids)) if node_ids is not None else (None, None)))
+            for way_id, (version, tags, node_ids) in ways.items()
+        ]
+
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO changed_nodes VALUES (?, ?, ?, ?)", node_rows)
+            self.connection.executemany("INSERT OR REPLACE INTO changed_ways VALUES (?, ?, ?, ?)", way_rows)
+
+    def get_changed_nodes(self):
+        """
+        :return: dict with the location of each node changed by the applied change files, None if deleted
+        """
+
+        return {
+            node_id: (lon, lat) if lon is not None else None
+            for node_id, lon, lat in self.connection.execute("SELECT osm_id, lon, lat FROM changed_nodes")
+        }
+
+    def get_changed_ways(self):
+        """
+        :return: dict with the (version, tags, node ids) of each way changed by the applied change
+            files, None if deleted
+        """
+
+        return {
+            way_id: (version, json.loads(tags), json.loads(node_ids)) if node_ids is not None else None
+            for way_id, version, tags, node_ids in self.connection.execute(
+                "SELECT osm_id, version, tags, node_ids FROM changed_ways"
+            )
+        }
+
+    def get_polygon_contributions(self, polygon_id):
+        """
+        Lists the osm objects that contributed to the features of a polygon
+
+        :param polygon_id: id of the polygon
+        :return: list of (osm type, osm id, version, feature, value)
+        """
+
+        return self.connection.execute(
+            """
+            SELECT c.osm_type, c.osm_id, c.version, f.name, c.value
+            FROM contributions c
+            JOIN polygons p ON p.polygon_row = c.polygon_row
+            JOIN features f ON f.feature_id = c.feature_id
+            WHERE p.polygon_id = ?
+            ORDER BY f.name, c.osm_type, c.osm_id
+            """,
+            (str(polygon_id),),
+        ).fetchall()
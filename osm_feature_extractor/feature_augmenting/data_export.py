@@ -0,0 +1,312 @@
+import csv
+import json
+import logging
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from shapely.geometry import mapping
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+OUTPUT_FORMATS = ["geojson", "geojsonseq", "geoparquet", "arrow", "feather", "csv"]
+
+# Formats of the output files by extension, used when reading a file whose format is not given
+OUTPUT_FORMAT_EXTENSIONS = {
+    ".geojson": "geojson",
+    ".json": "geojson",
+    ".geojsonl": "geojsonseq",
+    ".geojsons": "geojsonseq",
+    ".geojsonseq": "geojsonseq",
+    ".ndjson": "geojsonseq",
+    ".jsonl": "geojsonseq",
+    ".parquet": "geoparquet",
+    ".geoparquet": "geoparquet",
+    ".arrow": "arrow",
+    ".arrows": "arrow",
+    ".ipc": "arrow",
+    ".feather": "feather",
+    ".csv": "csv",
+}
+
+
+def dumps(obj):
+    """
+    Encodes an object as JSON, using orjson if it is installed
+
+    :param obj: object to be encoded
+    :return: encoded object as bytes
+    """
+
+    if orjson is not None:
+        return orjson.dumps(obj)
+
+    return json.dumps(obj).encode()
+
+
+def to_geodataframe(properties, polygon_index, accumulator):
+    """
+    Builds a GeoDataFrame with the input properties of the polygons, their extracted
+    features with numeric dtypes (int64 for counts and float64 otherwise) and their geometry
+
+    :param properties: list with the input properties of each polygon, aligned with the accumulator rows
+    :param polygon_index: PolygonIndex of the polygons, aligned with the accumulator rows
+    :param accumulator: FeatureAccumulator with the features of the polygons
+    :return: GeoDataFrame
+    """
+
+    index = pd.Index(polygon_index.ids, name="id")
+
+    properties_df = pd.DataFrame(properties, index=index)
+    properties_df = properties_df.drop(
+        columns=[*accumulator.features, "updated"], errors="ignore"
+    )
+
+    features_df = pd.DataFrame(accumulator.values, columns=accumulator.features, index=index)
+    features_df = features_df.astype({
+        feature: np.int64 for feature in accumulator.features if feature.endswith("_count")
+    })
+
+    updated = pd.Series(accumulator.updated, index=index, name="updated")
+
+    return gpd.GeoDataFrame(
+        pd.concat([properties_df, features_df, updated], axis=1),
+        geometry=gpd.GeoSeries(polygon_index.geometries, index=index),
+        crs="EPSG:4326",
+    )
+
+
+def write_arrow(polygons_df, output_file):
+    """
+    Writes a GeoDataFrame in the Arrow IPC streaming format, with WKB geometries
+
+    :param polygons_df: GeoDataFrame to be written
+    :param output_file: path of the output file
+    :return: None
+    """
+
+    import pyarrow as pa
+
+    table = pa.table(polygons_df.to_arrow(index=True, geometry_encoding="WKB"))
+
+    with pa.OSFile(output_file, "wb") as sink:
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+
+
+def iter_features(properties, polygon_index, accumulator):
+    """
+    Iterates over the GeoJSON features of the polygons with the accumulated features
+    as properties, building one feature at a time
+
+    :param properties: list with the input properties of each polygon, aligned with the accumulator rows
+    :param polygon_index: PolygonIndex of the polygons, aligned with the accumulator rows
+    :param accumulator: FeatureAccumulator with the features of the polygons
+    :return: generator of GeoJSON features
+    """
+
+    for polygon_id, polygon_properties, geometry, features in zip(
+        polygon_index.ids, properties, polygon_index.geometries, accumulator.iter_properties()
+    ):
+        yield {
+            "id": polygon_id,
+            "type": "Feature",
+            "properties": {**polygon_properties, **features},
+            "geometry": mapping(geometry),
+        }
+
+
+def write_geojson(features, output_file):
+    """
+    Writes the features as a GeoJSON FeatureCollection, one feature at a time
+
+    :param features: iterable of GeoJSON features
+    :param output_file: path of the output file
+    :return: None
+    """
+
+    with open(output_file, "wb") as f:
+
+        f.write(b'{"type": "FeatureCollection", "features": [\n')
+
+        for i, feature in enumerate(features):
+
+            if i > 0:
+                f.write(b",\n")
+
+            f.write(dumps(feature))
+
+        f.write(b"\n]}\n")
+
+
+def write_geojson_seq(features, output_file):
+    """
+    Writes the features as newline delimited GeoJSON (GeoJSONSeq), one feature per line
+
+    :param features: iterable of GeoJSON features
+    :param output_file: path of the output file
+    :return: None
+    """
+
+    with open(output_file, "wb") as f:
+
+        for feature in features:
+            f.write(dumps(feature))
+            f.write(b"\n")
+
+
+def read_geojson(input_file):
+    """
+    Reads the features of a GeoJSON FeatureCollection or of newline delimited GeoJSON,
+    such as the ones written by export_data
+
+    :param input_file: path of the GeoJSON file
+    :return: dict with the features by id, or by position if they don't have an id
+    """
+
+    with open(input_file, "r") as f:
+        try:
+            features = json.load(f)["features"]
+        except json.JSONDecodeError:
+            f.seek(0)
+            features = [json.loads(line) for line in f if line.strip()]
+
+    return {str(feature.get("id", i)): feature for i, feature in enumerate(features)}
+
+
+def get_output_format(output_file):
+    """
+    Infers the format of an output file from its extension
+
+    :param output_file: path of the output file
+    :return: one of OUTPUT_FORMATS, geojson if the extension is unknown
+    """
+
+    extension = os.path.splitext(output_file)[1].lower()
+
+    return OUTPUT_FORMAT_EXTENSIONS.get(extension, "geojson")
+
+
+def read_geodataframe(input_file, input_format):
+    """
+    Reads a file written by export_data in one of the columnar formats
+
+    :param input_file: path of the file
+    :param input_format: one of geoparquet, arrow, feather or csv
+    :return: GeoDataFrame indexed by the polygon ids
+    """
+
+    if input_format == "geoparquet":
+        polygons_df = gpd.read_parquet(input_file)
+
+    elif input_format == "arrow":
+        import pyarrow as pa
+
+        with pa.OSFile(input_file, "rb") as source:
+            polygons_df = gpd.GeoDataFrame.from_arrow(pa.ipc.open_stream(source).read_all())
+
+    elif input_format == "feather":
+        polygons_df = gpd.read_feather(input_file)
+
+    elif input_format == "csv":
+        # The first column is the index, and the header is read separately so that an input
+        # property also named id keeps its name
+        with open(input_file, newline="") as f:
+            columns = next(csv.reader(f))[1:]
+
+        polygons_df = pd.read_csv(input_file, index_col=0, dtype={"id": str})
+        polygons_df.columns = columns
+        polygons_df = gpd.GeoDataFrame(
+            polygons_df.drop(columns="geometry"),
+            geometry=shapely.from_wkt(polygons_df["geometry"]),
+            crs="EPSG:4326",
+        )
+
+    else:
+        raise ValueError(f"{input_format} is not a columnar output format")
+
+    if polygons_df.index.name != "id" and "id" in polygons_df.columns:
+        polygons_df = polygons_df.set_index("id")
+
+    return polygons_df
+
+
+def read_output(input_file, input_format=None):
+    """
+    Reads the features of a file written by export_data in any of the OUTPUT_FORMATS, as the
+    GeoJSON features of read_geojson. Missing values of the columnar formats are left out of
+    the properties, as in the GeoJSON features the columns were built from.
+
+    :param input_file: path of the file
+    :param input_format: one of OUTPUT_FORMATS. Inferred from the file extension if None
+    :return: dict with the features by id
+    """
+
+    if input_format is None:
+        input_format = get_output_format(input_file)
+
+    if input_format in ["geojson", "geojsonseq"]:
+        return read_geojson(input_file)
+
+    polygons_df = read_geodataframe(input_file, input_format)
+
+    geometries = polygons_df.geometry
+    records = pd.DataFrame(polygons_df.drop(columns=geometries.name)).to_dict("records")
+
+    return {
+        str(polygon_id): {
+            "id": str(polygon_id),
+            "type": "Feature",
+            "properties": {key: value for key, value in properties.items() if not pd.isna(value)},
+            "geometry": mapping(geometry),
+        }
+        for polygon_id, properties, geometry in zip(polygons_df.index, records, geometries)
+    }
+
+
+def export_data(properties, polygon_index, accumulator, output_file, output_format="geojson"):
+    """
+    Exports the polygons with their extracted features. GeoJSON formats are streamed one
+    feature at a time, while the columnar formats (geoparquet, arrow, feather and csv) are
+    written from a GeoDataFrame. geoparquet, arrow and feather store the geometries as WKB
+    and require pyarrow, csv stores them as WKT.
+
+    :param properties: list with the input properties of each polygon, aligned with the accumulator rows
+    :param polygon_index: PolygonIndex of the polygons, aligned with the accumulator rows
+    :param accumulator: FeatureAccumulator with the features of the polygons
+    :param output_file: path of the output file
+    :param output_format: one of OUTPUT_FORMATS
+    :return: None
+    """
+
+    logging.info(f"\tWriting {output_format} to {output_file}...")
+
+    if output_format in ["geojson", "geojsonseq"]:
+
+        features = iter_features(properties, polygon_index, accumulator)
+
+        if output_format == "geojsonseq":
+            write_geojson_seq(features, output_file)
+        else:
+            write_geojson(features, output_file)
+
+        return
+
+    polygons_df = to_geodataframe(properties, polygon_index, accumulator)
+
+    if output_format == "geoparquet":
+        polygons_df.to_parquet(output_file, geometry_encoding="WKB")
+
+    elif output_format == "arrow":
+        write_arrow(polygons_df, output_file)
+
+    elif output_format == "feather":
+        polygons_df.to_feather(output_file)
+
+    elif output_format == "csv":
+        polygons_df.to_csv(output_file)
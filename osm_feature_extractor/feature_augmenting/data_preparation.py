@@ -5,23 +5,13 @@ from warnings import simplefilter
 
 import geopandas as gpd
 import pandas as pd
-from rtree.index import Rtree
-
-from osm_feature_extractor.feature_augmenting.features_to_tags import (
-    features_types,
-    building_tags,
-    highway_tags,
-    cycleway_tags,
-    amenity_tags,
-    landuse_tags,
-    railway_tags,
-    public_transport_tags,
-    shop_tags,
-    unspecific_tags,
-    node_tags,
-    way_tags,
-    area_tags,
+
+from osm_feature_extractor.feature_augmenting.features_table import feature_names
+from osm_feature_extractor.feature_augmenting.polygon_index import (
+    build_polygon_index,
+    save_polygon_index,
 )
+from osm_feature_extractor.utils.metrics import metrics
 
 simplefilter(action="ignore", category=pd.errors.PerformanceWarning)
 
@@ -92,110 +82,80 @@ def save_json(data, osm_extractor_files_dir, file_name):
         json.dump(data, f)
 
 
-def build_r_tree(polygons_df, r_tree_path, create_r_tree):
+def get_feature_names():
     """
-    Build RTree index with input data polygons. To be used later on on polygons intersections
+    Lists the names of all the features that are extracted, in the order of the feature columns
 
-    :param polygons_df: GeoDataFrame with polygons to be indexed
-    :param r_tree_path: path of where to save the RTree index on disk
-    :param create_r_tree: if RTree should be created or not
-    :return: None
+    :return: list of feature names
     """
 
-    r_tree_file_path = r_tree_path + '.idx'
-
-    if create_r_tree or not os.path.exists(r_tree_file_path):
-
-        logging.info("\tBuilding R-Tree...")
-
-        r_tree_index = Rtree(r_tree_path, overwrite=True)
-
-        polygons = polygons_df["geometry"].values
-        polygon_indexes = polygons_df.index
-
-        for i, polygon in enumerate(polygons):
+    return list(feature_names)
 
-            bounding_box = polygon.bounds
 
-            r_tree_index.insert(polygon_indexes[i], bounding_box, polygon)
-
-        r_tree_index.close()
-
-
-def initialize_features(polygon_df):
+def save_polygon_properties(polygons_df, osm_extractor_files_dir, file_name):
     """
-    Initializes features that will be extracted at a later stage with 0 values
+    Saves the input properties of the polygons, without their geometries and without the
+    features to be extracted, as a JSON table with the column names stored only once
 
-    :param polygon_df: GeoDataFrame with polygons that will be initialized
-    :return: The GeoDataFrame with initialized features
+    :param polygons_df: GeoDataFrame with the input polygons
+    :param osm_extractor_files_dir: path to base data directory
+    :param file_name: name of file to be saved
+    :return: None
     """
 
-    logging.info("\tInitializing features...")
-
-    polygon_df["updated"] = False
-
-    features = []
-
-    for obj in [("node", "count"), ("way", "length"), ("area", "area")]:
-
-        object_tags = eval(f"{obj[0]}_tags")
-
-        for tag in object_tags:
-
-            if tag in unspecific_tags:
-                feature_name = tag
-
-                feature = "_".join([feature_name, obj[1]])
-
-                features.append(feature)
-
-            else:
-                features_dict = eval(f"{tag}_tags")
+    logging.info(f"\tSaving {file_name} in {osm_extractor_files_dir}...")
 
-                features_set = {value for value in features_dict.values()}
+    properties_df = pd.DataFrame(polygons_df.drop(
+        columns=[polygons_df.geometry.name, *get_feature_names(), "updated"], errors="ignore"
+    ))
 
-                for feature_name in features_set:
+    properties_df.to_json(
+        os.path.join(osm_extractor_files_dir, file_name), orient="split", index=False, double_precision=15
+    )
 
-                    if obj[1] in features_types[feature_name]:
 
-                        feature = "_".join([feature_name, obj[1]])
+def load_polygon_properties(osm_extractor_files_dir, file_name):
+    """
+    Loads the input properties of the polygons saved by save_polygon_properties
 
-                        features.append(feature)
+    :param osm_extractor_files_dir: path to base data directory
+    :param file_name: name of file with the properties
+    :return: list with the properties of each polygon
+    """
 
-        polygon_df[features] = 0
+    table = load_json(osm_extractor_files_dir, file_name)
 
-    return polygon_df
+    return [dict(zip(table["columns"], row)) for row in table["data"]]
 
 
 def process_base_data(
     osm_extractor_files_dir,
     input_polygons_file,
-    r_tree_path,
     polygons_file,
-    create_r_tree=True,
+    polygon_index_path=None,
+    max_polygon_vertices=None,
 ):
     """
     Methods that wraps all the data processing logic.
 
     :param osm_extractor_files_dir: path to extractor files data directory
     :param input_polygons_file: name of file with base data
-    :param r_tree_path: path of where to save the RTree index on disk
-    :param polygons_file: name of file where initialized GeoDataFrame will be saved
-    :param create_r_tree: if RTree should be created or not
+    :param polygons_file: name of file where the properties of the polygons will be saved
+    :param polygon_index_path: path of the directory where the polygons of the spatial index are cached
+    :param max_polygon_vertices: polygons with more vertices are tiled in the spatial index
     :return: None
     """
 
     logging.info("\tImporting data...")
 
-    base_data_df = load_data(input_polygons_file)
-
-    polygons_df = initialize_features(base_data_df)
+    polygons_df = load_data(input_polygons_file)
 
-    build_r_tree(polygons_df, r_tree_path, create_r_tree)
+    save_polygon_properties(polygons_df, osm_extractor_files_dir, polygons_file)
 
-    polygons = {
-        feature["id"]: feature
-        for feature in json.loads(polygons_df.to_json())["features"]
-    }
+    if polygon_index_path is not None:
+        with metrics.stage("index build"):
+            polygon_index = build_polygon_index(
+                polygons_df.index.astype(str), polygons_df.geometry.values, max_polygon_vertices
+            )
 
-    save_json(polygons, osm_extractor_files_dir, polygons_file)
+        save_polygon_index(polygon_index, polygon_index_path)
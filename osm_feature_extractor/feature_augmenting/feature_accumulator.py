@@ -0,0 +1,172 @@
+from collections import Counter
+
+import numpy as np
+
+from osm_feature_extractor.feature_augmenting.features_table import feature_names, feature_columns
+
+
+class FeatureAccumulator:
+    """
+    Dense matrix of polygons x features where the extracted features are accumulated.
+    The rows are aligned with the positions of the polygons in the PolygonIndex and the
+    columns with the feature columns of the features table.
+
+    Attributes:
+        features (list): names of the features
+        columns (dict): column index of each feature
+        values (np.ndarray): float64 matrix with the accumulated features
+        updated (np.ndarray): boolean array with the polygons that were matched to any object
+        counters (Counter): counts of how the (object, polygon) pairs were matched
+        store (ContributionStore): store where every contribution is also recorded, if any
+    """
+
+    def __init__(self, n_polygons, store=None):
+
+        self.features = feature_names
+        self.columns = feature_columns
+        self.values = np.zeros((n_polygons, len(self.features)), dtype=np.float64)
+        self.updated = np.zeros(n_polygons, dtype=bool)
+        self.counters = Counter()
+        self.store = store
+
+    @classmethod
+    def from_polygons(cls, polygons, polygon_ids):
+        """
+        Creates an accumulator with the features of previously augmented GeoJSON polygons
+
+        :param polygons: GeoJSON object with polygons that were mapped
+        :param polygon_ids: ids of the polygons, aligned with the rows
+        :return: FeatureAccumulator
+        """
+
+        accumulator = cls(len(polygon_ids))
+
+        for row, polygon_id in enumerate(polygon_ids):
+
+            properties = polygons[polygon_id]["properties"]
+
+            accumulator.values[row] = [properties.get(feature, 0) for feature in accumulator.features]
+            accumulator.updated[row] = properties.get("updated", False)
+
+        return accumulator
+
+    def add(self, rows, columns, values):
+        """
+        Adds values to the matrix. Repeated (row, column) pairs are accumulated.
+
+        :param rows: array with the polygon rows
+        :param columns: array with the feature columns
+        :param values: array with the values to be added
+        :return: None
+        """
+
+        np.add.at(self.values, (rows, columns), values)
+
+        self.updated[rows] = True
+
+    def get_partial_sums(self):
+        """
+        Gets the rows of the polygons that were updated
+
+        :return: (rows, values of those rows, counters)
+        """
+
+        rows = np.flatnonzero(self.updated)
+
+        return rows, self.values[rows], self.counters
+
+    def merge_partial_sums(self, rows, values, counters=None):
+        """
+        Adds partial sums of the rows of another accumulator
+
+        :param rows: array with the polygon rows
+        :param values: matrix with the values of those rows
+        :param counters: counters of the other accumulator
+        :return: None
+        """
+
+        self.values[rows] += values
+        self.updated[rows] = True
+
+        if counters is not None:
+            self.counters.update(counters)
+
+    def iter_properties(self):
+        """
+        Iterates over the accumulated features of each polygon, one row at a time
+
+        :return: generator of dicts with the features of each polygon
+        """
+
+        count_columns = [i for i, feature in enumerate(self.features) if feature.endswith("_count")]
+
+        for row, updated in zip(self.values, self.updated.tolist()):
+
+            values = row.tolist()
+
+            for i in count_columns:
+                values[i] = int(values[i])
+
+            properties = dict(zip(self.features, values))
+            properties["updated"] = updated
+
+            yield properties
+
+    def to_polygons(self, polygons, polygon_ids):
+        """
+        Materializes the accumulated features into the GeoJSON properties
+
+        :param polygons: GeoJSON object with polygons to be mapped
+        :param polygon_ids: ids of the polygons, aligned with the rows
+        :return: updated polygons
+        """
+
+        for polygon_id, properties in zip(polygon_ids, self.iter_properties()):
+            polygons[polygon_id]["properties"].update(properties)
+
+        return polygons
+
+
+def expand_pairs(object_idxs, polygon_idxs, values, column_offsets, columns):
+    """
+    Expands matched (object, polygon) pairs into one (row, column, value) entry
+    for every feature column of the object
+
+    :param object_idxs: array with the positions of the matched objects
+    :param polygon_idxs: array with the positions of the matched polygons
+    :param values: array with the value of each pair
+    :param column_offsets: array with the start of the feature columns of each object in columns
+    :param columns: array with the feature columns of all objects, concatenated
+    :return: (rows, columns, values)
+    """
+
+    repeats = np.diff(column_offsets)[object_idxs]
+
+    starts = np.repeat(column_offsets[object_idxs], repeats)
+    positions = np.arange(repeats.sum()) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+
+    return (
+        np.repeat(polygon_idxs, repeats),
+        columns[starts + positions],
+        np.repeat(values, repeats),
+    )
+
+
+def map_columns(column_offsets, columns, column_mapping):
+    """
+    Maps the feature columns of each object to other feature columns, dropping the ones
+    without a mapping
+
+    :param column_offsets: array with the start of the feature columns of each object in columns
+    :param columns: array with the feature columns of all objects, concatenated
+    :param column_mapping: array with the mapped column of each column, -1 if there is none
+    :return: (mapped column offsets, mapped columns)
+    """
+
+    mapped_columns = column_mapping[columns]
+    keep = mapped_columns >= 0
+
+    objects = np.repeat(np.arange(len(column_offsets) - 1), np.diff(column_offsets))
+    n_columns = np.bincount(objects[keep], minlength=len(column_offsets) - 1)
+
+    return np.concatenate([[0], np.cumsum(n_columns)]), mapped_columns[keep]
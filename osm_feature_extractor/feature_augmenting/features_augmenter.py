@@ -1,252 +1,353 @@
 import logging
-import re
-from shapely.errors import TopologicalError
-
-from rtree import Rtree
-from turf import length, area as polygon_area, line_string, feature_collection, InvalidInput, polygon
-
-from osm_feature_extractor.feature_augmenting.features_to_tags import (
-    features_types,
-    building_tags,
-    highway_tags,
-    cycleway_tags,
-    amenity_tags,
-    landuse_tags,
-    railway_tags,
-    public_transport_tags,
-    shop_tags,
-    unspecific_tags,
-    node_tags,
-    way_tags,
-    area_tags,
-)
-
-
-def load_r_tree(file_path):
-
-    r_tree_index = Rtree(file_path)
-
-    return r_tree_index
-
-
-def get_features(tags, tag_ids, feature_suffix):
-
-    features = []
-
-    for tag in tag_ids:
-        if tag in {*unspecific_tags, "total"}:
-            feature_name = tag
-
-        else:
-            tags_dict = eval(f"{tag}_tags")
-
-            try:
-                feature_name = tags_dict[tags[tag]]
-                if feature_suffix not in features_types[feature_name]:
-                    continue
-            except KeyError:
-                continue
-
-        feature = "_".join([feature_name, feature_suffix])
-
-        features.append(feature)
-
-    return features
 
+import numpy as np
+import shapely
+from shapely.errors import GEOSException
 
-def get_regex_matches(regex_str):
-
-    pattern = r"\((.*?)\)"
-
-    matches = re.findall(pattern, regex_str)
+from osm_feature_extractor.feature_augmenting.feature_accumulator import expand_pairs, map_columns
+from osm_feature_extractor.feature_augmenting.geodesy import (
+    haversine_lengths,
+    ring_areas,
+    lines_lengths,
+    polygons_areas,
+)
+from osm_feature_extractor.feature_augmenting.features_table import (
+    get_feature_columns,
+    area_count_columns,
+)
+from osm_feature_extractor.feature_extraction.osm_datamodel import ObjectBatch
 
-    matches = [match.replace("(", "").replace(")", "").split(", ") for match in matches]
 
-    return matches
+def intersect_pairs(objects, polygons_geometries, n_polygons):
+    """
+    Intersects each object with the respective polygon in bulk. If any of the
+    intersections fails, these are computed one by one and the failing ones are skipped.
 
+    :param objects: array of shapely geometries of the osm objects
+    :param polygons_geometries: array of shapely polygons, aligned with objects
+    :param n_polygons: total number of polygons (or polygon pieces) being mapped
+    :return: array with the intersections, None for the ones that failed
+    """
 
-def handle_multi_line_string(multi_line_string):
+    try:
+        return shapely.intersection(objects, polygons_geometries)
+    except GEOSException:
+        pass
 
-    matches = get_regex_matches(multi_line_string)
+    intersections = np.empty(len(objects), dtype=object)
+
+    for i, (obj, polygon_geometry) in enumerate(zip(objects, polygons_geometries)):
+        try:
+            intersections[i] = obj.intersection(polygon_geometry)
+        except GEOSException:
+            intersections[i] = obj if n_polygons == 1 else None
+
+    return intersections
 
-    line_strings = []
 
-    for match in matches:
+def add_pairs(accumulator, batch, object_idxs, polygon_idxs, values, column_offsets, columns):
+    """
+    Adds the values of matched (object, polygon) pairs to every feature column of the objects,
+    recording them in the contribution store of the accumulator, if it has one
+
+    :param accumulator: FeatureAccumulator where the features are added
+    :param batch: ObjectBatch of the matched objects
+    :param object_idxs: array with the positions of the matched objects
+    :param polygon_idxs: array with the positions of the matched polygons
+    :param values: array with the value of each pair
+    :param column_offsets: array with the start of the feature columns of each object in columns
+    :param columns: array with the feature columns of all objects, concatenated
+    :return: None
+    """
 
-        coords = [[float(c) for c in coord.split(" ")] for coord in match]
+    rows, feature_columns, feature_values = expand_pairs(
+        object_idxs, polygon_idxs, values, column_offsets, columns
+    )
 
-        line_strings.append(line_string(coords))
+    accumulator.add(rows, feature_columns, feature_values)
 
-    return feature_collection(line_strings)
+    if accumulator.store is not None:
 
+        object_idxs = np.repeat(object_idxs, np.diff(column_offsets)[object_idxs])
+
+        accumulator.store.write(
+            "node" if batch.geometry_kind == "node" else "way",
+            np.asarray(batch.ids)[object_idxs],
+            np.asarray(batch.versions)[object_idxs],
+            rows,
+            feature_columns,
+            feature_values,
+        )
 
-def handle_multi_polygon(multi_polygon):
 
-    matches = get_regex_matches(multi_polygon)
+def measure_pairs(
+    objects,
+    object_idxs,
+    piece_idxs,
+    polygon_index,
+    full_values,
+    measure,
+    counter_prefix,
+    accumulator,
+):
+    """
+    Measures the part of each matched object that lies in the respective polygon piece.
+    Objects fully inside the interior of the piece, found with the prepared piece, take
+    their precomputed full value, and only the objects crossing its boundary are clipped.
 
-    polygons = []
+    :param objects: array of shapely geometries of the osm objects
+    :param object_idxs: array with the positions of the matched objects
+    :param piece_idxs: array with the positions of the matched polygon pieces
+    :param polygon_index: PolygonIndex of the polygons
+    :param full_values: array with the length or area of each object
+    :param measure: function that measures an array of clipped geometries
+    :param counter_prefix: prefix of the counters of inside and clipped pairs
+    :param accumulator: FeatureAccumulator whose counters are updated
+    :return: array with the value of each pair, NaN if the object is not within the piece
+    """
 
-    for match in matches:
+    pieces = polygon_index.pieces[piece_idxs]
 
-        coords = [[[float(c) for c in coord.split(" ")] for coord in match]]
+    inside = shapely.contains_properly(pieces, objects[object_idxs])
+    clipped = ~inside
+
+    values = np.empty(len(object_idxs), dtype=np.float64)
+    values[inside] = full_values[object_idxs[inside]]
 
-        try:
-            polygons.append(polygon(coords))
-        except InvalidInput:
-            coords[0].append(coords[0][0])
-            polygons.append(polygon(coords))
+    intersections = intersect_pairs(
+        objects[object_idxs[clipped]], pieces[clipped], len(polygon_index.pieces)
+    )
+    values[clipped] = np.round(measure(intersections), 2)
+
+    accumulator.counters[f"{counter_prefix}_inside"] += int(inside.sum())
+    accumulator.counters[f"{counter_prefix}_clipped"] += int(clipped.sum())
+    accumulator.counters["intersections"] += len(intersections)
+
+    return values
 
-    return feature_collection(polygons)
 
+def log_match_counters(counters):
+    """
+    Logs the share of the ways and areas that were matched without being clipped
+
+    :param counters: counters of a FeatureAccumulator
+    :return: None
+    """
+
+    for counter_prefix in ["ways", "areas"]:
+
+        inside, clipped = counters[f"{counter_prefix}_inside"], counters[f"{counter_prefix}_clipped"]
+
+        if inside + clipped > 0:
+            logging.info(
+                f"\t\t{counter_prefix.capitalize()}: {inside} of {inside + clipped} matches "
+                f"({inside / (inside + clipped):.1%}) inside a polygon, {clipped} clipped"
+            )
 
-def match_nodes_to_polygon(tag_ids, nodes, r_tree_index, polygons):
 
-    for node in nodes:
+def match_nodes_to_polygon(batch, polygon_index, accumulator):
+    """
+    Matches a batch of nodes to the polygons they are within and counts their features
+
+    :param batch: ObjectBatch of nodes
+    :param polygon_index: PolygonIndex of the polygons
+    :param accumulator: FeatureAccumulator where the features are added
+    :return: updated accumulator
+    """
 
-        features = get_features(node.tags, tag_ids, "count")
+    if len(batch) == 0:
+        return accumulator
 
-        if len(features) == 0:
-            return polygons
+    _, coords = batch.get_coordinates()
 
-        matches = list(r_tree_index.intersection(node.point.bounds, objects=True))
+    node_idxs, piece_idxs = polygon_index.query_points(coords)
 
-        for match in matches:
-            if node.point.within(match.object):
-                for feature in features:
-                    polygons[str(match.id)]["properties"][feature] += 1
+    accumulator.counters["rtree_queries"] += len(coords)
+    accumulator.counters["nodes_matched"] += len(node_idxs)
 
-                polygons[str(match.id)]["properties"]["updated"] = True
+    add_pairs(
+        accumulator,
+        batch,
+        node_idxs,
+        polygon_index.parents[piece_idxs],
+        np.ones(len(node_idxs)),
+        *batch.get_columns(),
+    )
 
-    return polygons
+    return accumulator
 
 
-def match_ways_to_polygon(tag_ids, ways, r_tree_index, polygons):
+def match_ways_to_polygon(batch, polygon_index, accumulator):
+    """
+    Matches a batch of ways to the polygons they intersect and adds the length
+    of the intersections to their features. The lengths within each piece of a tiled
+    polygon are summed into the polygon.
+
+    :param batch: ObjectBatch of ways
+    :param polygon_index: PolygonIndex of the polygons
+    :param accumulator: FeatureAccumulator where the features are added
+    :return: updated accumulator
+    """
 
-    for way in ways:
+    if len(batch) == 0:
+        return accumulator
 
-        features = get_features(way.tags, tag_ids, "length")
+    line_strings = batch.geometries()
 
-        if len(features) == 0:
-            continue
+    way_idxs, piece_idxs = polygon_index.query(line_strings, predicate="intersects")
 
-        matches = list(r_tree_index.intersection(way.line_string.bounds, objects=True))
+    accumulator.counters["rtree_queries"] += len(line_strings)
 
-        for match in matches:
-            
-            try:
-                intersection = way.line_string.intersection(match.object)
+    coord_offsets, coords = batch.get_coordinates()
+    full_lengths = np.round(haversine_lengths(coords, coord_offsets), 2)
 
-                if not intersection.is_empty:
+    lengths = measure_pairs(
+        line_strings,
+        way_idxs,
+        piece_idxs,
+        polygon_index,
+        full_lengths,
+        lines_lengths,
+        "ways",
+        accumulator,
+    )
 
-                    geom_type = intersection.geom_type
+    matched = ~np.isnan(lengths)
 
-                    if geom_type == "LineString":
-                        coords = [list(coord) for coord in intersection.coords]
+    add_pairs(
+        accumulator,
+        batch,
+        way_idxs[matched],
+        polygon_index.parents[piece_idxs[matched]],
+        lengths[matched],
+        *batch.get_columns(),
+    )
 
-                    elif geom_type == "MultiLineString":
+    return accumulator
 
-                        try:
-                            coords = handle_multi_line_string(intersection.wkt)
-                        except InvalidInput:
-                            logging.info(
-                                f"Found LineString with only 1 coords: {intersection.wkt}"
-                            )
-                            continue
 
-                    else:
-                        logging.info(f"Found geometry type {geom_type}")
-                        continue
-                else:
-                    continue
+def match_areas_to_polygon(batch, polygon_index, accumulator):
+    """
+    Matches a batch of areas to the polygons they intersect and adds the area
+    of the intersections to their features. Buildings are also counted. The areas within
+    each piece of a tiled polygon are summed into the polygon, while buildings are
+    counted once per polygon.
 
-            except TopologicalError:
-                if len(polygons) == 1:
-                    coords = way.line_string.coords
-                else:
-                    continue
+    :param batch: ObjectBatch of areas
+    :param polygon_index: PolygonIndex of the polygons
+    :param accumulator: FeatureAccumulator where the features are added
+    :return: updated accumulator
+    """
 
-            line_length = round(length(coords, {"units": "meters"}), 2)
+    if len(batch) == 0:
+        return accumulator
 
-            for feature in features:
-                polygons[str(match.id)]["properties"][feature] += line_length
+    areas_polygons = batch.geometries()
 
-            polygons[str(match.id)]["properties"]["updated"] = True
+    area_idxs, piece_idxs = polygon_index.query(areas_polygons, predicate="intersects")
 
-    return polygons
+    accumulator.counters["rtree_queries"] += len(areas_polygons)
 
+    coord_offsets, coords = batch.get_coordinates()
+    full_areas = np.round(ring_areas(coords, coord_offsets), 2)
 
-def match_areas_to_polygon(tag_ids, areas, r_tree_index, polygons):
+    poly_areas = measure_pairs(
+        areas_polygons,
+        area_idxs,
+        piece_idxs,
+        polygon_index,
+        full_areas,
+        polygons_areas,
+        "areas",
+        accumulator,
+    )
 
-    for area in areas:
+    matched = ~np.isnan(poly_areas)
 
-        features = get_features(area.tags, tag_ids, "area")
+    area_idxs, polygon_idxs = area_idxs[matched], polygon_index.parents[piece_idxs[matched]]
 
-        if len(features) == 0:
-            continue
+    column_offsets, columns = batch.get_columns()
 
-        matches = list(r_tree_index.intersection(area.polygon.bounds, objects=True))
+    add_pairs(
+        accumulator, batch, area_idxs, polygon_idxs, poly_areas[matched], column_offsets, columns
+    )
 
-        for match in matches:
+    if polygon_index.is_tiled:
+        area_idxs, polygon_idxs = np.unique(np.stack([area_idxs, polygon_idxs]), axis=1)
 
-            try:
-                intersection = area.polygon.intersection(match.object)
-                if not intersection.is_empty:
+    add_pairs(
+        accumulator,
+        batch,
+        area_idxs,
+        polygon_idxs,
+        np.ones(len(area_idxs)),
+        *map_columns(column_offsets, columns, area_count_columns),
+    )
 
-                    geom_type = intersection.geom_type
+    return accumulator
 
-                    if geom_type == "Polygon":
-                        coords = [list(coord) for coord in intersection.exterior.coords]
 
-                    elif geom_type == "MultiPolygon":
+def match_polygons_to_features(accumulator, polygon_index, nodes, ways, areas=None):
+    """
+    Matches Node, Way and Area objects, grouped by tag, to the polygons
 
-                        try:
-                            coords = handle_multi_polygon(intersection.wkt)
-                        except InvalidInput:
-                            logging.info(
-                                f"Found Polygon with invalid coordinates: {intersection.wkt}"
-                            )
-                            continue
+    :param accumulator: FeatureAccumulator where the features are added
+    :param polygon_index: PolygonIndex of the polygons
+    :param nodes: dict with lists of Node objects by tag
+    :param ways: dict with lists of Way objects by tag
+    :param areas: dict with lists of Area objects by tag
+    :return: updated accumulator
+    """
 
-                    else:
-                        logging.info(f"Found geometry type {geom_type}")
-                        continue
-                else:
-                    continue
+    logging.info("\t\tMatching node features to polygons...")
 
-            except TopologicalError:
-                if len(polygons) == 1:
-                    coords = area.polygon.coords
-                else:
-                    continue
+    for tag_id, nodes_lst in nodes.items():
 
-            poly_area = round(polygon_area([coords]), 2)
+        batch = ObjectBatch("node")
 
-            for feature in features:
-                polygons[str(match.id)]["properties"][feature] += poly_area
+        for node in nodes_lst:
+            batch.append(
+                node.id,
+                node.tags.get("version", 0),
+                get_feature_columns(node.tags, [tag_id], "node"),
+                node.coordinates,
+            )
 
-                if "building" in feature:
-                    feature = feature.replace("_area", "_count")
-                    polygons[str(match.id)]["properties"][feature] += 1
+        accumulator = match_nodes_to_polygon(batch, polygon_index, accumulator)
 
-            polygons[str(match.id)]["properties"]["updated"] = True
+    logging.info("\t\tMatching way features to polygons...")
 
-    return polygons
+    for tag_id, ways_lst in ways.items():
 
+        batch = ObjectBatch("way")
 
-def match_polygons_to_features(polygons, r_tree_path, nodes, ways, areas=None):
+        for way in ways_lst:
+            batch.append(
+                way.id,
+                way.tags.get("version", 0),
+                get_feature_columns(way.tags, [tag_id], "way"),
+                [c for coord in way.coordinates for c in coord],
+            )
 
-    r_tree_index = load_r_tree(r_tree_path)
+        accumulator = match_ways_to_polygon(batch, polygon_index, accumulator)
 
-    logging.info("\t\tMatching node features to polygons...")
+    if areas is None:
+        return accumulator
 
-    for tag_id, nodes_lst in nodes.items():
+    logging.info("\t\tMatching area features to polygons...")
 
-        polygons = match_nodes_to_polygon(tag_id, nodes_lst, r_tree_index, polygons)
+    for tag_id, areas_lst in areas.items():
 
-    logging.info("\t\tMatching way features to polygons...")
+        batch = ObjectBatch("area")
 
-    for tag_id, ways_lst in ways.items():
+        for area in areas_lst:
+            batch.append(
+                area.id,
+                area.tags.get("version", 0),
+                get_feature_columns(area.tags, [tag_id], "area"),
+                [c for coord in area.coordinates for c in coord],
+            )
 
-        polygons = match_ways_to_polygon(tag_id, ways_lst, r_tree_index, polygons)
+        accumulator = match_areas_to_polygon(batch, polygon_index, accumulator)
 
-    return polygons
+    return accumulator
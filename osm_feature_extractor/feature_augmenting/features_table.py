@@ -0,0 +1,121 @@
+import numpy as np
+
+from osm_feature_extractor.feature_augmenting.features_to_tags import (
+    features_types,
+    building_tags,
+    highway_tags,
+    cycleway_tags,
+    amenity_tags,
+    landuse_tags,
+    railway_tags,
+    public_transport_tags,
+    shop_tags,
+    unspecific_tags,
+    node_tags,
+    way_tags,
+    area_tags,
+)
+
+geometry_kinds = {
+    "node": (node_tags, "count"),
+    "way": (way_tags, "length"),
+    "area": (area_tags, "area"),
+}
+
+specific_tags = {
+    "building": building_tags,
+    "highway": highway_tags,
+    "cycleway": cycleway_tags,
+    "amenity": amenity_tags,
+    "landuse": landuse_tags,
+    "railway": railway_tags,
+    "public_transport": public_transport_tags,
+    "shop": shop_tags,
+}
+
+
+def build_features_table():
+    """
+    Compiles the mappings in features_to_tags into the list of feature columns and a lookup
+    table of (geometry kind, tag key, tag value) -> tuple of feature columns. Unspecific
+    tags are mapped regardless of their value, so they are stored with a None value.
+
+    :return: (feature names, lookup table)
+    """
+
+    feature_names = []
+    table = {}
+
+    def get_column(feature):
+        if feature not in feature_names:
+            feature_names.append(feature)
+
+        return feature_names.index(feature)
+
+    for geometry_kind, (object_tags, feature_suffix) in geometry_kinds.items():
+
+        for tag in sorted(object_tags):
+
+            if tag in unspecific_tags:
+                table[(geometry_kind, tag, None)] = (get_column(f"{tag}_{feature_suffix}"),)
+
+                continue
+
+            features_dict = specific_tags[tag]
+
+            columns = {
+                feature_name: get_column(f"{feature_name}_{feature_suffix}")
+                for feature_name in sorted(set(features_dict.values()))
+                if feature_suffix in features_types[feature_name]
+            }
+
+            for tag_value, feature_name in features_dict.items():
+                if feature_name in columns:
+                    table[(geometry_kind, tag, tag_value)] = (columns[feature_name],)
+
+    return feature_names, table
+
+
+def build_area_count_columns(feature_columns):
+    """
+    Areas of buildings are also counted as buildings. Maps the area feature
+    columns of buildings to the respective count feature columns.
+
+    :param feature_columns: column index of each feature
+    :return: array with the count column of each column, -1 for the columns of other features
+    """
+
+    area_count_columns = np.full(len(feature_columns), -1, dtype=np.int64)
+
+    for feature, column in feature_columns.items():
+        if feature.startswith("building") and feature.endswith("_area"):
+            area_count_columns[column] = feature_columns[feature.replace("_area", "_count")]
+
+    return area_count_columns
+
+
+feature_names, features_table = build_features_table()
+
+feature_columns = {feature: i for i, feature in enumerate(feature_names)}
+
+area_count_columns = build_area_count_columns(feature_columns)
+
+
+def get_feature_columns(tags, tag_ids, geometry_kind):
+    """
+    Gets the feature columns of an osm object
+
+    :param tags: osm object tags
+    :param tag_ids: tags being analysed
+    :param geometry_kind: one of node, way or area
+    :return: tuple with the feature columns
+    """
+
+    columns = ()
+
+    for tag in tag_ids:
+        tag_value = None if tag in unspecific_tags else tags[tag]
+
+        columns += features_table.get((geometry_kind, tag, tag_value), ())
+
+    return columns
@@ -0,0 +1,138 @@
+import logging
+
+import numpy as np
+import shapely
+
+# Same earth radius as turf, so that lengths and areas match the turf ones
+EARTH_RADIUS = 6371008.8
+
+LINE_TYPES = [shapely.GeometryType.LINESTRING, shapely.GeometryType.MULTILINESTRING]
+POLYGON_TYPES = [shapely.GeometryType.POLYGON, shapely.GeometryType.MULTIPOLYGON]
+
+
+def haversine_lengths(coords, offsets):
+    """
+    Computes the length of a batch of lines with the haversine formula
+
+    :param coords: array of shape (n, 2) with the lng, lat points of all lines, concatenated
+    :param offsets: array with the start of each line in coords, followed by the total number of points
+    :return: array with the length of each line in meters
+    """
+
+    n_lines = len(offsets) - 1
+
+    if len(coords) < 2:
+        return np.zeros(n_lines)
+
+    lng, lat = np.radians(coords).T
+
+    d_lat = np.diff(lat)
+    d_lng = np.diff(lng)
+
+    a = np.sin(d_lat / 2) ** 2 + np.sin(d_lng / 2) ** 2 * np.cos(lat[:-1]) * np.cos(lat[1:])
+    distances = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+    # Segments between the last point of a line and the first point of the next one are discarded
+    line_ids = np.repeat(np.arange(n_lines), np.diff(offsets))[:-1]
+    valid = np.ones(len(distances), dtype=bool)
+    valid[offsets[1:-1] - 1] = False
+
+    return np.bincount(line_ids[valid], weights=distances[valid], minlength=n_lines) * EARTH_RADIUS
+
+
+def ring_areas(coords, offsets):
+    """
+    Computes the area of a batch of closed rings projected onto the earth, as described in
+    Chamberlain and Duquette, "Some Algorithms for Polygons on a Sphere", JPL Publication 07-03
+
+    :param coords: array of shape (n, 2) with the lng, lat points of all rings, concatenated
+    :param offsets: array with the start of each ring in coords, followed by the total number of points
+    :return: array with the area of each ring in square meters
+    """
+
+    n_rings = len(offsets) - 1
+
+    n_points = np.diff(offsets)
+    ring_ids = np.repeat(np.arange(n_rings), n_points)
+
+    starts = offsets[ring_ids]
+    sizes = n_points[ring_ids]
+    lower = np.arange(len(coords))
+    middle = starts + (lower - starts + 1) % sizes
+    upper = starts + (lower - starts + 2) % sizes
+
+    lng, lat = np.radians(coords).T
+
+    terms = (lng[upper] - lng[lower]) * np.sin(lat[middle])
+
+    areas = np.abs(np.bincount(ring_ids, weights=terms, minlength=n_rings)) * EARTH_RADIUS ** 2 / 2
+
+    areas[n_points <= 2] = 0
+
+    return areas
+
+
+def _get_valid(geometries, geometry_types):
+    """
+    Finds the non empty geometries of the given types, logging the types of the other
+    geometries. Missing geometries (None) are skipped silently.
+    """
+
+    type_ids = shapely.get_type_id(geometries)
+    empty = shapely.is_empty(geometries) | shapely.is_missing(geometries)
+
+    valid = np.isin(type_ids, geometry_types) & ~empty
+
+    for geom_type in set(type_ids[~valid & ~empty].tolist()):
+        logging.info(f"Found geometry type {shapely.GeometryType(geom_type).name}")
+
+    return valid
+
+
+def _get_offsets(part_ids, n_parts):
+
+    return np.concatenate([[0], np.cumsum(np.bincount(part_ids, minlength=n_parts))])
+
+
+def lines_lengths(geometries):
+    """
+    Computes the length of a batch of (Multi)LineStrings
+
+    :param geometries: array of shapely geometries
+    :return: array with the length of each geometry in meters, NaN for empty or non linear geometries
+    """
+
+    lengths = np.full(len(geometries), np.nan)
+
+    valid = _get_valid(geometries, LINE_TYPES)
+
+    parts, geometry_ids = shapely.get_parts(geometries[valid], return_index=True)
+    coords, part_ids = shapely.get_coordinates(parts, return_index=True)
+
+    parts_lengths = haversine_lengths(coords, _get_offsets(part_ids, len(parts)))
+
+    lengths[valid] = np.bincount(geometry_ids, weights=parts_lengths, minlength=valid.sum())
+
+    return lengths
+
+
+def polygons_areas(geometries):
+    """
+    Computes the area of the exterior ring(s) of a batch of (Multi)Polygons
+
+    :param geometries: array of shapely geometries
+    :return: array with the area of each geometry in square meters, NaN for empty or non polygonal geometries
+    """
+
+    areas = np.full(len(geometries), np.nan)
+
+    valid = _get_valid(geometries, POLYGON_TYPES)
+
+    parts, geometry_ids = shapely.get_parts(geometries[valid], return_index=True)
+    coords, part_ids = shapely.get_coordinates(shapely.get_exterior_ring(parts), return_index=True)
+
+    parts_areas = ring_areas(coords, _get_offsets(part_ids, len(parts)))
+
+    areas[valid] = np.bincount(geometry_ids, weights=parts_areas, minlength=valid.sum())
+
+    return areas
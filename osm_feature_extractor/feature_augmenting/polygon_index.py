@@ -0,0 +1,226 @@
+import logging
+import os
+
+import numpy as np
+import shapely
+from shapely.geometry import shape
+
+from osm_feature_extractor.feature_augmenting.polygon_tiling import tile_polygons
+
+# Maximum number of children of each node of the STRtree, the default of shapely
+DEFAULT_NODE_CAPACITY = 10
+
+# Nodes with fewer children can't be packed
+MIN_NODE_CAPACITY = 2
+
+
+class PolygonIndex:
+    """
+    In memory spatial index of the polygons to be mapped. Queries are done in bulk
+    for arrays of geometries and return the positions of the matched polygons, which
+    can be mapped back to the polygon ids with the ids attribute. The polygons are
+    prepared once, so that the predicates evaluated against them reuse their edge index.
+
+    Big polygons can be indexed as smaller pieces (see tile_polygons). Queries then return
+    the positions of the matched pieces, which are mapped to the position of their
+    polygon with the parents attribute.
+
+    The STRtree is packed with node_capacity children per node. Smaller nodes make the
+    bounding boxes tighter, so fewer candidates are tested, at the cost of a deeper tree.
+
+    Attributes:
+        ids (list): ids of the polygons
+        geometries (np.ndarray): array with the shapely polygons
+        pieces (np.ndarray): array with the indexed pieces of the polygons
+        parents (np.ndarray): position of the polygon of each piece
+        tree (shapely.STRtree): STRtree built over the pieces
+        node_capacity (int): maximum number of children of each node of the STRtree
+    """
+
+    def __init__(self, ids, geometries, pieces=None, parents=None, node_capacity=DEFAULT_NODE_CAPACITY):
+
+        self.ids = list(ids)
+        self.geometries = np.asarray(geometries, dtype=object)
+
+        if pieces is None:
+            self.pieces = self.geometries
+            self.parents = np.arange(len(self.ids), dtype=np.int64)
+        else:
+            self.pieces = np.asarray(pieces, dtype=object)
+            self.parents = np.asarray(parents, dtype=np.int64)
+
+        self.node_capacity = node_capacity
+        self.tree = shapely.STRtree(self.pieces, node_capacity=node_capacity)
+
+        shapely.prepare(self.pieces)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __reduce__(self):
+        if self.is_tiled:
+            return PolygonIndex, (self.ids, self.geometries, self.pieces, self.parents, self.node_capacity)
+
+        return PolygonIndex, (self.ids, self.geometries, None, None, self.node_capacity)
+
+    @property
+    def is_tiled(self):
+        return self.pieces is not self.geometries
+
+    def query(self, geometries, predicate=None):
+        """
+        Queries the index with an array of geometries
+
+        :param geometries: array of shapely geometries
+        :param predicate: binary predicate evaluated as predicate(geometry, polygon)
+        :return: array of shape (2, n) with the geometry positions and the matched piece positions
+        """
+
+        return self.tree.query(geometries, predicate=predicate)
+
+    def query_points(self, coords):
+        """
+        Finds the pieces that contain each point. Candidates are found by their bounding
+        box in the STRtree and tested with the prepared pieces, in bulk with contains_xy.
+
+        The points on the border of a piece of a tiled polygon, which can be an edge between
+        two of its pieces, are not contained in any of them, so they are tested against the
+        whole polygon instead, and matched to one of the pieces they are on.
+
+        :param coords: array of shape (n, 2) with the lng, lat of the points
+        :return: arrays with the point positions and the positions of the pieces containing them
+        """
+
+        point_idxs, piece_idxs = self.tree.query(shapely.points(coords))
+
+        x, y = coords[point_idxs, 0], coords[point_idxs, 1]
+
+        contained = shapely.contains_xy(self.pieces[piece_idxs], x, y)
+
+        if not self.is_tiled:
+            return point_idxs[contained], piece_idxs[contained]
+
+        outside = np.flatnonzero(~contained)
+        on_border = outside[shapely.intersects_xy(self.pieces[piece_idxs[outside]], x[outside], y[outside])]
+
+        border_point_idxs, border_piece_idxs = point_idxs[on_border], piece_idxs[on_border]
+        border_parents = self.parents[border_piece_idxs]
+
+        in_parent = shapely.contains_xy(
+            self.geometries[border_parents], coords[border_point_idxs, 0], coords[border_point_idxs, 1]
+        )
+
+        # A point on the edge between two pieces of a polygon is on the border of both
+        _, first = np.unique(
+            np.stack([border_point_idxs[in_parent], border_parents[in_parent]]), axis=1, return_index=True
+        )
+
+        return (
+            np.concatenate([point_idxs[contained], border_point_idxs[in_parent][first]]),
+            np.concatenate([piece_idxs[contained], border_piece_idxs[in_parent][first]]),
+        )
+
+
+def build_polygon_index(ids, geometries, max_vertices=None, node_capacity=DEFAULT_NODE_CAPACITY):
+    """
+    Builds the in memory spatial index, tiling the polygons with more than max_vertices vertices
+
+    :param ids: ids of the polygons
+    :param geometries: shapely polygons
+    :param max_vertices: maximum number of vertices of the indexed pieces. No tiling if None
+    :param node_capacity: maximum number of children of each node of the STRtree
+    :return: PolygonIndex
+    """
+
+    if max_vertices is None:
+        return PolygonIndex(ids, geometries, node_capacity=node_capacity)
+
+    geometries = np.asarray(geometries, dtype=object)
+
+    return PolygonIndex(ids, geometries, *tile_polygons(geometries, max_vertices), node_capacity=node_capacity)
+
+
+def load_polygon_index(polygons, max_vertices=None, node_capacity=DEFAULT_NODE_CAPACITY):
+    """
+    Builds the in memory spatial index from the GeoJSON polygons
+
+    :param polygons: GeoJSON object with polygons to be mapped
+    :param max_vertices: maximum number of vertices of the indexed pieces. No tiling if None
+    :param node_capacity: maximum number of children of each node of the STRtree
+    :return: PolygonIndex
+    """
+
+    logging.info("\tBuilding spatial index...")
+
+    geometries = [shape(polygon["geometry"]) for polygon in polygons.values()]
+
+    return build_polygon_index(polygons.keys(), geometries, max_vertices, node_capacity)
+
+
+def _to_wkb_buffer(geometries):
+
+    wkb = shapely.to_wkb(geometries)
+
+    offsets = np.concatenate([[0], np.cumsum([len(geometry) for geometry in wkb])])
+
+    return np.frombuffer(b"".join(wkb), dtype=np.uint8), offsets
+
+
+def _from_wkb_buffer(wkb, offsets):
+
+    return shapely.from_wkb([
+        wkb[start:end].tobytes() for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())
+    ])
+
+
+def save_polygon_index(polygon_index, index_dir):
+    """
+    Caches the polygons of the index, and their pieces if they were tiled, on disk as
+    WKB buffers in .npy files, so that they don't need to be parsed from GeoJSON again
+    on later runs, and can be read with memory mapping
+
+    :param polygon_index: PolygonIndex to be saved
+    :param index_dir: path of the directory where the .npy files are saved
+    :return: None
+    """
+
+    logging.info(f"\tSaving spatial index polygons in {index_dir}...")
+
+    os.makedirs(index_dir, exist_ok=True)
+
+    wkb, offsets = _to_wkb_buffer(polygon_index.geometries)
+
+    arrays = {"ids": np.array(polygon_index.ids, dtype=str), "wkb": wkb, "offsets": offsets}
+
+    if polygon_index.is_tiled:
+        arrays["pieces_wkb"], arrays["pieces_offsets"] = _to_wkb_buffer(polygon_index.pieces)
+        arrays["parents"] = polygon_index.parents
+
+    for name, values in arrays.items():
+        np.save(os.path.join(index_dir, f"{name}.npy"), values)
+
+
+def read_polygon_index(index_dir, node_capacity=DEFAULT_NODE_CAPACITY):
+    """
+    Builds the in memory spatial index from the polygons cached by save_polygon_index. Only
+    the polygons are cached, so the STRtree can be built with any node_capacity.
+
+    :param index_dir: path of the directory with the .npy files
+    :param node_capacity: maximum number of children of each node of the STRtree
+    :return: PolygonIndex
+    """
+
+    logging.info(f"\tLoading spatial index polygons from {index_dir}...")
+
+    def load(name):
+        return np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode="r")
+
+    ids = load("ids").tolist()
+    geometries = _from_wkb_buffer(load("wkb"), load("offsets"))
+
+    if not os.path.exists(os.path.join(index_dir, "parents.npy")):
+        return PolygonIndex(ids, geometries, node_capacity=node_capacity)
+
+    pieces = _from_wkb_buffer(load("pieces_wkb"), load("pieces_offsets"))
+
+    return PolygonIndex(ids, geometries, pieces, np.array(load("parents")), node_capacity)
@@ -0,0 +1,99 @@
+import logging
+
+import numpy as np
+import shapely
+
+# Limit on the number of times a polygon is subdivided
+MAX_TILING_DEPTH = 16
+
+# A piece has at least the 5 coordinates of a closed box, so smaller limits can't be met
+MIN_POLYGON_VERTICES = 5
+
+
+def _get_polygonal_parts(geometry):
+
+    parts = shapely.get_parts(geometry)
+
+    while np.any(shapely.get_type_id(parts) == shapely.GeometryType.GEOMETRYCOLLECTION):
+        parts = shapely.get_parts(parts)
+
+    polygon_types = [shapely.GeometryType.POLYGON, shapely.GeometryType.MULTIPOLYGON]
+
+    return parts[np.isin(shapely.get_type_id(parts), polygon_types) & ~shapely.is_empty(parts)]
+
+
+def tile_polygon(geometry, max_vertices, depth=0, stalled=False):
+    """
+    Subdivides a polygon in quadrants, recursively, until each piece has at most max_vertices
+    vertices. Pieces follow the local complexity of the polygon: simple regions are kept whole
+    while detailed boundaries are split into smaller tiles. A polygon is also kept whole if
+    neither splitting it nor splitting its pieces again reduces the number of vertices of the pieces.
+
+    :param geometry: shapely (Multi)Polygon
+    :param max_vertices: maximum number of vertices of each piece
+    :param depth: current subdivision level
+    :param stalled: if the split of the parent piece didn't reduce the number of vertices
+    :return: list of shapely (Multi)Polygons that together cover the polygon
+    """
+
+    num_vertices = shapely.get_num_coordinates(geometry)
+
+    if num_vertices <= max_vertices or depth >= MAX_TILING_DEPTH:
+        return [geometry]
+
+    min_x, min_y, max_x, max_y = geometry.bounds
+    mid_x, mid_y = (min_x + max_x) / 2, (min_y + max_y) / 2
+
+    quadrants = shapely.box(
+        [min_x, mid_x, min_x, mid_x],
+        [min_y, min_y, mid_y, mid_y],
+        [mid_x, max_x, mid_x, max_x],
+        [mid_y, mid_y, max_y, max_y],
+    )
+
+    quadrant_pieces = np.concatenate([
+        _get_polygonal_parts(quadrant_piece) for quadrant_piece in shapely.intersection(geometry, quadrants)
+    ])
+
+    if len(quadrant_pieces) == 0:
+        return [geometry]
+
+    # A piece can have more vertices than the polygon, where its edges cross the quadrant borders,
+    # so the split is only given up if the pieces of the next split don't have fewer vertices either
+    if shapely.get_num_coordinates(quadrant_pieces).max() >= num_vertices:
+        if stalled:
+            return [geometry]
+        stalled = True
+    else:
+        stalled = False
+
+    pieces = []
+
+    for piece in quadrant_pieces:
+        pieces.extend(tile_polygon(piece, max_vertices, depth + 1, stalled))
+
+    return pieces
+
+
+def tile_polygons(geometries, max_vertices):
+    """
+    Subdivides the polygons with more than max_vertices vertices into smaller pieces
+
+    :param geometries: array of shapely polygons
+    :param max_vertices: maximum number of vertices of each piece
+    :return: (array with the pieces, array with the position of the parent polygon of each piece)
+    """
+
+    pieces = []
+    parents = []
+
+    for parent, geometry in enumerate(geometries):
+
+        polygon_pieces = tile_polygon(geometry, max_vertices)
+
+        pieces.extend(polygon_pieces)
+        parents.extend([parent] * len(polygon_pieces))
+
+    logging.info(f"\tTiled {len(geometries)} polygons into {len(pieces)} pieces...")
+
+    return np.array(pieces, dtype=object), np.array(parents, dtype=np.int64)
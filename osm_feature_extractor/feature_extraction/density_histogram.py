@@ -0,0 +1,321 @@
+import json
+import os
+
+import numpy as np
+
+# Size of the cells of the histogram in degrees
+HISTOGRAM_RESOLUTION = 0.01
+
+# Number of cell counts buffered from the blocks of nodes before they are merged
+COMPACT_SIZE = 1 << 22
+
+
+def get_density_histogram_path(osm_extractor_files_dir, osm_file):
+    """
+    Gets the path of the density histogram of an osm file
+
+    :param osm_extractor_files_dir: path to extractor files data directory
+    :param osm_file: Path to the osm file
+    :return: path of the density histogram file
+    """
+
+    prefix = os.path.basename(osm_file).split('.')[0]
+
+    return os.path.join(osm_extractor_files_dir, f"{prefix}_density.npz")
+
+
+class DensityHistogram:
+    """
+    Sparse 2D histogram of the node locations in a fixed grid of cells of resolution degrees,
+    aligned with lng -180, lat -90. Only the cells with nodes are stored.
+
+    Nodes are added in blocks, whose cell counts are buffered and merged once the buffer
+    is large enough, so compact must be called before reading the cells.
+
+    Attributes:
+        resolution (float): size of the cells in degrees
+        keys (np.ndarray): keys of the cells with nodes, x index * number of rows + y index
+        counts (np.ndarray): number of nodes in each cell
+        bbox (np.ndarray): bounding box of the nodes [west, south, east, north]
+    """
+
+    def __init__(self, resolution=HISTOGRAM_RESOLUTION):
+
+        self.resolution = resolution
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.bbox = np.array([np.inf, np.inf, -np.inf, -np.inf])
+        self.pending = []
+
+    @property
+    def number_rows(self):
+        return int(np.ceil(180 / self.resolution)) + 1
+
+    @property
+    def total(self):
+        return int(self.counts.sum()) + sum(int(counts.sum()) for _, counts in self.pending)
+
+    def add(self, coords):
+        """
+        Adds a block of node locations
+
+        :param coords: array of shape (n, 2) with the lng, lat of the nodes
+        :return: None
+        """
+
+        if len(coords) == 0:
+            return
+
+        cells = np.floor((coords + [180, 90]) / self.resolution).astype(np.int64)
+
+        keys, counts = np.unique(cells[:, 0] * self.number_rows + cells[:, 1], return_counts=True)
+
+        self.pending.append((keys, counts))
+
+        self.bbox = np.concatenate([
+            np.minimum(self.bbox[:2], coords.min(axis=0)), np.maximum(self.bbox[2:], coords.max(axis=0))
+        ])
+
+        if sum(len(keys) for keys, _ in self.pending) >= COMPACT_SIZE:
+            self.compact()
+
+    def merge(self, other):
+        """
+        Adds the nodes of another histogram with the same resolution
+
+        :param other: DensityHistogram to be merged
+        :return: None
+        """
+
+        other.compact()
+
+        self.pending.append((other.keys, other.counts))
+
+        self.bbox = np.concatenate([
+            np.minimum(self.bbox[:2], other.bbox[:2]), np.maximum(self.bbox[2:], other.bbox[2:])
+        ])
+
+        self.compact()
+
+    def compact(self):
+        """
+        Merges the buffered cell counts
+
+        :return: None
+        """
+
+        if len(self.pending) == 0:
+            return
+
+        keys = np.concatenate([self.keys, *[keys for keys, _ in self.pending]])
+        counts = np.concatenate([self.counts, *[counts for _, counts in self.pending]])
+
+        self.keys, inverse = np.unique(keys, return_inverse=True)
+        self.counts = np.bincount(inverse, weights=counts).astype(np.int64)
+        self.pending = []
+
+    def get_cells(self):
+        """
+        :return: (x index, y index, number of nodes) of the cells with nodes
+        """
+
+        self.compact()
+
+        return self.keys // self.number_rows, self.keys % self.number_rows, self.counts
+
+    def save(self, path, signature):
+        """
+        Saves the histogram in a .npz file
+
+        :param path: path of the file
+        :param signature: signature of the osm file the histogram was computed from
+        :return: None
+        """
+
+        self.compact()
+
+        with open(f"{path}.tmp", "wb") as f:
+            np.savez(
+                f,
+                resolution=self.resolution,
+                keys=self.keys,
+                counts=self.counts,
+                bbox=self.bbox,
+                signature=json.dumps(signature),
+            )
+
+        os.replace(f"{path}.tmp", path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads a histogram saved with save
+
+        :param path: path of the file
+        :return: (DensityHistogram, signature of the osm file it was computed from)
+        """
+
+        with np.load(path) as data:
+
+            histogram = cls(float(data["resolution"]))
+            histogram.keys = data["keys"]
+            histogram.counts = data["counts"]
+            histogram.bbox = data["bbox"]
+
+            return histogram, json.loads(data["signature"].item())
+
+
+def _get_median_cut(cumulative, before, last):
+
+    # Position of the last weight of the first half of the part, of at least two weights
+    half = (cumulative[before + 1] + cumulative[last + 1]) / 2
+
+    median = np.searchsorted(cumulative[before + 2:last + 2], half) + before + 1
+
+    return int(min(median, last - 1))
+
+
+def _cut_weights(weights, number_parts, max_weight=np.inf):
+    """
+    Cuts a sequence of weights in consecutive parts of about the same weight, at the quantiles
+    of number_parts parts. Parts heavier than max_weight are then cut again at their weighted
+    median, until they are not heavier or have a single weight.
+
+    :param weights: array with the weights
+    :param number_parts: number of parts cut at the quantiles
+    :param max_weight: maximum weight of the parts with more than one weight
+    :return: sorted array with the position of the last weight of every part but the last one
+    """
+
+    cumulative = np.concatenate([[0], np.cumsum(weights)])
+    total = cumulative[-1]
+
+    quantiles = np.searchsorted(cumulative[1:], total * np.arange(1, number_parts) / number_parts)
+    ends = np.unique(quantiles[quantiles < len(weights) - 1]).tolist()
+
+    # Parts as (position of the last weight before the part, position of the last weight of the part)
+    parts = list(zip([-1, *ends], [*ends, len(weights) - 1]))
+    cuts = []
+
+    while parts:
+
+        before, last = parts.pop()
+        weight = cumulative[last + 1] - cumulative[before + 1]
+
+        if weight <= max_weight or last - before == 1:
+            cuts.append(last)
+            continue
+
+        median = _get_median_cut(cumulative, before, last)
+
+        parts.extend([(before, median), (median, last)])
+
+    return np.sort(cuts)[:-1]
+
+
+def _get_edges(values, cuts, resolution, offset, bounds):
+
+    # Divide at the upper edge of the last cell of each part
+    edges = (values[cuts] + 1) * resolution - offset
+
+    return np.concatenate([[bounds[0]], np.clip(edges, *bounds), [bounds[1]]])
+
+
+def split_bounds_by_density(histogram, max_nodes_box=5e6):
+    """
+    Divides the bounding box of the nodes in columns at the quantiles of the node density
+    histogram in the x direction, and each column in rows at the quantiles of the nodes of
+    the column in the y direction, so that the cells have about the same number of nodes.
+    The number of columns is the same as the one of split_bounds, and each column has as
+    many rows as needed for its cells to have at most max_nodes_box nodes.
+
+    Rows that still have more nodes are divided again at their weighted median, and columns
+    with a row of a single histogram cell with more nodes are divided in two columns at their
+    weighted median, so that only the cells of a single histogram cell can have more nodes.
+
+    :param histogram: DensityHistogram of the nodes
+    :param max_nodes_box: max number of nodes per cell
+    :return: [x divisions, list with the y divisions of each column] of the bounding box
+    """
+
+    x_cells, y_cells, counts = histogram.get_cells()
+
+    if len(counts) == 0:
+        return [np.array([-180.0, 180.0]), [np.array([-90.0, 90.0])]]
+
+    x_bounds, y_bounds = histogram.bbox[[0, 2]], histogram.bbox[[1, 3]]
+
+    x_values, x_inverse = np.unique(x_cells, return_inverse=True)
+    x_weights = np.bincount(x_inverse, weights=counts)
+    x_cumulative = np.concatenate([[0], np.cumsum(x_weights)])
+
+    number_columns = max(int(np.ceil(np.sqrt(counts.sum() / max_nodes_box))), 1)
+
+    x_cuts = _cut_weights(x_weights, number_columns)
+
+    # Columns as ranges [start, end) of positions of x_values
+    pending = list(zip([0, *(x_cuts + 1).tolist()], [*(x_cuts + 1).tolist(), len(x_values)]))
+    columns = {}
+
+    while pending:
+
+        start, end = pending.pop()
+
+        in_column = (x_inverse >= start) & (x_inverse < end)
+
+        y_values, y_inverse = np.unique(y_cells[in_column], return_inverse=True)
+        y_weights = np.bincount(y_inverse, weights=counts[in_column])
+
+        y_cuts = _cut_weights(y_weights, int(np.ceil(y_weights.sum() / max_nodes_box)), max_nodes_box)
+
+        row_weights = np.add.reduceat(y_weights, np.concatenate([[0], y_cuts + 1]).astype(np.int64))
+
+        if end - start > 1 and np.any(row_weights > max_nodes_box):
+            middle = _get_median_cut(x_cumulative, start - 1, end - 1) + 1
+            pending.extend([(start, middle), (middle, end)])
+            continue
+
+        columns[start] = _get_edges(y_values, y_cuts, histogram.resolution, 90, y_bounds)
+
+    starts = sorted(columns)
+
+    x_divisions = _get_edges(x_values, np.array(starts[1:], dtype=np.int64) - 1, histogram.resolution, 180, x_bounds)
+
+    return [x_divisions, [columns[start] for start in starts]]
+
+
+def count_shard_nodes(histogram, xy_divisions):
+    """
+    Counts the nodes of each cell of the split_bounds grid, locating the nodes of each
+    histogram cell at its center
+
+    :param histogram: DensityHistogram of the nodes
+    :param xy_divisions: [x divisions, list with the y divisions of each column] of the bounding box
+    :return: array with the number of nodes of each cell, in the order of get_shards
+    """
+
+    x_cells, y_cells, counts = histogram.get_cells()
+
+    x_centers = (x_cells + 0.5) * histogram.resolution - 180
+    y_centers = (y_cells + 0.5) * histogram.resolution - 90
+
+    x_divisions, y_divisions = xy_divisions
+    x_indexes = np.clip(np.searchsorted(x_divisions, x_centers, side="right") - 1, 0, len(x_divisions) - 2)
+
+    shard_counts = []
+
+    for x_index, column_divisions in enumerate(y_divisions):
+
+        in_column = x_indexes == x_index
+
+        y_indexes = np.clip(
+            np.searchsorted(column_divisions, y_centers[in_column], side="right") - 1,
+            0,
+            len(column_divisions) - 2,
+        )
+
+        shard_counts.append(
+            np.bincount(y_indexes, weights=counts[in_column], minlength=len(column_divisions) - 1)
+        )
+
+    return np.concatenate(shard_counts).astype(np.int64)
@@ -1,10 +1,91 @@
 import logging
 import os
+from array import array
+from functools import partial
+from multiprocessing import Pool
 
 import osmium
 import numpy as np
 from scipy import stats
 
+from osm_feature_extractor.feature_extraction.density_histogram import (
+    DensityHistogram,
+    get_density_histogram_path,
+)
+from osm_feature_extractor.feature_extraction.osm_locations import get_osm_file_signature
+from osm_feature_extractor.feature_extraction.pbf_reader import (
+    is_pbf_file,
+    read_blob_index,
+    read_blob,
+    decode_block_locations,
+    UnsupportedBlobError,
+)
+from osm_feature_extractor.utils.metrics import metrics, record_task
+
+
+BLOCK_SIZE = 1 << 16
+
+# Number of blob ranges per worker when a PBF file is analyzed in parallel, so that
+# the workers stay busy when the blobs take different times to decode
+RANGES_PER_WORKER = 4
+
+
+def get_empty_statistics():
+    """
+    :return: statistics of an empty set of nodes
+    """
+
+    return 0, np.zeros(2), np.zeros(2), np.array([np.inf, np.inf, -np.inf, -np.inf])
+
+
+def get_block_statistics(coords):
+    """
+    Computes the statistics of a block of node locations with NumPy reductions
+
+    :param coords: array of shape (n, 2) with the lng, lat of the nodes
+    :return: (number of nodes, centroid, sum of squared deviations from the centroid, bounding box)
+    """
+
+    if len(coords) == 0:
+        return get_empty_statistics()
+
+    centroid = coords.mean(axis=0)
+
+    return (
+        len(coords),
+        centroid,
+        ((coords - centroid) ** 2).sum(axis=0),
+        np.concatenate([coords.min(axis=0), coords.max(axis=0)]),
+    )
+
+
+def merge_statistics(statistics, other):
+    """
+    Merges the statistics of two sets of nodes, combining their centroids and
+    squared deviations with the pairwise update of Chan et al.
+
+    :param statistics: statistics of the first set of nodes
+    :param other: statistics of the second set of nodes
+    :return: statistics of the union of both sets
+    """
+
+    count, centroid, m2, bbox = statistics
+    other_count, other_centroid, other_m2, other_bbox = other
+
+    total = count + other_count
+
+    if total == 0:
+        return get_empty_statistics()
+
+    delta = other_centroid - centroid
+
+    return (
+        total,
+        centroid + delta * other_count / total,
+        m2 + other_m2 + delta ** 2 * count * other_count / total,
+        np.concatenate([np.minimum(bbox[:2], other_bbox[:2]), np.maximum(bbox[2:], other_bbox[2:])]),
+    )
+
 
 class OSMFileAnalyzer(osmium.SimpleHandler):
 
@@ -16,117 +97,273 @@ class OSMFileAnalyzer(osmium.SimpleHandler):
     - centroid
     - variance
 
+    The node locations are buffered in blocks of block_size nodes, and the metrics are
+    updated once per block with NumPy reductions, so finish must be called after the
+    file is applied to add the last block. If a DensityHistogram is given, the blocks
+    are also added to it.
+
     """
 
-    def __init__(self):
+    def __init__(self, block_size=BLOCK_SIZE, histogram=None):
         osmium.SimpleHandler.__init__(self)
 
-        self.nodes_counter = 0
         self.ways_counter = 0
-        self.bbox = [np.inf, np.inf, -np.inf, -np.inf]
-        self.centroid = [0, 0]
-        self.previous_centroid = [0, 0]
-        self.variance = [0, 0]
+        self.block_size = block_size
+        self.histogram = histogram
+        self.block = array("d")
+        self.statistics = get_empty_statistics()
 
     def node(self, n):
 
-        coords = [n.location.lon, n.location.lat]
-
-        if self.nodes_counter % 1e6 == 0:
-            logging.debug(f"\t\tProcessed {self.nodes_counter} nodes")
-
-        self.nodes_counter += 1
-
-        self.previous_centroid = self.centroid
+        location = n.location
 
-        self.centroid = [
-            self.update_centroid(self.centroid[0], coords[0]),
-            self.update_centroid(self.centroid[1], coords[1]),
-        ]
+        self.block.extend((location.lon, location.lat))
 
-        self.variance = [
-            self.update_std(
-                self.variance[0], self.previous_centroid[0], self.centroid[0], coords[0]
-            ),
-            self.update_std(
-                self.variance[1], self.previous_centroid[1], self.centroid[1], coords[1]
-            ),
-        ]
-
-        self.bbox = self.update_bbox(self.bbox, coords)
+        if len(self.block) >= 2 * self.block_size:
+            self.reduce_block()
 
     def way(self, _):
         self.ways_counter += 1
 
-    def update_centroid(self, previous, new):
+    def reduce_block(self):
         """
-        Updates centroid iteratively
+        Updates the metrics with the buffered node locations and empties the buffer
 
-        :param previous: previous centroid
-        :param new: new point
-        :return: updated centroid
+        :return: None
         """
 
-        return previous + (new - previous) / self.nodes_counter
+        coords = np.frombuffer(self.block, dtype=np.float64).reshape(-1, 2)
 
-    @staticmethod
-    def update_std(previous_variance, previous_mean, new_mean, new_point):
-        """
-        Updates variance iteratively
+        self.statistics = merge_statistics(self.statistics, get_block_statistics(coords))
 
-        :param previous_variance: previous variance
-        :param previous_mean: previous centroid
-        :param new_mean: new centroid
-        :param new_point: new point
-        :return: updated variance
-        """
+        if self.histogram is not None:
+            self.histogram.add(coords)
 
-        variance = previous_variance + (new_point - previous_mean) * (new_point - new_mean)
+        logging.debug(f"\t\tProcessed {self.nodes_counter} nodes")
 
-        return variance
+        self.block = array("d")
 
-    @staticmethod
-    def update_bbox(bounding_box, coords):
+    def finish(self):
+        self.reduce_block()
 
-        """
-        Updates bounding box containing all nodes
+    @property
+    def nodes_counter(self):
+        return self.statistics[0]
 
-        :param bounding_box: current bounding box
-        :param coords: new point coordinates
-        :return: updated bounding box
-        """
+    @property
+    def bbox(self):
+        return self.statistics[3].tolist()
 
-        if bounding_box[0] > coords[0]:
-            bounding_box[0] = coords[0]
-        if bounding_box[1] > coords[1]:
-            bounding_box[1] = coords[1]
-        if bounding_box[2] < coords[0]:
-            bounding_box[2] = coords[0]
-        if bounding_box[3] < coords[1]:
-            bounding_box[3] = coords[1]
+    @property
+    def centroid(self):
+        return self.statistics[1].tolist()
 
-        return bounding_box
+    @property
+    def variance(self):
+        return self.statistics[2].tolist()
 
 
-def analyze_osm_file(osm_file):
+def analyze_pbf_blobs(osm_file, blobs, histogram=None):
+    """
+    Computes the node statistics and counts the ways of blobs of a PBF file, decoding
+    only the node locations of each blob and reducing them with NumPy
+
+    :param osm_file: Path to the PBF file
+    :param blobs: BlobInfo of the blobs to be analyzed
+    :param histogram: DensityHistogram where the node locations are also added, if any
+    :return: (node statistics, number of ways)
     """
-    Method that wraps the calls to the OSMAnalyzer class and
-    returns the results
+
+    statistics = get_empty_statistics()
+    ways_counter = 0
+
+    with open(osm_file, "rb") as f:
+
+        for blob in blobs:
+
+            if blob.type != "OSMData":
+                continue
+
+            coords, ways = decode_block_locations(read_blob(f, blob))
+
+            statistics = merge_statistics(statistics, get_block_statistics(coords))
+            ways_counter += ways
+
+            if histogram is not None:
+                histogram.add(coords)
+
+    return statistics, ways_counter
+
+
+def _analyze_blob_range(args):
+
+    osm_file, blobs, resolution = args
+
+    histogram = DensityHistogram(resolution) if resolution is not None else None
+
+    statistics, ways_counter = analyze_pbf_blobs(osm_file, blobs, histogram)
+
+    if histogram is not None:
+        histogram.compact()
+
+    return statistics, ways_counter, histogram
+
+
+def analyze_pbf_blobs_parallel(osm_file, blobs, workers, histogram=None):
+    """
+    Splits the blobs of a PBF file in contiguous ranges which are analyzed in a pool of
+    worker processes, and merges the partial statistics of the ranges in file order
+
+    :param osm_file: Path to the PBF file
+    :param blobs: BlobInfo of the blobs to be analyzed
+    :param workers: number of worker processes
+    :param histogram: DensityHistogram where the node locations are also added, if any
+    :return: (node statistics, number of ways)
+    """
+
+    data_blobs = [blob for blob in blobs if blob.type == "OSMData"]
+
+    number_ranges = min(workers * RANGES_PER_WORKER, len(data_blobs))
+
+    if workers <= 1 or number_ranges <= 1:
+        return analyze_pbf_blobs(osm_file, data_blobs, histogram)
+
+    bounds = np.linspace(0, len(data_blobs), number_ranges + 1).astype(int)
+
+    resolution = histogram.resolution if histogram is not None else None
+
+    tasks = [(osm_file, data_blobs[start:end], resolution) for start, end in zip(bounds[:-1], bounds[1:])]
+
+    logging.info(f"\tAnalyzing {len(data_blobs)} blobs in {number_ranges} ranges with {workers} workers...")
+
+    statistics = get_empty_statistics()
+    ways_counter = 0
+
+    with Pool(workers) as pool:
+
+        results = pool.imap(partial(record_task, _analyze_blob_range), tasks)
+
+        for (range_statistics, range_ways, range_histogram), worker_stages in results:
+
+            metrics.merge(worker_stages)
+
+            statistics = merge_statistics(statistics, range_statistics)
+            ways_counter += range_ways
+
+            if histogram is not None:
+                histogram.merge(range_histogram)
+
+    return statistics, ways_counter
+
+
+def analyze_osm_file(osm_file, histogram=None, workers=1):
+    """
+    Method that computes the metrics of an osm file. PBF files are analyzed blob by
+    blob, in ranges of blobs processed in parallel if workers is larger than 1, and
+    other formats with the OSMAnalyzer class.
 
     :param osm_file: Path to the osm file
-    :return: (number of nodes, bounding box, centroid, standard deviation)
+    :param histogram: DensityHistogram where the node locations are also added, if any
+    :param workers: number of worker processes used for PBF files
+    :return: (number of nodes, number of ways, bounding box, centroid, standard deviation)
     """
 
-    osm_handler = OSMFileAnalyzer()
-    osm_handler.apply_file(osm_file)
+    statistics = None
+
+    if is_pbf_file(osm_file):
+        # Blocks are only added to the histogram once all blobs could be decoded
+        pbf_histogram = DensityHistogram(histogram.resolution) if histogram is not None else None
+
+        try:
+            statistics, ways_counter = analyze_pbf_blobs_parallel(
+                osm_file, read_blob_index(osm_file), workers, pbf_histogram
+            )
+        except UnsupportedBlobError as e:
+            logging.info(f"\t{e}, analyzing the file with osmium...")
+        else:
+            if histogram is not None:
+                histogram.merge(pbf_histogram)
+
+    if statistics is None:
+        osm_handler = OSMFileAnalyzer(histogram=histogram)
+        osm_handler.apply_file(osm_file)
+        osm_handler.finish()
+
+        statistics, ways_counter = osm_handler.statistics, osm_handler.ways_counter
+
+    nodes_counter, centroid, variance, bbox = statistics
 
     std = [
-        np.sqrt(osm_handler.variance[0] / osm_handler.nodes_counter),
-        np.sqrt(osm_handler.variance[1] / osm_handler.nodes_counter),
+        np.sqrt(variance[0] / nodes_counter),
+        np.sqrt(variance[1] / nodes_counter),
     ]
 
-    return (osm_handler.nodes_counter, osm_handler.ways_counter,
-            osm_handler.bbox, osm_handler.centroid, std)
+    return nodes_counter, ways_counter, bbox.tolist(), centroid.tolist(), std
+
+
+def get_density_histogram(osm_file, osm_extractor_files_dir=None, workers=1):
+    """
+    Gets the node density histogram of an osm file, analyzing the file only if there is
+    no histogram saved under osm_extractor_files_dir from its current version
+
+    :param osm_file: Path to the osm file
+    :param osm_extractor_files_dir: path to extractor files data directory
+    :param workers: number of worker processes used to analyze the file
+    :return: DensityHistogram
+    """
+
+    if osm_extractor_files_dir is None:
+        histogram = DensityHistogram()
+        analyze_osm_file(osm_file, histogram, workers)
+
+        return histogram
+
+    path = get_density_histogram_path(osm_extractor_files_dir, osm_file)
+    signature = get_osm_file_signature(osm_file)
+
+    if os.path.exists(path):
+        histogram, histogram_signature = DensityHistogram.load(path)
+
+        if histogram_signature == signature:
+            logging.info(f"\tReusing node density histogram {path}...")
+            return histogram
+
+    logging.info("\tAnalyzing OSM file node density...")
+
+    histogram = DensityHistogram()
+    analyze_osm_file(osm_file, histogram, workers)
+    histogram.save(path, signature)
+
+    return histogram
+
+
+def analyze_osm_header(osm_file):
+    """
+    Reads the bounding box stored in the header of the osm file and counts the blobs of a
+    PBF file from their headers, without decoding any osm object
+
+    :param osm_file: Path to the osm file
+    :return: (bounding box or None if it is not in the header, number of data blobs, size of the data blobs)
+    """
+
+    reader = osmium.io.Reader(osm_file, osmium.osm.NOTHING)
+
+    try:
+        box = reader.header().box()
+    finally:
+        reader.close()
+
+    bbox = None
+
+    if box.valid():
+        bbox = [box.bottom_left.lon, box.bottom_left.lat, box.top_right.lon, box.top_right.lat]
+
+    if not is_pbf_file(osm_file):
+        return bbox, None, None
+
+    data_blobs = [blob for blob in read_blob_index(osm_file) if blob.type == "OSMData"]
+
+    return bbox, len(data_blobs), sum(blob.data_size for blob in data_blobs)
 
 
 def split_bounds(number_nodes, bbox, centroid, std, max_nodes_box=5e6):
@@ -1,6 +1,10 @@
 from abc import ABC
+from array import array
 from collections import namedtuple
 from typing import List, Dict
+
+import numpy as np
+import shapely
 from shapely.geometry import Point, LineString, Polygon
 
 SimpleNode = namedtuple("Node", ("id", "coordinates", "tags"))
@@ -85,3 +89,106 @@ class Area:
 
     def __getinitargs__(self):
         return self.id, self.polygon.exterior.coords, self.nodes, self.tags
+
+
+class ObjectBatch:
+    """
+    Compact batch of osm objects of one geometry kind, stored in flat arrays. Objects
+    don't keep their tags, only the feature columns they contribute to, and their geometries
+    are only created when needed, in bulk.
+
+    Attributes:
+        geometry_kind (str): one of node, way or area
+        ids (array): ids of the objects
+        versions (array): versions of the objects
+        columns (array): feature columns of all objects, concatenated
+        column_offsets (array): start of the feature columns of each object in columns
+        coords (array): coordinates of all objects, concatenated as lng, lat pairs
+        coord_offsets (array): start of the points of each object in coords
+    """
+
+    __slots__ = (
+        "geometry_kind",
+        "ids",
+        "versions",
+        "columns",
+        "column_offsets",
+        "coords",
+        "coord_offsets",
+    )
+
+    # Minimum number of points of a valid geometry of each kind
+    min_points = {"node": 1, "way": 2, "area": 4}
+
+    def __init__(self, geometry_kind):
+
+        self.geometry_kind = geometry_kind
+        self.ids = array("q")
+        self.versions = array("q")
+        self.columns = array("q")
+        self.column_offsets = array("q", [0])
+        self.coords = array("d")
+        self.coord_offsets = array("q", [0])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def append(self, id_, version, columns, coords):
+        """
+        Adds an object to the batch. Objects without feature columns or with too few
+        points for their geometry kind are skipped.
+
+        :param id_: ID of the object
+        :param version: version of the object
+        :param columns: feature columns of the object
+        :param coords: flat sequence of coordinates lng, lat of the object
+        :return: True if the object was added, False otherwise
+        """
+
+        if len(columns) == 0 or len(coords) < 2 * self.min_points[self.geometry_kind]:
+            return False
+
+        self.ids.append(id_)
+        self.versions.append(version)
+        self.columns.extend(columns)
+        self.column_offsets.append(len(self.columns))
+        self.coords.extend(coords)
+        self.coord_offsets.append(len(self.coords) // 2)
+
+        return True
+
+    def get_columns(self):
+        """
+        :return: (offsets of the feature columns of each object, concatenated feature columns)
+        """
+
+        return np.array(self.column_offsets, dtype=np.int64), np.array(self.columns, dtype=np.int64)
+
+    def get_coordinates(self):
+        """
+        :return: (offsets of the points of each object, array of shape (n, 2) with all the points)
+        """
+
+        return (
+            np.array(self.coord_offsets, dtype=np.int64),
+            np.array(self.coords, dtype=np.float64).reshape(-1, 2),
+        )
+
+    def geometries(self):
+        """
+        Creates the geometries of all objects in bulk
+
+        :return: array of shapely Points, LineStrings or Polygons
+        """
+
+        coord_offsets, coords = self.get_coordinates()
+
+        if self.geometry_kind == "node":
+            return shapely.points(coords)
+
+        indices = np.repeat(np.arange(len(self)), np.diff(coord_offsets))
+
+        if self.geometry_kind == "way":
+            return shapely.linestrings(coords, indices=indices)
+
+        return shapely.polygons(shapely.linearrings(coords, indices=indices))
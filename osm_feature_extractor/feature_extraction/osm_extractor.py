@@ -1,8 +1,13 @@
 import logging
 import os
 import pickle
+import time
+from bisect import bisect_right
 from typing import Sequence
 
+# Time when the processing of each type of osm object started, to log the processing rates
+_status_start = {}
+
 
 def in_bbox(point: Sequence, bbox: Sequence):
     """
@@ -15,6 +20,42 @@ def in_bbox(point: Sequence, bbox: Sequence):
     return bbox[0] <= point[0] <= bbox[2] and bbox[1] <= point[1] <= bbox[3]
 
 
+def get_shard(point: Sequence, xy_divisions: Sequence):
+    """
+    Finds the cell of the split_bounds grid a point belongs to. Points outside
+    the grid are assigned to the closest cell, so that every point belongs to exactly one cell
+
+    :param point: point coordinates [lng, lat]
+    :param xy_divisions: [x divisions, list with the y divisions of each column] of the bounding box
+    :return: (x index, y index) of the cell
+    """
+
+    x_divisions, y_divisions = xy_divisions[0], xy_divisions[1]
+
+    x_index = min(max(bisect_right(x_divisions, point[0]) - 1, 0), len(x_divisions) - 2)
+
+    column_divisions = y_divisions[x_index]
+
+    y_index = min(max(bisect_right(column_divisions, point[1]) - 1, 0), len(column_divisions) - 2)
+
+    return x_index, y_index
+
+
+def get_shards(xy_divisions: Sequence):
+    """
+    Lists the cells of the split_bounds grid
+
+    :param xy_divisions: [x divisions, list with the y divisions of each column] of the bounding box
+    :return: list with the (x index, y index) of every cell
+    """
+
+    return [
+        (x_index, y_index)
+        for x_index, column_divisions in enumerate(xy_divisions[1])
+        for y_index in range(len(column_divisions) - 1)
+    ]
+
+
 def check_status(count, obj_name):
     """
     Checks status of the osm file processing and prints status
@@ -24,10 +65,12 @@ def check_status(count, obj_name):
     """
 
     if count == 0:
+        _status_start[obj_name] = time.perf_counter()
         logging.info(f"\t\tProcessing {obj_name}...")
 
     elif count % 100000 == 0:
-        logging.info(f"\t\t\tProcessed {count} {obj_name}...")
+        rate = count / (time.perf_counter() - _status_start[obj_name])
+        logging.info(f"\t\t\tProcessed {count} {obj_name} ({rate:.0f} {obj_name}/s)...")
 
 
 def load_osm_data(osm_data_dir):
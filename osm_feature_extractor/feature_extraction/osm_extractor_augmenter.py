@@ -1,136 +1,277 @@
 import logging
-import os
 
 import osmium
-from shapely.geometry import MultiPoint
 
 from osm_feature_extractor.feature_augmenting.features_to_tags import node_tags, way_tags, area_tags
-from osm_feature_extractor.feature_extraction.osm_datamodel import Node, Way, SimpleNode, Area
+from osm_feature_extractor.feature_augmenting.features_table import get_feature_columns
+from osm_feature_extractor.feature_extraction.osm_datamodel import ObjectBatch
 from osm_feature_extractor.feature_augmenting.features_augmenter import (
     match_nodes_to_polygon,
     match_ways_to_polygon,
-    load_r_tree,
-    match_areas_to_polygon)
-from osm_feature_extractor.feature_extraction.osm_extractor import check_status
+    match_areas_to_polygon,
+    log_match_counters)
+from osm_feature_extractor.feature_augmenting.feature_accumulator import FeatureAccumulator
+from osm_feature_extractor.feature_augmenting.contribution_store import ContributionStore
+from osm_feature_extractor.feature_extraction.osm_extractor import check_status, get_shard
+from osm_feature_extractor.feature_extraction.osm_locations import apply_osm_file
+from osm_feature_extractor.feature_extraction.pbf_reader import (
+    count_pbf_objects,
+    is_pbf_file,
+    read_blob_index,
+    UnsupportedBlobError,
+)
+from osm_feature_extractor.utils.metrics import metrics
+
+BATCH_SIZE = 10000
+
+
+def get_tag_filters():
+    """
+    Builds the osmium filters that only let through the nodes and ways carrying any of the
+    tags being extracted, so that all other objects never reach the python callbacks. The node
+    locations are still stored for all nodes, since the location handler runs before the filters.
+
+    :return: list of osmium filters
+    """
+
+    return [
+        osmium.filter.KeyFilter(*node_tags).enable_for(osmium.osm.NODE),
+        osmium.filter.KeyFilter(*way_tags, *area_tags).enable_for(osmium.osm.WAY),
+    ]
+
+
+class ObjectCounter(osmium.SimpleHandler):
+    """
+    Counts the nodes and ways read from an osm file, when applied before the tag filters.
+    """
+
+    def __init__(self, nodes_counter=0, ways_counter=0):
+        osmium.SimpleHandler.__init__(self)
+
+        self.nodes_counter = nodes_counter
+        self.ways_counter = ways_counter
+
+    def node(self, n):
+        self.nodes_counter += 1
+
+    def way(self, w):
+        self.ways_counter += 1
+
+
+def get_object_counter(osm_file, blobs=None):
+    """
+    Counts the nodes and ways of an osm file, or of some blobs of a PBF file. The objects of a PBF
+    file are counted from its blobs, which is much faster than a python callback for every object.
+    Otherwise, or if its blobs can't be decompressed, the returned ObjectCounter counts the objects
+    once it is applied before the tag filters.
+
+    :param osm_file: Path to the osm file
+    :param blobs: BlobInfo of the blobs to be counted. All the blobs of the file if None
+    :return: (ObjectCounter, list of the handlers to be applied before the tag filters)
+    """
+
+    if is_pbf_file(osm_file):
+        try:
+            with open(osm_file, "rb") as f:
+                counts = count_pbf_objects(f, blobs if blobs is not None else read_blob_index(osm_file))
+        except UnsupportedBlobError as e:
+            logging.info(f"\t{e}, counting the objects with osmium...")
+        else:
+            return ObjectCounter(*counts), []
+
+    object_counter = ObjectCounter()
+
+    return object_counter, [object_counter]
 
 
 class OSMFileHandler(osmium.SimpleHandler):
     """
     Main OSM file processor. Takes an osm file and parses every node and way, checking
     if they belong to any of the specified tags, and if so, passes the node / way to
-    the respective feature augmenter, which will in turn map those objects to the geojson
-    containing the polygon(s) of the area in study.
+    the respective feature augmenter, which will in turn map those objects to the polygon(s)
+    of the area in study, accumulating their features.
+
+    Objects are buffered in ObjectBatches and matched in batches of batch_size objects, so
+    flush must be called after the file is applied to match the remaining objects.
+
+    If a ContributionStore is given, every value added to the features is also recorded in it.
+
+    If a shard of the split_bounds grid is given, only the nodes located in that cell and the
+    ways whose first node is located in that cell are processed.
 
     """
 
     def __init__(
         self,
-        polygons,
-        r_tree_index,
-        invalid_location_nodes=None,
-        invalid_location_ways=None,
+        polygon_index,
+        accumulator=None,
+        xy_divisions=None,
+        shard=None,
+        batch_size=BATCH_SIZE,
+        store=None,
     ):
         osmium.SimpleHandler.__init__(self)
 
         self.nodes_counter = 0
         self.ways_counter = 0
-        self.invalid_location_nodes = (
-            invalid_location_nodes if invalid_location_nodes else set()
-        )
-        self.incomplete_ways = (
-            invalid_location_ways if invalid_location_ways else set()
-        )
-        self.polygons = polygons
-        self.r_tree_index = r_tree_index
-        self.nodes = {}
-        self.convex_hull = []
+        self.polygon_index = polygon_index
+        self.accumulator = accumulator if accumulator else FeatureAccumulator(len(polygon_index), store)
+        self.xy_divisions = xy_divisions
+        self.shard = shard
+        self.batch_size = batch_size
+        self.batches = {geometry_kind: ObjectBatch(geometry_kind) for geometry_kind in ["node", "way", "area"]}
+        self.matchers = {
+            "node": match_nodes_to_polygon,
+            "way": match_ways_to_polygon,
+            "area": match_areas_to_polygon,
+        }
+
+    def owns(self, coords):
+        """
+        Checks if an object located at coords belongs to the shard being processed
+
+        :param coords: coordinates of the object [lng, lat]
+        :return: True if the object should be processed by this handler, False otherwise
+        """
+
+        return self.shard is None or get_shard(coords, self.xy_divisions) == self.shard
 
     def node(self, n):
 
-        coords = [n.location.lon, n.location.lat]
+        coords = (n.location.lon, n.location.lat)
 
-        tags = {**{"version": n.version}, **{tag.k: tag.v for tag in n.tags}}
+        if not self.owns(coords):
+            return
 
         check_status(self.nodes_counter, "nodes")
 
         self.nodes_counter += 1
 
-        node = Node(n.id, coords, tags=tags)
+        self.add_node(n.id, n.version, n.tags, [tag.k for tag in n.tags], coords)
 
-        existing_tags = set(tags).intersection(node_tags)
+    def way(self, w):
 
-        if len(existing_tags) != 0:
-            self.polygons = match_nodes_to_polygon(
-                existing_tags, [node], self.r_tree_index, self.polygons
-            )
+        nodes = w.nodes
 
-    def way(self, w):
+        if len(nodes) == 0:
+            return
+
+        try:
+            coords = [c for n in nodes for c in (n.lon, n.lat)]
+        except osmium.InvalidLocationError:
+            return
+
+        if not self.owns(coords[:2]):
+            return
 
         check_status(self.ways_counter, "ways")
 
         self.ways_counter += 1
 
-        if any(tag in w.tags for tag in {*way_tags, *area_tags}):
+        self.add_way(
+            w.id, w.version, w.tags, [tag.k for tag in w.tags], nodes[0].ref == nodes[-1].ref, coords
+        )
 
-            tags = {**{"version": w.version}, **{tag.k: tag.v for tag in w.tags}}
+    def add_node(self, node_id, version, tags, tag_keys, coords):
+        """
+        Adds a node to the nodes batch if it has any of the tags being extracted
 
-            nodes = [node.ref for node in w.nodes]
+        :param node_id: id of the node
+        :param version: version of the node
+        :param tags: mapping of the node tags
+        :param tag_keys: keys of the node tags
+        :param coords: coordinates of the node (lng, lat)
+        :return: None
+        """
+
+        tag_ids = [tag for tag in tag_keys if tag in node_tags]
+
+        if len(tag_ids) != 0:
+            self.add_to_batch(
+                "node", node_id, version, get_feature_columns(tags, tag_ids, "node"), coords
+            )
+
+    def add_way(self, way_id, version, tags, tag_keys, is_closed, coords):
+        """
+        Adds a way to the ways batch, or to the areas batch if it is closed, if it
+        has any of the tags being extracted
+
+        :param way_id: id of the way
+        :param version: version of the way
+        :param tags: mapping of the way tags
+        :param tag_keys: keys of the way tags
+        :param is_closed: if the first and last nodes of the way are the same
+        :param coords: flat sequence of coordinates lng, lat of the way nodes
+        :return: None
+        """
+
+        if is_closed:
+            geometry_kind, object_tags = "area", area_tags
+        else:
+            geometry_kind, object_tags = "way", way_tags
 
-            try:
-                coords = [[n.lon, n.lat] for n in w.nodes]
-            except osmium.InvalidLocationError:
-                return
+        tag_ids = [
+            tag for tag in tag_keys
+            if tag in object_tags and not self.check_for_mutually_exclusive(tag, tags)
+        ]
 
-            if nodes[0] == nodes[-1]:
-                for tag_id in area_tags:
-                    if tag_id in tags:
-                        self.process_area(w, tag_id, tags, nodes, coords)
-            else:
-                for tag_id in way_tags:
-                    if tag_id in tags:
-                        self.process_way(w, tag_id, tags, nodes, coords)
+        if len(tag_ids) != 0:
+            self.add_to_batch(
+                geometry_kind, way_id, version, get_feature_columns(tags, tag_ids, geometry_kind), coords
+            )
 
-    def process_way(self, w, tag_id, tags, nodes, coords):
+    def add_to_batch(self, geometry_kind, object_id, version, columns, coords):
         """
-        Creates a Way object and sends it to the feature augmenter for ways
+        Adds an osm object to a batch, and matches the batch to the polygons if it is full
 
-        :param w: osm way object
-        :param tag_id: tag being analysed
-        :param tags: osm object tags
-        :param nodes: nodes belonging to way
-        :param coords: coordinates of nodes in way
+        :param geometry_kind: one of node, way or area
+        :param object_id: id of the osm object
+        :param version: version of the osm object
+        :param columns: feature columns of the object
+        :param coords: flat sequence of coordinates lng, lat of the object
         :return: None
         """
 
-        if self.check_for_mutually_exclusive(tag_id, tags):
-            return
+        batch = self.batches[geometry_kind]
 
-        way = Way(w.id, coords, nodes, tags=tags)
+        batch.append(object_id, version, columns, coords)
 
-        self.polygons = match_ways_to_polygon(
-            [tag_id], [way], self.r_tree_index, self.polygons
-        )
+        if len(batch) >= self.batch_size:
+            self.flush(geometry_kind)
 
-    def process_area(self, a, tag_id, tags, nodes, coords):
+    def flush(self, *geometry_kinds):
+        """
+        Matches the buffered osm objects to the polygons
 
+        :param geometry_kinds: batches to be matched. All batches are matched if none is given
+        :return: None
         """
-       Creates an Area object and sends it to the feature augmenter for areas
 
-       :param a: osm area object
-       :param tag_id: tag being analysed
-       :param tags: osm object tags
-       :param nodes: nodes belonging to area
-       :param coords: coordinates of nodes in area
-       :return: None
-       """
+        for geometry_kind in geometry_kinds or self.batches:
 
-        if self.check_for_mutually_exclusive(tag_id, tags):
-            return
+            batch = self.batches[geometry_kind]
+
+            if len(batch) == 0:
+                continue
+
+            with metrics.stage("matching"):
+                self.accumulator = self.matchers[geometry_kind](
+                    batch, self.polygon_index, self.accumulator
+                )
 
-        area = Area(a.id, coords, nodes, tags=tags)
+            self.batches[geometry_kind] = ObjectBatch(geometry_kind)
+
+    def count_objects_read(self, object_counter):
+        """
+        Adds the number of nodes and ways read from the file, before the tag filters, to the
+        counters of the accumulator
 
-        self.polygons = match_areas_to_polygon(
-            [tag_id], [area], self.r_tree_index, self.polygons
+        :param object_counter: ObjectCounter of the objects read
+        :return: None
+        """
+
+        self.accumulator.counters.update(
+            nodes_read=object_counter.nodes_counter, ways_read=object_counter.ways_counter
         )
 
     @staticmethod
@@ -143,21 +284,44 @@ class OSMFileHandler(osmium.SimpleHandler):
             return False
 
 
-def extract_features_augment(osm_file, polygons, r_tree_path):
+def extract_features_augment(
+    osm_file,
+    polygon_index,
+    location_index="flex_mem",
+    osm_extractor_files_dir=None,
+    contribution_store=None,
+):
     """
     Method that wraps the calls to the OSMFileHandler class and returns the results
 
     :param osm_file: Path to the osm file
-    :param polygons: GeoJSON object with polygons to be mapped
-    :param r_tree_path: path to the RTree index files
-    :return: mapped polygons
+    :param polygon_index: PolygonIndex of the polygons to be mapped
+    :param location_index: type of node location index
+    :param osm_extractor_files_dir: path to extractor files data directory
+    :param contribution_store: path of the contribution store, if the contributions should be recorded
+    :return: FeatureAccumulator with the features of the polygons
     """
 
-    r_tree_index = load_r_tree(r_tree_path)
-
     logging.info(f"\tParsing OSM file: {osm_file}...")
 
-    osm_handler = OSMFileHandler(polygons, r_tree_index)
-    osm_handler.apply_file(osm_file, locations=True, idx='flex_mem')
+    store = None
+
+    if contribution_store is not None:
+        store = ContributionStore(contribution_store)
+        store.reset(polygon_index.ids)
+
+    osm_handler = OSMFileHandler(polygon_index, store=store)
+    object_counter, counter_handlers = get_object_counter(osm_file)
+
+    apply_osm_file(
+        osm_handler, osm_file, [*counter_handlers, *get_tag_filters()], location_index, osm_extractor_files_dir
+    )
+    osm_handler.flush()
+    osm_handler.count_objects_read(object_counter)
+
+    log_match_counters(osm_handler.accumulator.counters)
+
+    if store is not None:
+        store.close()
 
-    return osm_handler.polygons
+    return osm_handler.accumulator
@@ -4,18 +4,63 @@ import pickle
 from collections import defaultdict
 
 import osmium
-from ordered_set import OrderedSet
 
-from osm_feature_extractor.feature_augmenting.features_to_tags import node_tags, way_tags
-from osm_feature_extractor.feature_extraction.osm_datamodel import Node, SimpleNode, Way
+from osm_feature_extractor.feature_augmenting.features_to_tags import node_tags, way_tags, area_tags
+from osm_feature_extractor.feature_extraction.osm_datamodel import Node, Way, Area
 from osm_feature_extractor.feature_extraction.osm_extractor import (
     in_bbox,
+    get_shard,
     check_status,
 )
+from osm_feature_extractor.feature_extraction.osm_extractor_augmenter import (
+    OSMFileHandler as AugmenterFileHandler,
+)
+
+
+def add_to_tags(objects, osm_object, tags, object_tags):
+    """
+    Adds an osm object to the lists of every tag being extracted that it has
+
+    :param objects: dict with lists of osm objects by tag
+    :param osm_object: Node, Way or Area to be added
+    :param tags: tags of the osm object
+    :param object_tags: tags being extracted for this kind of object
+    :return: None
+    """
+
+    for tag_id in object_tags:
+
+        if tag_id in tags and not AugmenterFileHandler.check_for_mutually_exclusive(tag_id, tags):
+            objects[tag_id].append(osm_object)
 
 
 class OSMFileHandler(osmium.SimpleHandler):
-    def __init__(self, bounds=None, missing_edges=None, way_edges=None, batch=None):
+    """
+    Processes the objects of one batch of the osm file, the nodes inside the batch bounds and the
+    parts of the ways inside them, grouped by tag in Node, Way and Area objects.
+
+    The batch is either a cell of the split_bounds grid, given by batch and xy_divisions, where
+    every node belongs to exactly one cell, or the bounding box given by bounds.
+
+    Ways that cross the batch border are split in the pieces inside the bounds. Each border edge,
+    with only one node inside the bounds, is recorded in border_edges with the coordinates of that
+    node, and the edges recorded by the batches processed before, given in missing_edges, are
+    completed and included in the pieces. Closed ways that cross the border are recorded in
+    border_areas with the coordinates of their nodes inside the bounds, to be completed once all
+    batches are processed.
+
+    Attributes:
+        all_nodes (dict): coordinates of the nodes inside the bounds
+        border_edges (dict): coordinates by node id of the border edges, by (way id, node id, node id).
+            Edges with the coordinates of both nodes were completed by this batch
+        border_ways (dict): tags of the ways with border edges
+        border_areas (dict): (tags, node ids, coordinates by node id) of the closed ways crossing the border
+        way_edges (dict): edges of the ways that were already included, by way id
+    """
+
+    def __init__(
+        self, bounds=None, missing_edges=None, way_edges=None, batch=None, xy_divisions=None
+    ):
         osmium.SimpleHandler.__init__(self)
 
         self.all_nodes = {}
@@ -23,143 +68,169 @@ class OSMFileHandler(osmium.SimpleHandler):
         self.ways_counter = 0
         self.ways = dict(**{tag: [] for tag in way_tags})
         self.nodes = dict(**{tag: [] for tag in node_tags})
+        self.areas = dict(**{tag: [] for tag in area_tags})
         self.bounds = bounds if bounds else [-180, -90, 180, 90]
-        self.border_edges = missing_edges if missing_edges else defaultdict(lambda: {})
+        self.missing_edges = missing_edges if missing_edges else {}
+        self.border_edges = {}
+        self.border_ways = {}
+        self.border_areas = {}
         self.way_edges = way_edges if way_edges else defaultdict(lambda: set())
         self.batch = batch
+        self.xy_divisions = xy_divisions
 
-    def node(self, n):
+    def in_batch(self, coords):
+
+        if self.xy_divisions is None:
+            return in_bbox(coords, self.bounds)
 
-        coords = [n.location.lon, n.location.lat]
+        return get_shard(coords, self.xy_divisions) == self.batch
 
-        if not in_bbox(coords, self.bounds):
+    def node(self, n):
+
+        if not n.location.valid():
             return
 
-        check_status(self.nodes_counter, "nodes")
+        coords = (n.location.lon, n.location.lat)
 
-        tags = dict(version=n.version, **{tag.k: tag.v for tag in n.tags},)
+        if not self.in_batch(coords):
+            return
 
-        node = SimpleNode(n.id, coords, tags=tags)
+        check_status(self.nodes_counter, "nodes")
 
-        self.all_nodes[node.id] = node
+        self.nodes_counter += 1
 
-        for tag in node_tags:
+        self.all_nodes[n.id] = coords
 
-            if tag in tags:
-                node = Node(n.id, coords, tags=tags)
+        if not any(tag.k in node_tags for tag in n.tags):
+            return
 
-                self.nodes[tag].append(node)
+        tags = dict(version=n.version, **{tag.k: tag.v for tag in n.tags})
 
-        self.nodes_counter += 1
+        add_to_tags(self.nodes, Node(n.id, coords, tags=tags), tags, node_tags)
 
     def way(self, w):
 
-        if any(tag in w.tags for tag in ["highway", "cycleway"]):
+        nodes = [node.ref for node in w.nodes]
 
-            nodes = [node.ref for node in w.nodes]
+        bool_nodes_in_bounds = [node_id in self.all_nodes for node_id in nodes]
 
-            bool_nodes_in_bounds = {node_id in self.all_nodes for node_id in nodes}
+        if not any(bool_nodes_in_bounds):
+            return
 
-            if True not in bool_nodes_in_bounds:
-                return
+        check_status(self.ways_counter, "ways")
 
-            check_status(self.ways_counter, "ways")
+        self.ways_counter += 1
 
-            self.ways_counter += 1
+        tags = dict(version=w.version, **{tag.k: tag.v for tag in w.tags})
 
-            if False in bool_nodes_in_bounds:
+        if nodes[0] == nodes[-1]:
 
-                edges = zip(nodes, nodes[1:])
+            if all(bool_nodes_in_bounds):
+                self.add_area(w.id, [self.all_nodes[node_id] for node_id in nodes], nodes, tags)
+            else:
+                self.border_areas[w.id] = (
+                    tags,
+                    nodes,
+                    {node_id: self.all_nodes[node_id] for node_id in nodes if node_id in self.all_nodes},
+                )
 
-                nodes_in_bounds = [OrderedSet()]
-                coords_in_bounds = [[]]
+            return
 
-                for edge in edges:
+        if all(bool_nodes_in_bounds):
+            pieces = [(nodes, [self.all_nodes[node_id] for node_id in nodes])]
+        else:
+            pieces = self.get_way_pieces(w.id, nodes, tags)
 
-                    if edge in self.way_edges[w.id]:
+        for node_ids, coords in pieces:
 
-                        logging.info(f"edge {edge} was not imputed")
-                        continue
+            if len(coords) < 2:
+                continue
 
-                    if (
-                        len(nodes_in_bounds[-1]) > 0
-                        and nodes_in_bounds[-1][-1] != edge[0]
-                    ):
-                        nodes_in_bounds.append(OrderedSet())
+            add_to_tags(self.ways, Way(w.id, coords, node_ids, tags=tags), tags, way_tags)
 
-                    if edge[0] in self.all_nodes and edge[1] in self.all_nodes:
+    def area(self, a):
+        pass
 
-                        coords = [self.all_nodes[node].coordinates for node in edge]
+    def add_area(self, way_id, coords, node_ids, tags):
 
-                        nodes_in_bounds[-1].update(edge)
-                        coords_in_bounds[-1].extend(coords)
+        if len(coords) < 4:
+            return
 
-                    elif edge[0] in self.all_nodes:
+        add_to_tags(self.areas, Area(way_id, coords, node_ids, tags=tags), tags, area_tags)
 
-                        nodes_in_bounds, coords_in_bounds = self.handle_missing_node(
-                            edge, edge[1], edge[0], nodes_in_bounds, coords_in_bounds
-                        )
+    def get_way_pieces(self, way_id, nodes, tags):
+        """
+        Splits a way that crosses the border of the batch in its pieces inside the bounds
 
-                    elif edge[1] in self.all_nodes:
+        :param way_id: id of the way
+        :param nodes: node ids of the way
+        :param tags: tags of the way
+        :return: list of (node ids, coordinates) of the pieces
+        """
 
-                        nodes_in_bounds, coords_in_bounds = self.handle_missing_node(
-                            edge, edge[0], edge[1], nodes_in_bounds, coords_in_bounds
-                        )
+        pieces = [([], [])]
 
-                    else:
-                        continue
+        for edge in zip(nodes, nodes[1:]):
 
-            else:
-                nodes_in_bounds = [nodes]
-                coords_in_bounds = [
-                    [self.all_nodes[node].coordinates for node in nodes]
-                ]
+            if edge in self.way_edges[way_id]:
 
-            tags = dict(version=w.version, **{tag.k: tag.v for tag in w.tags})
+                logging.info(f"edge {edge} was not imputed")
+                continue
 
-            for node_ids, coords in zip(nodes_in_bounds, coords_in_bounds):
+            if edge[0] in self.all_nodes and edge[1] in self.all_nodes:
+                coords = [self.all_nodes[node_id] for node_id in edge]
 
-                if len(coords) < 2:
-                    continue
+            elif edge[0] in self.all_nodes:
+                coords = self.handle_missing_node(way_id, edge, edge[1], edge[0], tags)
 
-                pairs = list(zip(node_ids, node_ids[1:]))
+            elif edge[1] in self.all_nodes:
+                coords = self.handle_missing_node(way_id, edge, edge[0], edge[1], tags)
 
-                self.way_edges[w.id].update({pair for pair in pairs})
+            else:
+                coords = None
 
-                for tag_id in way_tags:
+            if coords is None:
+                continue
 
-                    if tag_id in tags:
+            self.way_edges[way_id].add(edge)
 
-                        if tag_id == "cycleway" and tags.get("highway") == "cycleway":
-                            continue
+            if len(pieces[-1][0]) > 0 and pieces[-1][0][-1] != edge[0]:
+                pieces.append(([], []))
 
-                        way = Way(w.id, coords, node_ids, tags=tags)
+            node_ids, piece_coords = pieces[-1]
 
-                        self.ways[tag_id].append(way)
+            if len(node_ids) == 0:
+                node_ids.append(edge[0])
+                piece_coords.append(coords[0])
 
-    def area(self, a):
-        pass
+            node_ids.append(edge[1])
+            piece_coords.append(coords[1])
 
-    def handle_missing_node(
-        self, edge, missing_node, existing_node, nodes_in_bounds, coords_in_bounds
-    ):
+        return pieces
 
-        if edge in self.border_edges:
+    def handle_missing_node(self, way_id, edge, missing_node, existing_node, tags):
+        """
+        Records a border edge, and completes it if the missing node was recorded by a previous batch
 
-            node_1_coords = self.border_edges[edge][missing_node]
-            node_2_coords = self.all_nodes[existing_node].coordinates
+        :param way_id: id of the way
+        :param edge: (node id, node id) of the edge
+        :param missing_node: id of the node outside the bounds
+        :param existing_node: id of the node inside the bounds
+        :param tags: tags of the way
+        :return: coordinates of the edge nodes if the edge was completed, None otherwise
+        """
 
-            self.border_edges[edge][existing_node] = node_2_coords
+        key = (way_id, *edge)
 
-            nodes_in_bounds[-1].update(edge)
-            coords_in_bounds[-1].extend([node_1_coords, node_2_coords])
+        self.border_edges[key] = {existing_node: self.all_nodes[existing_node]}
 
-        else:
-            self.border_edges[edge][existing_node] = self.all_nodes[
-                existing_node
-            ].coordinates
+        if missing_node not in self.missing_edges.get(key, {}):
+            self.border_ways[way_id] = tags
+            return None
+
+        self.border_edges[key][missing_node] = self.missing_edges[key][missing_node]
 
-        return nodes_in_bounds, coords_in_bounds
+        return [self.border_edges[key][node_id] for node_id in edge]
 
     def save(self, path=""):
 
@@ -170,16 +241,36 @@ class OSMFileHandler(osmium.SimpleHandler):
             pickle.dump(self.ways, f)
 
 
-def extract_features_batches(osm_file, bounds, border_edges=None, way_edges=None, batch=None):
-
-    osm_handler = OSMFileHandler(bounds, border_edges, way_edges, batch)
-    osm_handler.apply_file(osm_file)
+def extract_features_batches(
+    osm_file, bounds, border_edges=None, way_edges=None, batch=None, xy_divisions=None, save=True
+):
+    """
+    Extracts the osm objects of one batch of the osm file
+
+    :param osm_file: Path to the osm file
+    :param bounds: bounding box of the batch [west, south, east, north], if xy_divisions is not given
+    :param border_edges: border edges recorded by the batches processed before
+    :param way_edges: edges of the ways already included by the batches processed before
+    :param batch: (x, y) index of the cell of the split_bounds grid
+    :param xy_divisions: [x divisions, list with the y divisions of each column] of the bounding box
+    :param save: if the nodes and ways should be pickled in the working directory
+    :return: (nodes, ways, areas, border edges, border ways, border areas, way edges)
+    """
+
+    osm_handler = OSMFileHandler(bounds, border_edges, way_edges, batch, xy_divisions)
+    osm_handler.apply_file(
+        osm_file, filters=[osmium.filter.KeyFilter(*way_tags, *area_tags).enable_for(osmium.osm.WAY)]
+    )
 
-    osm_handler.save()
+    if save:
+        osm_handler.save()
 
     return (
         osm_handler.nodes,
         osm_handler.ways,
+        osm_handler.areas,
         osm_handler.border_edges,
+        osm_handler.border_ways,
+        osm_handler.border_areas,
         osm_handler.way_edges,
     )
@@ -0,0 +1,165 @@
+import logging
+from functools import partial
+from multiprocessing import Pool
+
+import numpy as np
+
+from osm_feature_extractor.feature_augmenting.feature_accumulator import FeatureAccumulator
+from osm_feature_extractor.feature_augmenting.contribution_store import ContributionStore
+from osm_feature_extractor.feature_augmenting.features_augmenter import log_match_counters
+from osm_feature_extractor.feature_extraction.osm_analyzer import RANGES_PER_WORKER
+from osm_feature_extractor.feature_extraction.osm_extractor_augmenter import (
+    OSMFileHandler,
+    extract_features_augment,
+    get_object_counter,
+    get_tag_filters,
+)
+from osm_feature_extractor.feature_extraction.osm_locations import (
+    apply_pbf_buffer,
+    build_location_index,
+    get_location_index_path,
+    is_location_index_reusable,
+    REUSABLE_LOCATION_INDEXES,
+)
+from osm_feature_extractor.feature_extraction.pbf_reader import is_pbf_file, read_blob_index, read_raw_blobs
+from osm_feature_extractor.utils.metrics import metrics, record_task
+
+# Maximum size of the compressed blobs of a range, so that the memory used by each worker
+# to hold its range stays bounded for large files
+MAX_RANGE_BYTES = 64 * 1024 * 1024
+
+_worker = {}
+
+
+def plan_blob_ranges(blobs, workers):
+    """
+    Splits the data blobs of a PBF file in contiguous ranges, several per worker so that the
+    workers stay busy when the ranges take different times to process, and more if needed
+    to keep the ranges under MAX_RANGE_BYTES
+
+    :param blobs: BlobInfo of the blobs of the PBF file
+    :param workers: number of worker processes
+    :return: list of ranges, where a range is a list of BlobInfo
+    """
+
+    data_blobs = [blob for blob in blobs if blob.type == "OSMData"]
+
+    data_bytes = sum(4 + blob.header_size + blob.data_size for blob in data_blobs)
+
+    number_ranges = max(workers * RANGES_PER_WORKER, int(np.ceil(data_bytes / MAX_RANGE_BYTES)))
+    number_ranges = max(min(number_ranges, len(data_blobs)), 1)
+
+    bounds = np.linspace(0, len(data_blobs), number_ranges + 1).astype(int)
+
+    return [data_blobs[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def _init_worker(osm_file, header_blobs, polygon_index, index_path, location_index, contribution_store):
+    _worker["osm_file"] = osm_file
+    _worker["header_blobs"] = header_blobs
+    _worker["polygon_index"] = polygon_index
+    _worker["index_path"] = index_path
+    _worker["location_index"] = location_index
+    _worker["store"] = ContributionStore(contribution_store) if contribution_store is not None else None
+
+
+def _extract_blob_range(blobs):
+    """
+    Processes the objects of a range of blobs and returns the partial feature sums of
+    the polygons that were updated. Only the blobs of the range and the file header are
+    read, and the locations of the way nodes are read from the shared location index.
+
+    :param blobs: BlobInfo of the blobs to be processed
+    :return: (rows of the updated polygons, partial feature sums of those rows, counters)
+    """
+
+    with open(_worker["osm_file"], "rb") as f:
+        buffer = read_raw_blobs(f, _worker["header_blobs"] + blobs)
+
+    osm_handler = OSMFileHandler(_worker["polygon_index"], store=_worker["store"])
+    object_counter, counter_handlers = get_object_counter(_worker["osm_file"], blobs)
+
+    apply_pbf_buffer(
+        osm_handler,
+        buffer,
+        [*counter_handlers, *get_tag_filters()],
+        _worker["index_path"],
+        _worker["location_index"],
+    )
+
+    osm_handler.flush()
+    osm_handler.count_objects_read(object_counter)
+
+    return osm_handler.accumulator.get_partial_sums()
+
+
+def extract_features_parallel(
+    osm_file,
+    polygon_index,
+    workers,
+    location_index="dense_file_array",
+    osm_extractor_files_dir=None,
+    contribution_store=None,
+):
+    """
+    Splits the blobs of a PBF file in contiguous ranges and extracts the features of each
+    range in a pool of worker processes, merging the partial sums. Every blob is decoded
+    by a single worker, and the node locations are stored once in a reusable location index,
+    dense_file_array by default, which is shared by all workers. Files in other formats
+    can't be split, and are processed in a single process.
+
+    :param osm_file: Path to the osm file
+    :param polygon_index: PolygonIndex of the polygons to be mapped
+    :param workers: number of worker processes
+    :param location_index: type of node location index, one of REUSABLE_LOCATION_INDEXES
+    :param osm_extractor_files_dir: path to extractor files data directory
+    :param contribution_store: path of the contribution store, if the contributions should be recorded
+    :return: FeatureAccumulator with the features of the polygons
+    """
+
+    if location_index not in REUSABLE_LOCATION_INDEXES:
+        raise ValueError(
+            f"Parallel extraction requires a reusable location index: {', '.join(REUSABLE_LOCATION_INDEXES)}"
+        )
+
+    if not is_pbf_file(osm_file):
+        logging.info(f"\t{osm_file} is not a PBF file and can't be split, parsing it in a single process...")
+
+        return extract_features_augment(
+            osm_file, polygon_index, location_index, osm_extractor_files_dir, contribution_store
+        )
+
+    blobs = read_blob_index(osm_file)
+    blob_ranges = plan_blob_ranges(blobs, workers)
+    header_blobs = [blob for blob in blobs if blob.type == "OSMHeader"]
+
+    if contribution_store is not None:
+        store = ContributionStore(contribution_store)
+        store.reset(polygon_index.ids)
+        store.close()
+
+    index_path = get_location_index_path(osm_extractor_files_dir, osm_file, location_index)
+
+    if not is_location_index_reusable(index_path, osm_file, location_index):
+        build_location_index(osm_file, index_path, location_index)
+
+    accumulator = FeatureAccumulator(len(polygon_index))
+
+    logging.info(f"\tParsing OSM file: {osm_file} in {len(blob_ranges)} blob ranges with {workers} workers...")
+
+    initargs = (osm_file, header_blobs, polygon_index, index_path, location_index, contribution_store)
+
+    with Pool(workers, initializer=_init_worker, initargs=initargs) as pool:
+
+        tasks = pool.imap_unordered(partial(record_task, _extract_blob_range), blob_ranges)
+
+        for i, (partial_sums, worker_stages) in enumerate(tasks):
+
+            accumulator.merge_partial_sums(*partial_sums)
+            metrics.merge(worker_stages)
+
+            logging.info(f"\t\tMerged {i + 1} / {len(blob_ranges)} blob ranges")
+
+    log_match_counters(accumulator.counters)
+
+    return accumulator
@@ -0,0 +1,517 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import osmium
+import shapely
+
+from osm_feature_extractor.feature_augmenting.feature_accumulator import FeatureAccumulator
+from osm_feature_extractor.feature_augmenting.features_augmenter import (
+    match_polygons_to_features,
+    log_match_counters,
+)
+from osm_feature_extractor.feature_augmenting.features_to_tags import way_tags, area_tags
+from osm_feature_extractor.feature_extraction.density_histogram import (
+    count_shard_nodes,
+    split_bounds_by_density,
+)
+from osm_feature_extractor.feature_extraction.osm_analyzer import get_density_histogram
+from osm_feature_extractor.feature_extraction.osm_datamodel import Way, Area
+from osm_feature_extractor.feature_extraction.osm_extractor import get_shard, get_shards, check_status
+from osm_feature_extractor.feature_extraction.osm_extractor_augmenter import get_object_counter
+from osm_feature_extractor.feature_extraction.osm_extractor_batches import (
+    extract_features_batches,
+    add_to_tags,
+)
+from osm_feature_extractor.feature_extraction.osm_locations import (
+    apply_osm_file,
+    get_osm_file_signature,
+    FILE_LOCATION_INDEXES,
+)
+from osm_feature_extractor.utils.metrics import metrics, record_task
+
+PLAN_FILE = "plan.json"
+
+# Increased whenever the layout of the plan changes, so that older plans are not resumed
+PLAN_FORMAT_VERSION = 3
+
+# Size of the output buffer of each batch file written while partitioning the osm file
+PARTITION_BUFFER_SIZE = 1 << 20
+
+# Batches are processed in 4 waves, by the parity of their (x, y) index, so that no two
+# neighbouring batches run at the same time and each one receives the border edges of
+# the neighbours processed in the waves before
+N_WAVES = 4
+
+_worker = {}
+
+
+def get_checkpoint_dir(osm_extractor_files_dir, osm_file):
+    """
+    Gets the directory where the batch files and the checkpoints of an osm file are stored
+
+    :param osm_extractor_files_dir: path to extractor files data directory
+    :param osm_file: Path to the osm file
+    :return: path of the checkpoint directory
+    """
+
+    prefix = os.path.basename(osm_file).split('.')[0]
+
+    return os.path.join(osm_extractor_files_dir, f"{prefix}_batches")
+
+
+def get_batch_wave(batch):
+    """
+    :param batch: (x, y) index of the cell of the split_bounds grid
+    :return: wave in which the batch is processed
+    """
+
+    return (batch[0] % 2) * 2 + batch[1] % 2
+
+
+def _get_batch_path(checkpoint_dir, batch, extension):
+
+    return os.path.join(checkpoint_dir, f"batch_{batch[0]}_{batch[1]}.{extension}")
+
+
+def _write_pickle(obj, path):
+
+    with open(f"{path}.tmp", "wb") as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    os.replace(f"{path}.tmp", path)
+
+
+def _read_pickle(path):
+
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def _save_plan(plan, checkpoint_dir):
+
+    with open(os.path.join(checkpoint_dir, f"{PLAN_FILE}.tmp"), "w") as f:
+        json.dump(plan, f)
+
+    os.replace(os.path.join(checkpoint_dir, f"{PLAN_FILE}.tmp"), os.path.join(checkpoint_dir, PLAN_FILE))
+
+
+def _get_run_signature(osm_file, polygon_index, max_batch_nodes):
+
+    digest = hashlib.sha256("\n".join(map(str, polygon_index.ids)).encode())
+
+    for wkb in shapely.to_wkb(polygon_index.geometries):
+        digest.update(wkb)
+
+    return {
+        **get_osm_file_signature(osm_file),
+        "polygons": digest.hexdigest(),
+        "max_batch_nodes": max_batch_nodes,
+        "plan_format_version": PLAN_FORMAT_VERSION,
+    }
+
+
+def plan_batches(
+    osm_file, polygon_index, max_batch_nodes, checkpoint_dir, osm_extractor_files_dir=None, workers=1
+):
+    """
+    Divides the bounding box of the osm file in a grid at the quantiles of the node density
+    histogram of the file, with at most max_batch_nodes nodes per cell, unless a single cell of
+    the histogram has more. The plan of a previous run with the same osm file, polygons and batch
+    size is reused together with its checkpoints, otherwise the checkpoint directory is cleared.
+
+    :param osm_file: Path to the osm file
+    :param polygon_index: PolygonIndex of the polygons to be mapped
+    :param max_batch_nodes: maximum number of nodes per batch
+    :param checkpoint_dir: path of the checkpoint directory
+    :param osm_extractor_files_dir: path to extractor files data directory, where the histogram is saved
+    :param workers: number of worker processes used to analyze the file
+    :return: dict with the run signature, the xy_divisions, if the osm file was already partitioned
+        and the counts of the objects read while partitioning it
+    """
+
+    signature = _get_run_signature(osm_file, polygon_index, max_batch_nodes)
+
+    plan_file = os.path.join(checkpoint_dir, PLAN_FILE)
+
+    if os.path.exists(plan_file):
+
+        with open(plan_file, "r") as f:
+            plan = json.load(f)
+
+        if plan["signature"] == signature:
+            logging.info(f"\tResuming batches checkpointed in {checkpoint_dir}...")
+            return plan
+
+    shutil.rmtree(checkpoint_dir, ignore_errors=True)
+    os.makedirs(checkpoint_dir)
+
+    histogram = get_density_histogram(osm_file, osm_extractor_files_dir, workers)
+
+    xy_divisions = split_bounds_by_density(histogram, max_nodes_box=max_batch_nodes)
+
+    batch_nodes = count_shard_nodes(histogram, xy_divisions)
+
+    logging.info(f"\tPlanned {len(batch_nodes)} batches with at most {batch_nodes.max()} nodes")
+
+    if batch_nodes.max() > max_batch_nodes:
+        logging.warning(
+            f"\t\t{int(sum(batch_nodes > max_batch_nodes))} batches of a single "
+            f"{histogram.resolution} degree histogram cell have more than {max_batch_nodes} nodes"
+        )
+
+    plan = {
+        "signature": signature,
+        "xy_divisions": [
+            list(map(float, xy_divisions[0])),
+            [list(map(float, divisions)) for divisions in xy_divisions[1]],
+        ],
+        "partitioned": False,
+        "objects_read": {},
+    }
+
+    _save_plan(plan, checkpoint_dir)
+
+    return plan
+
+
+class PartitionHandler(osmium.SimpleHandler):
+    """
+    Writes every node of the osm file to the file of the batch it is located in, and every way
+    to the files of all the batches where any of its nodes are located.
+    """
+
+    def __init__(self, xy_divisions, writers):
+        osmium.SimpleHandler.__init__(self)
+
+        self.xy_divisions = xy_divisions
+        self.writers = writers
+        self.nodes_counter = 0
+        self.ways_counter = 0
+
+    def node(self, n):
+
+        if not n.location.valid():
+            return
+
+        check_status(self.nodes_counter, "nodes")
+
+        self.nodes_counter += 1
+
+        self.writers[get_shard((n.location.lon, n.location.lat), self.xy_divisions)].add_node(n)
+
+    def way(self, w):
+
+        check_status(self.ways_counter, "ways")
+
+        self.ways_counter += 1
+
+        batches = {
+            get_shard((n.lon, n.lat), self.xy_divisions) for n in w.nodes if n.location.valid()
+        }
+
+        for batch in batches:
+            self.writers[batch].add_way(w)
+
+
+def partition_osm_file(
+    osm_file,
+    xy_divisions,
+    batches,
+    checkpoint_dir,
+    location_index="dense_file_array",
+    osm_extractor_files_dir=None,
+):
+    """
+    Splits the osm file in one file per batch, so that each batch only reads its own nodes
+    and the ways that cross it. The node locations are kept in a file location index, so
+    that the memory used doesn't grow with the size of the osm file.
+
+    :param osm_file: Path to the osm file
+    :param xy_divisions: [x divisions, list with the y divisions of each column] of the bounding box
+    :param batches: (x, y) indexes of the batches
+    :param checkpoint_dir: path of the checkpoint directory
+    :param location_index: type of file node location index
+    :param osm_extractor_files_dir: path to extractor files data directory
+    :return: dict with the number of nodes and ways read from the osm file, before the tag filters
+    """
+
+    if location_index not in FILE_LOCATION_INDEXES:
+        raise ValueError(f"The osm file can only be partitioned with a file location index, not {location_index}")
+
+    logging.info(f"\tPartitioning OSM file: {osm_file} in {len(batches)} batches...")
+
+    writers = {
+        batch: osmium.SimpleWriter(
+            _get_batch_path(checkpoint_dir, batch, "osm.pbf"), PARTITION_BUFFER_SIZE, overwrite=True
+        )
+        for batch in batches
+    }
+
+    object_counter, counter_handlers = get_object_counter(osm_file)
+
+    try:
+        apply_osm_file(
+            PartitionHandler(xy_divisions, writers),
+            osm_file,
+            [*counter_handlers, osmium.filter.KeyFilter(*way_tags, *area_tags).enable_for(osmium.osm.WAY)],
+            location_index,
+            osm_extractor_files_dir,
+        )
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    return {"nodes_read": object_counter.nodes_counter, "ways_read": object_counter.ways_counter}
+
+
+class BorderState:
+    """
+    Border edges and closed ways crossing the batch borders that are still incomplete, merged
+    from the results of the batches as they are processed.
+
+    Attributes:
+        edges (dict): coordinates by node id of the incomplete border edges, by (way id, node id, node id)
+        ways (dict): tags of the ways with incomplete border edges
+        areas (dict): (tags, node ids, coordinates by node id) of the incomplete closed ways
+        completed_ways (dict): lists of the Way objects of the edges completed by merging, by tag
+        completed_areas (dict): lists of the Area objects of the closed ways completed by merging, by tag
+    """
+
+    def __init__(self):
+
+        self.edges = {}
+        self.ways = {}
+        self.areas = {}
+        self.completed_ways = {tag: [] for tag in way_tags}
+        self.completed_areas = {tag: [] for tag in area_tags}
+
+    def merge(self, border_edges, border_ways, border_areas):
+        """
+        Merges the border edges and closed ways of a batch. Edges completed by the batch itself
+        are removed, while edges and closed ways that become complete with the coordinates of
+        the batch, but that the batch could not complete, are added to the completed objects.
+
+        :param border_edges: border edges of the batch
+        :param border_ways: tags of the ways with border edges of the batch
+        :param border_areas: closed ways of the batch crossing its border
+        :return: None
+        """
+
+        self.ways.update(border_ways)
+
+        for key, nodes in border_edges.items():
+
+            if len(nodes) == 2:
+                self.edges.pop(key, None)
+                continue
+
+            edge_nodes = self.edges.setdefault(key, {})
+            edge_nodes.update(nodes)
+
+            if len(edge_nodes) < 2:
+                continue
+
+            del self.edges[key]
+
+            way_id, node_ids = key[0], key[1:]
+            tags = self.ways[way_id]
+
+            way = Way(way_id, [edge_nodes[node_id] for node_id in node_ids], list(node_ids), tags=tags)
+
+            add_to_tags(self.completed_ways, way, tags, way_tags)
+
+        for way_id, (tags, node_ids, coords) in border_areas.items():
+
+            area_coords = self.areas.setdefault(way_id, (tags, node_ids, {}))[2]
+            area_coords.update(coords)
+
+            if any(node_id not in area_coords for node_id in node_ids):
+                continue
+
+            del self.areas[way_id]
+
+            if len(node_ids) < 4:
+                continue
+
+            area = Area(way_id, [area_coords[node_id] for node_id in node_ids], node_ids, tags=tags)
+
+            add_to_tags(self.completed_areas, area, tags, area_tags)
+
+    def pop_completed(self):
+        """
+        Gets the objects completed by merging and removes the tags of the ways
+        without incomplete border edges
+
+        :return: (Way objects by tag, Area objects by tag)
+        """
+
+        completed = self.completed_ways, self.completed_areas
+
+        self.completed_ways = {tag: [] for tag in way_tags}
+        self.completed_areas = {tag: [] for tag in area_tags}
+
+        pending_ways = {key[0] for key in self.edges}
+        self.ways = {way_id: tags for way_id, tags in self.ways.items() if way_id in pending_ways}
+
+        return completed
+
+
+def _init_worker(polygon_index, xy_divisions, checkpoint_dir):
+    _worker["polygon_index"] = polygon_index
+    _worker["xy_divisions"] = xy_divisions
+    _worker["checkpoint_dir"] = checkpoint_dir
+    _worker["border_edges"] = (None, None)
+
+
+def _extract_batch(task):
+    """
+    Processes the file of one batch, matching its objects to the polygons, and checkpoints
+    the partial feature sums and the border state of the batch
+
+    :param task: ((x, y) index of the batch, path of the border edges of the previous waves)
+    :return: (x, y) index of the batch
+    """
+
+    batch, border_edges_file = task
+
+    if _worker["border_edges"][0] != border_edges_file:
+        _worker["border_edges"] = (border_edges_file, _read_pickle(border_edges_file))
+
+    checkpoint_dir = _worker["checkpoint_dir"]
+
+    nodes, ways, areas, border_edges, border_ways, border_areas, _ = extract_features_batches(
+        _get_batch_path(checkpoint_dir, batch, "osm.pbf"),
+        None,
+        _worker["border_edges"][1],
+        batch=batch,
+        xy_divisions=_worker["xy_divisions"],
+        save=False,
+    )
+
+    polygon_index = _worker["polygon_index"]
+
+    accumulator = match_polygons_to_features(
+        FeatureAccumulator(len(polygon_index)), polygon_index, nodes, ways, areas
+    )
+
+    rows, values, counters = accumulator.get_partial_sums()
+
+    _write_pickle(
+        {
+            "rows": rows,
+            "values": values,
+            "counters": counters,
+            "border_edges": border_edges,
+            "border_ways": border_ways,
+            "border_areas": border_areas,
+        },
+        _get_batch_path(checkpoint_dir, batch, "pickle"),
+    )
+
+    return batch
+
+
+def extract_features_batches_parallel(
+    osm_file,
+    polygon_index,
+    workers,
+    max_batch_nodes,
+    location_index="dense_file_array",
+    osm_extractor_files_dir=None,
+):
+    """
+    Processes the osm file in batches of the split_bounds grid, in a pool of worker processes,
+    so that the memory used by each worker is bounded by the size of the batches. The osm file is
+    first partitioned in one file per batch, and the batches are processed in waves in which no two
+    neighbouring batches run, passing the border edges of each wave to the following ones.
+
+    The result of every batch is checkpointed, and an interrupted run over the same osm file and
+    polygons resumes from the checkpointed batches. The checkpoints are removed once all batches
+    are merged.
+
+    :param osm_file: Path to the osm file
+    :param polygon_index: PolygonIndex of the polygons to be mapped
+    :param workers: number of worker processes
+    :param max_batch_nodes: maximum number of nodes per batch
+    :param location_index: type of file node location index used to partition the osm file
+    :param osm_extractor_files_dir: path to extractor files data directory
+    :return: FeatureAccumulator with the features of the polygons
+    """
+
+    checkpoint_dir = get_checkpoint_dir(osm_extractor_files_dir, osm_file)
+
+    plan = plan_batches(
+        osm_file, polygon_index, max_batch_nodes, checkpoint_dir, osm_extractor_files_dir, workers
+    )
+
+    xy_divisions = plan["xy_divisions"]
+
+    batches = get_shards(xy_divisions)
+
+    if not plan["partitioned"]:
+        plan["objects_read"] = partition_osm_file(
+            osm_file, xy_divisions, batches, checkpoint_dir, location_index, osm_extractor_files_dir
+        )
+
+        plan["partitioned"] = True
+        _save_plan(plan, checkpoint_dir)
+
+    accumulator = FeatureAccumulator(len(polygon_index))
+    border_state = BorderState()
+
+    logging.info(f"\tParsing OSM file: {osm_file} in {len(batches)} batches with {workers} workers...")
+
+    initargs = (polygon_index, xy_divisions, checkpoint_dir)
+
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=initargs) as executor:
+
+        for wave in range(N_WAVES):
+
+            wave_batches = [batch for batch in batches if get_batch_wave(batch) == wave]
+
+            border_edges_file = os.path.join(checkpoint_dir, f"border_edges_{wave}.pickle")
+            _write_pickle(border_state.edges, border_edges_file)
+
+            pending = [
+                batch for batch in wave_batches
+                if not os.path.exists(_get_batch_path(checkpoint_dir, batch, "pickle"))
+            ]
+
+            logging.info(
+                f"\t\tWave {wave + 1} / {N_WAVES}: {len(pending)} batches to process, "
+                f"{len(wave_batches) - len(pending)} checkpointed"
+            )
+
+            futures = [
+                executor.submit(record_task, _extract_batch, (batch, border_edges_file)) for batch in pending
+            ]
+
+            for i, future in enumerate(as_completed(futures)):
+                batch, worker_stages = future.result()
+                metrics.merge(worker_stages)
+                logging.info(f"\t\t\tProcessed batch {batch} ({i + 1} / {len(pending)})")
+
+            for batch in wave_batches:
+
+                result = _read_pickle(_get_batch_path(checkpoint_dir, batch, "pickle"))
+
+                accumulator.merge_partial_sums(result["rows"], result["values"], result["counters"])
+
+                border_state.merge(result["border_edges"], result["border_ways"], result["border_areas"])
+
+            ways, areas = border_state.pop_completed()
+
+            accumulator = match_polygons_to_features(accumulator, polygon_index, {}, ways, areas)
+
+    accumulator.counters.update(plan["objects_read"])
+
+    log_match_counters(accumulator.counters)
+
+    shutil.rmtree(checkpoint_dir, ignore_errors=True)
+
+    return accumulator
@@ -0,0 +1,206 @@
+import json
+import logging
+import os
+
+import osmium
+from osmium.index import create_map
+
+LOCATION_INDEXES = [
+    "flex_mem",
+    "sparse_mem_array",
+    "dense_mmap_array",
+    "sparse_file_array",
+    "dense_file_array",
+]
+
+# Indexes stored in a file under osm_extractor_files_dir
+FILE_LOCATION_INDEXES = ["sparse_file_array", "dense_file_array"]
+
+# Indexes that can be reopened and reused by later runs over the same osm file
+REUSABLE_LOCATION_INDEXES = ["dense_file_array"]
+
+
+def get_location_index_path(osm_extractor_files_dir, osm_file, location_index, suffix=""):
+    """
+    Gets the path of the file of a node location index
+
+    :param osm_extractor_files_dir: path to extractor files data directory
+    :param osm_file: Path to the osm file
+    :param location_index: type of location index
+    :param suffix: suffix added to the file name
+    :return: path of the location index file
+    """
+
+    prefix = os.path.basename(osm_file).split('.')[0]
+
+    return os.path.join(osm_extractor_files_dir, f"{prefix}_locations{suffix}.{location_index}")
+
+
+def get_osm_file_signature(osm_file):
+    """
+    Identifies the current version of an osm file, to check if files derived from it are up to date
+
+    :param osm_file: Path to the osm file
+    :return: dict with the absolute path, size and modification time of the file
+    """
+
+    stat = os.stat(osm_file)
+
+    return {"osm_file": os.path.abspath(osm_file), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def is_location_index_reusable(index_path, osm_file, location_index):
+    """
+    Checks if a location index file was completely built from the current version of the osm file
+
+    :param index_path: path of the location index file
+    :param osm_file: Path to the osm file
+    :param location_index: type of location index
+    :return: True if the location index can be reused, False otherwise
+    """
+
+    if location_index not in REUSABLE_LOCATION_INDEXES or not os.path.exists(index_path + ".json"):
+        return False
+
+    with open(index_path + ".json", "r") as f:
+        signature = json.load(f)
+
+    return signature == get_osm_file_signature(osm_file)
+
+
+def _open_location_index(index_path, location_index, overwrite):
+
+    if overwrite:
+        for path in [index_path, index_path + ".json"]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    location_handler = osmium.NodeLocationsForWays(create_map(f"{location_index},{index_path}"))
+    location_handler.ignore_errors()
+
+    return location_handler
+
+
+def _apply(osm_file, entities, *handlers):
+
+    reader = osmium.io.Reader(osm_file, entities)
+
+    try:
+        osmium.apply(reader, *handlers)
+    finally:
+        reader.close()
+
+
+def _save_signature(index_path, osm_file):
+
+    with open(index_path + ".json", "w") as f:
+        json.dump(get_osm_file_signature(osm_file), f)
+
+
+def build_location_index(osm_file, index_path, location_index):
+    """
+    Stores the locations of all nodes of the osm file in a location index file
+
+    :param osm_file: Path to the osm file
+    :param index_path: path of the location index file
+    :param location_index: type of location index
+    :return: None
+    """
+
+    logging.info(f"\tBuilding {location_index} node location index in {index_path}...")
+
+    location_handler = _open_location_index(index_path, location_index, overwrite=True)
+
+    _apply(osm_file, osmium.osm.NODE, location_handler)
+
+    del location_handler
+
+    _save_signature(index_path, osm_file)
+
+
+def apply_osm_file(
+    osm_handler,
+    osm_file,
+    filters,
+    location_index="flex_mem",
+    osm_extractor_files_dir=None,
+    index_suffix="",
+):
+    """
+    Applies a handler to the nodes and ways of an osm file, with the node locations
+    stored in the chosen location index. File indexes are kept under osm_extractor_files_dir,
+    and a complete dense_file_array index of the same osm file is reused instead of
+    being rebuilt, in which case the nodes and the ways are read in two separate passes.
+    Index files that can't be reused are removed once the file is applied.
+
+    :param osm_handler: handler to be applied
+    :param osm_file: Path to the osm file
+    :param filters: osmium filters applied before the handler
+    :param location_index: type of location index
+    :param osm_extractor_files_dir: path to extractor files data directory
+    :param index_suffix: suffix added to the name of the location index file
+    :return: None
+    """
+
+    if location_index not in FILE_LOCATION_INDEXES:
+        osm_handler.apply_file(osm_file, locations=True, idx=location_index, filters=filters)
+        return
+
+    index_path = get_location_index_path(
+        osm_extractor_files_dir, osm_file, location_index, suffix=index_suffix
+    )
+
+    if is_location_index_reusable(index_path, osm_file, location_index):
+
+        logging.info(f"\tReusing node location index {index_path}...")
+
+        location_handler = _open_location_index(index_path, location_index, overwrite=False)
+
+        _apply(osm_file, osmium.osm.NODE, *filters, osm_handler)
+        _apply(osm_file, osmium.osm.WAY, location_handler, *filters, osm_handler)
+
+        return
+
+    location_handler = _open_location_index(index_path, location_index, overwrite=True)
+
+    try:
+        _apply(osm_file, osmium.osm.NODE | osmium.osm.WAY, location_handler, *filters, osm_handler)
+    finally:
+        del location_handler
+
+        # Indexes that can't be reused are only needed while the file is applied
+        if location_index not in REUSABLE_LOCATION_INDEXES and os.path.exists(index_path):
+            os.remove(index_path)
+
+    if location_index in REUSABLE_LOCATION_INDEXES:
+        _save_signature(index_path, osm_file)
+
+
+def apply_pbf_buffer(osm_handler, buffer, filters, index_path, location_index="dense_file_array"):
+    """
+    Applies a handler to the nodes and ways of a PBF file held in memory, such as a range of
+    the blobs of a larger file, with the node locations read from a complete reusable index of
+    the larger file, so that the ways get the locations of nodes stored in other blobs.
+    The filters run before the location handler, so the index is only written with the
+    locations of the filtered nodes, which are the ones it already stores.
+
+    :param osm_handler: handler to be applied
+    :param buffer: bytes with the PBF file
+    :param filters: osmium filters applied before the handler
+    :param index_path: path of the location index file
+    :param location_index: type of location index, one of REUSABLE_LOCATION_INDEXES
+    :return: None
+    """
+
+    location_handler = _open_location_index(index_path, location_index, overwrite=False)
+
+    try:
+        _apply(
+            osmium.io.FileBuffer(buffer, "pbf"),
+            osmium.osm.NODE | osmium.osm.WAY,
+            *filters,
+            location_handler,
+            osm_handler,
+        )
+    finally:
+        del location_handler
@@ -0,0 +1,324 @@
+import logging
+
+import osmium
+
+from osm_feature_extractor.feature_augmenting.contribution_store import ContributionStore
+from osm_feature_extractor.feature_augmenting.features_to_tags import way_tags, area_tags
+from osm_feature_extractor.feature_extraction.osm_extractor_augmenter import OSMFileHandler
+from osm_feature_extractor.feature_extraction.osm_locations import apply_osm_file
+
+
+class ChangeFileHandler(osmium.SimpleHandler):
+    """
+    Reads the nodes and ways of an OSM change file (.osc), keeping the latest version of each
+    object. Nodes are stored as (version, deleted, tags, coordinates) and ways as
+    (version, deleted, tags, node ids).
+    """
+
+    def __init__(self):
+        osmium.SimpleHandler.__init__(self)
+
+        self.nodes = {}
+        self.ways = {}
+
+    def node(self, n):
+
+        if n.id in self.nodes and self.nodes[n.id][0] >= n.version:
+            return
+
+        coords = (n.location.lon, n.location.lat) if n.location.valid() else None
+
+        self.nodes[n.id] = (n.version, n.deleted, dict(n.tags), coords)
+
+    def way(self, w):
+
+        if w.id in self.ways and self.ways[w.id][0] >= w.version:
+            return
+
+        self.ways[w.id] = (w.version, w.deleted, dict(w.tags), [n.ref for n in w.nodes])
+
+
+class BaseFileHandler(osmium.SimpleHandler):
+    """
+    Reads the objects of the base OSM file that are affected by a change file. The old versions of
+    the changed nodes and ways, and of the ways whose nodes were moved, are passed to old_handler,
+    so that their contributions can be subtracted. The new versions of the ways whose nodes were
+    moved are kept in moved_ways. Changes whose version is not newer than the one in the base
+    file, or than the one in stored_versions, are already applied, and are skipped.
+
+    If old_handler is None, the ways whose nodes were moved are only recorded in old_ways, for
+    their stored contributions to be subtracted instead.
+
+    The locations of the nodes of the changed ways that are not in the change file are also stored.
+
+    The nodes and ways changed by previously applied change files, stored_nodes and stored_ways,
+    replace their old versions in the base file. The stored ways whose nodes were moved are kept
+    in stored_moved_ways, to be rebuilt once the locations of their nodes are read.
+    """
+
+    def __init__(self, changes, old_handler, stored_versions=None, stored_nodes=None, stored_ways=None):
+        osmium.SimpleHandler.__init__(self)
+
+        self.changes = changes
+        self.old_handler = old_handler
+        self.applied = {
+            osm_type: {
+                object_id for object_id, version in (stored_versions or {}).get(osm_type, {}).items()
+                if changed[object_id][0] <= version
+            }
+            for osm_type, changed in [("node", changes.nodes), ("way", changes.ways)]
+        }
+        self.moved_ways = []
+        self.moved_nodes = {
+            node_id: coords for node_id, (_, deleted, _, coords) in changes.nodes.items()
+            if not deleted and node_id not in self.applied["node"]
+        }
+        self.stored_nodes = stored_nodes or {}
+        self.stored_ways = stored_ways or {}
+        self.stored_moved_ways = {
+            way_id: way for way_id, way in self.stored_ways.items()
+            if way is not None and way_id not in changes.ways
+            and any(node_id in self.moved_nodes for node_id in way[2])
+        }
+        self.old_ways = set(self.stored_moved_ways)
+        self.needed_nodes = {
+            node_id
+            for node_ids in [
+                *(node_ids for _, deleted, _, node_ids in changes.ways.values() if not deleted),
+                *(node_ids for _, _, node_ids in self.stored_moved_ways.values()),
+            ]
+            for node_id in node_ids
+        } - self.moved_nodes.keys()
+        self.node_locations = {}
+
+    def node(self, n):
+
+        if n.id in self.needed_nodes:
+            self.node_locations[n.id] = (n.location.lon, n.location.lat)
+
+        if n.id not in self.changes.nodes:
+            return
+
+        if n.id in self.applied["node"] or self.changes.nodes[n.id][0] <= n.version:
+            self.applied["node"].add(n.id)
+            self.moved_nodes.pop(n.id, None)
+            self.node_locations[n.id] = (n.location.lon, n.location.lat)
+        elif self.old_handler is not None:
+            self.old_handler.node(n)
+
+    def way(self, w):
+
+        if w.id in self.changes.ways:
+
+            if w.id in self.applied["way"] or self.changes.ways[w.id][0] <= w.version:
+                self.applied["way"].add(w.id)
+            elif self.old_handler is not None:
+                self.old_handler.way(w)
+
+            return
+
+        nodes = w.nodes
+
+        # The stored version replaces the one in the base file
+        if w.id in self.stored_ways or not any(n.ref in self.moved_nodes for n in nodes):
+            return
+
+        self.old_ways.add(w.id)
+
+        if self.old_handler is not None:
+            self.old_handler.way(w)
+
+        try:
+            coords = [
+                c for n in nodes
+                for c in self.moved_nodes.get(n.ref) or self.stored_nodes.get(n.ref) or (n.lon, n.lat)
+            ]
+        except osmium.InvalidLocationError:
+            return
+
+        self.moved_ways.append((w.id, w.version, dict(w.tags), nodes[0].ref == nodes[-1].ref, coords))
+
+
+def add_changed_objects(changes, base_handler, new_handler):
+    """
+    Passes the new versions of the changed nodes and ways that are not deleted nor already
+    applied, and of the ways whose nodes were moved, to new_handler. The node locations are
+    taken from the change file, then from the previously applied change files, and then
+    from the base file.
+
+    :param changes: ChangeFileHandler with the changed objects
+    :param base_handler: BaseFileHandler applied to the base OSM file
+    :param new_handler: OSMFileHandler where the new versions are matched
+    :return: None
+    """
+
+    for node_id, (version, deleted, tags, coords) in changes.nodes.items():
+
+        if not deleted and node_id not in base_handler.applied["node"]:
+            new_handler.add_node(node_id, version, tags, list(tags), coords)
+
+    node_locations = {**base_handler.node_locations, **base_handler.stored_nodes, **base_handler.moved_nodes}
+
+    rebuilt_ways = [
+        (way_id, version, tags, node_ids)
+        for way_id, (version, deleted, tags, node_ids) in changes.ways.items()
+        if not deleted and way_id not in base_handler.applied["way"]
+    ]
+    rebuilt_ways.extend(
+        (way_id, version, tags, node_ids)
+        for way_id, (version, tags, node_ids) in base_handler.stored_moved_ways.items()
+    )
+
+    skipped = 0
+
+    for way_id, version, tags, node_ids in rebuilt_ways:
+
+        if len(node_ids) == 0:
+            continue
+
+        if any(node_locations.get(node_id) is None for node_id in node_ids):
+            skipped += 1
+            continue
+
+        coords = [c for node_id in node_ids for c in node_locations[node_id]]
+
+        new_handler.add_way(way_id, version, tags, list(tags), node_ids[0] == node_ids[-1], coords)
+
+    for way_id, version, tags, is_closed, coords in base_handler.moved_ways:
+        new_handler.add_way(way_id, version, tags, list(tags), is_closed, coords)
+
+    if skipped > 0:
+        logging.warning(f"\t\tSkipped {skipped} changed ways with missing node locations")
+
+
+def subtract_stored_contributions(changes, base_handler, store, accumulator):
+    """
+    Subtracts the stored contributions of the changed objects that are not already applied,
+    and of the ways whose nodes were moved, removing them from the store
+
+    :param changes: ChangeFileHandler with the changed objects
+    :param base_handler: BaseFileHandler applied to the base OSM file
+    :param store: ContributionStore of the previous extraction
+    :param accumulator: FeatureAccumulator with the features of the previous extraction
+    :return: None
+    """
+
+    old_objects = {
+        "node": changes.nodes.keys() - base_handler.applied["node"],
+        "way": (changes.ways.keys() - base_handler.applied["way"]) | base_handler.old_ways,
+    }
+
+    for osm_type, osm_ids in old_objects.items():
+
+        rows, columns, values = store.pop(osm_type, osm_ids)
+
+        accumulator.add(rows, columns, -values)
+
+
+def update_features(
+    osm_file,
+    change_file,
+    polygon_index,
+    accumulator,
+    location_index="flex_mem",
+    osm_extractor_files_dir=None,
+    contribution_store=None,
+):
+    """
+    Updates the features extracted from an osm file with the changes of an OSM change file.
+    The contributions of the old versions of the changed objects are subtracted and the ones
+    of their new versions are added.
+
+    If the contribution store of the previous extraction is given, the stored contributions are
+    subtracted instead of the ones of the objects in the base osm file, and the versions in the
+    store are also used to skip changes that were already applied. The store is updated with the
+    new contributions, so the changes can be applied incrementally, one change file at a time.
+    The new versions of the changed nodes and ways are also stored, so that the objects changed
+    by a change file can reference the ones created or moved by the previously applied ones,
+    while osm_file stays the file of the previous extraction.
+
+    :param osm_file: Path to the osm file the features were extracted from
+    :param change_file: Path to the OSM change file (.osc or .osc.gz)
+    :param polygon_index: PolygonIndex of the polygons
+    :param accumulator: FeatureAccumulator with the features extracted from osm_file
+    :param location_index: type of node location index
+    :param osm_extractor_files_dir: path to extractor files data directory
+    :param contribution_store: path of the contribution store of the previous extraction
+    :return: updated FeatureAccumulator
+    """
+
+    logging.info(f"\tReading OSM change file: {change_file}...")
+
+    changes = ChangeFileHandler()
+    changes.apply_file(change_file)
+
+    logging.info(f"\t\t{len(changes.nodes)} changed nodes and {len(changes.ways)} changed ways")
+
+    store = None
+    stored_versions = None
+    stored_nodes = None
+    stored_ways = None
+
+    if contribution_store is not None:
+        store = ContributionStore(contribution_store)
+        store.check_polygons(polygon_index.ids)
+
+        stored_versions = {
+            "node": store.get_versions("node", changes.nodes),
+            "way": store.get_versions("way", changes.ways),
+        }
+        stored_nodes = store.get_changed_nodes()
+        stored_ways = store.get_changed_ways()
+
+    old_handler = OSMFileHandler(polygon_index) if store is None else None
+    new_handler = OSMFileHandler(polygon_index, store=store)
+
+    base_handler = BaseFileHandler(changes, old_handler, stored_versions, stored_nodes, stored_ways)
+
+    logging.info(f"\tReading affected objects from OSM file: {osm_file}...")
+
+    # Only the changed nodes and the nodes of the changed ways reach the handler, while
+    # the locations of all nodes are still stored for the geometries of the ways
+    filters = [
+        osmium.filter.IdFilter(changes.nodes.keys() | base_handler.needed_nodes).enable_for(osmium.osm.NODE),
+        osmium.filter.KeyFilter(*way_tags, *area_tags).enable_for(osmium.osm.WAY),
+    ]
+
+    apply_osm_file(base_handler, osm_file, filters, location_index, osm_extractor_files_dir)
+
+    if store is not None:
+        subtract_stored_contributions(changes, base_handler, store, accumulator)
+    else:
+        old_handler.flush()
+
+        rows, values, _ = old_handler.accumulator.get_partial_sums()
+
+        accumulator.merge_partial_sums(rows, -values)
+
+    add_changed_objects(changes, base_handler, new_handler)
+
+    new_handler.flush()
+
+    logging.info(
+        f"\t\tSkipped {len(base_handler.applied['node'])} nodes and "
+        f"{len(base_handler.applied['way'])} ways already in the OSM file"
+    )
+
+    accumulator.merge_partial_sums(*new_handler.accumulator.get_partial_sums())
+
+    if store is not None:
+        store.write_changed_objects(
+            {
+                node_id: (version, None if deleted else coords)
+                for node_id, (version, deleted, _, coords) in changes.nodes.items()
+                if node_id not in base_handler.applied["node"]
+            },
+            {
+                way_id: (version, *((None, None) if deleted else (tags, node_ids)))
+                for way_id, (version, deleted, tags, node_ids) in changes.ways.items()
+                if way_id not in base_handler.applied["way"]
+            },
+        )
+        store.close()
+
+    return accumulator
@@ -0,0 +1,341 @@
+import struct
+import zlib
+from collections import namedtuple
+
+import numpy as np
+
+# Blob of a PBF file: its type (OSMHeader or OSMData), the offset of its header length prefix,
+# and the sizes of its header and of its data
+BlobInfo = namedtuple("BlobInfo", ("type", "offset", "header_size", "data_size"))
+
+# Maximum size of a BlobHeader allowed by the PBF format
+MAX_BLOB_HEADER_SIZE = 64 * 1024
+
+# Coordinates are stored in nanodegrees in the PBF format, and in units of 1e-7 degrees by osmium
+NANODEGREES_PER_COORDINATE_UNIT = 100
+COORDINATE_PRECISION = 10000000
+
+
+class UnsupportedBlobError(ValueError):
+    """
+    Raised when the data of a blob is compressed with a method other than zlib, such as lzma or
+    zstd, so that the blob can only be read by osmium
+    """
+
+
+def read_varint(buffer, position):
+    """
+    Reads a protobuf varint
+
+    :param buffer: bytes with the encoded message
+    :param position: position of the varint in the buffer
+    :return: (value, position after the varint)
+    """
+
+    value = 0
+    shift = 0
+
+    while True:
+        byte = buffer[position]
+        position += 1
+
+        value |= (byte & 0x7F) << shift
+        shift += 7
+
+        if byte < 0x80:
+            return value, position
+
+
+def to_int64(value):
+    """
+    :param value: varint of a protobuf int64 field, read as unsigned
+    :return: signed value
+    """
+
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def iter_message_fields(buffer):
+    """
+    Iterates over the fields of a protobuf message. Only the varint and
+    length delimited wire types, the ones used by the PBF headers, are supported.
+
+    :param buffer: bytes with the encoded message
+    :return: generator of (field number, value), where value is an int for varints
+        and bytes for length delimited fields
+    """
+
+    position = 0
+
+    while position < len(buffer):
+
+        key, position = read_varint(buffer, position)
+
+        field_number, wire_type = key >> 3, key & 0x07
+
+        if wire_type == 0:
+            value, position = read_varint(buffer, position)
+
+        elif wire_type == 2:
+            length, position = read_varint(buffer, position)
+            value = bytes(buffer[position:position + length])
+            position += length
+
+        else:
+            raise ValueError(f"Unsupported protobuf wire type {wire_type}")
+
+        yield field_number, value
+
+
+def is_pbf_file(osm_file):
+    """
+    Checks if a file is in the PBF format, from the header of its first blob
+
+    :param osm_file: Path to the osm file
+    :return: True if the file is a PBF file, False otherwise
+    """
+
+    with open(osm_file, "rb") as f:
+        start = f.read(4 + 2 + len(b"OSMHeader"))
+
+    return start[6:] == b"OSMHeader"
+
+
+def iter_blob_headers(osm_file):
+    """
+    Iterates over the blobs of a PBF file, reading only their headers and
+    skipping over their data
+
+    :param osm_file: Path to the PBF file
+    :return: generator of BlobInfo
+    """
+
+    with open(osm_file, "rb") as f:
+
+        while True:
+
+            offset = f.tell()
+            prefix = f.read(4)
+
+            if len(prefix) == 0:
+                return
+
+            if len(prefix) < 4:
+                raise ValueError(f"Truncated blob header at offset {offset} of {osm_file}")
+
+            header_size, = struct.unpack(">I", prefix)
+
+            if header_size > MAX_BLOB_HEADER_SIZE:
+                raise ValueError(f"Invalid blob header size {header_size} at offset {offset} of {osm_file}")
+
+            fields = dict(iter_message_fields(f.read(header_size)))
+
+            blob = BlobInfo(fields[1].decode(), offset, header_size, fields[3])
+
+            f.seek(blob.data_size, 1)
+
+            yield blob
+
+
+def read_blob_index(osm_file):
+    """
+    Reads the index of the blobs of a PBF file
+
+    :param osm_file: Path to the PBF file
+    :return: list of BlobInfo
+    """
+
+    return list(iter_blob_headers(osm_file))
+
+
+def read_raw_blobs(f, blobs):
+    """
+    Reads the blobs of a PBF file as they are stored, with their headers and compressed data,
+    so that they can be concatenated into a smaller PBF file
+
+    :param f: PBF file opened in binary mode
+    :param blobs: BlobInfo of the blobs, in file order
+    :return: bytes with the raw blobs
+    """
+
+    chunks = []
+
+    for blob in blobs:
+        f.seek(blob.offset)
+        chunks.append(f.read(4 + blob.header_size + blob.data_size))
+
+    return b"".join(chunks)
+
+
+def read_blob(f, blob):
+    """
+    Reads and decompresses the data of a blob. Only raw and zlib compressed blobs are supported,
+    UnsupportedBlobError is raised for the others.
+
+    :param f: PBF file opened in binary mode
+    :param blob: BlobInfo of the blob
+    :return: bytes with the decompressed blob
+    """
+
+    f.seek(blob.offset + 4 + blob.header_size)
+
+    fields = dict(iter_message_fields(f.read(blob.data_size)))
+
+    if 1 in fields:
+        return fields[1]
+
+    if 3 in fields:
+        return zlib.decompress(fields[3])
+
+    raise UnsupportedBlobError(f"Unsupported compression of the blob at offset {blob.offset}")
+
+
+def count_block_objects(block):
+    """
+    Counts the nodes and ways of a PrimitiveBlock, from the number of ids of its dense nodes and
+    the number of messages of its other groups, without decoding the objects
+
+    :param block: bytes with the decompressed PrimitiveBlock
+    :return: (number of nodes, number of ways)
+    """
+
+    nodes, ways = 0, 0
+
+    for field_number, group in iter_message_fields(block):
+
+        if field_number != 2 or len(group) == 0:
+            continue
+
+        # All the fields of a PrimitiveGroup have the same number, and the keys of the ones
+        # used (1 to 5) are a single byte
+        group_field = group[0] >> 3
+
+        if group_field == 2:
+            for _, dense in iter_message_fields(group):
+                ids = dict(iter_message_fields(dense)).get(1, b"")
+                # Every varint ends with a byte under 0x80
+                nodes += int(np.count_nonzero(np.frombuffer(ids, dtype=np.uint8) < 0x80))
+
+        elif group_field == 1:
+            nodes += sum(1 for _ in iter_message_fields(group))
+
+        elif group_field == 3:
+            ways += sum(1 for _ in iter_message_fields(group))
+
+    return nodes, ways
+
+
+def count_pbf_objects(f, blobs):
+    """
+    Counts the nodes and ways of the data blobs of a PBF file
+
+    :param f: PBF file opened in binary mode
+    :param blobs: BlobInfo of the blobs
+    :return: (number of nodes, number of ways)
+    """
+
+    nodes, ways = 0, 0
+
+    for blob in blobs:
+
+        if blob.type != "OSMData":
+            continue
+
+        block_nodes, block_ways = count_block_objects(read_blob(f, blob))
+
+        nodes += block_nodes
+        ways += block_ways
+
+    return nodes, ways
+
+
+def decode_varints(buffer):
+    """
+    Decodes a packed field of protobuf varints with NumPy
+
+    :param buffer: bytes with the packed varints
+    :return: uint64 array with the decoded values
+    """
+
+    data = np.frombuffer(buffer, dtype=np.uint8)
+
+    if len(data) == 0:
+        return np.zeros(0, dtype=np.uint64)
+
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.concatenate([[0], ends[:-1] + 1])
+
+    positions = np.arange(len(data)) - np.repeat(starts, ends - starts + 1)
+
+    chunks = (data & 0x7F).astype(np.uint64) << (7 * positions).astype(np.uint64)
+
+    return np.add.reduceat(chunks, starts)
+
+
+def decode_zigzag(values):
+    """
+    :param values: uint64 array with zigzag encoded values (protobuf sint64)
+    :return: int64 array with the decoded values
+    """
+
+    return (values >> np.uint64(1)).astype(np.int64) ^ -(values & np.uint64(1)).astype(np.int64)
+
+
+def _to_degrees(values, granularity, offset):
+
+    nanodegrees = offset + granularity * values
+
+    # Truncated towards zero, as osmium does
+    units = np.sign(nanodegrees) * (np.abs(nanodegrees) // NANODEGREES_PER_COORDINATE_UNIT)
+
+    return units / COORDINATE_PRECISION
+
+
+def decode_block_locations(block):
+    """
+    Decodes the node locations of a PrimitiveBlock and counts its ways, without
+    decoding the tags, the members nor the metadata of the objects
+
+    :param block: bytes with the decompressed PrimitiveBlock
+    :return: (array of shape (n, 2) with the lng, lat of the nodes, number of ways)
+    """
+
+    fields = list(iter_message_fields(block))
+
+    block_fields = dict(fields)
+    granularity = block_fields.get(17, 100)
+    lat_offset = to_int64(block_fields.get(19, 0))
+    lon_offset = to_int64(block_fields.get(20, 0))
+
+    lats, lons = [], []
+    ways = 0
+
+    for field_number, group in fields:
+
+        if field_number != 2:
+            continue
+
+        for group_field, value in iter_message_fields(group):
+
+            if group_field == 1:
+                node_fields = dict(iter_message_fields(value))
+                lats.append(decode_zigzag(np.array([node_fields[8]], dtype=np.uint64)))
+                lons.append(decode_zigzag(np.array([node_fields[9]], dtype=np.uint64)))
+
+            elif group_field == 2:
+                dense_fields = dict(iter_message_fields(value))
+                lats.append(np.cumsum(decode_zigzag(decode_varints(dense_fields.get(8, b"")))))
+                lons.append(np.cumsum(decode_zigzag(decode_varints(dense_fields.get(9, b"")))))
+
+            elif group_field == 3:
+                ways += 1
+
+    if len(lats) == 0:
+        return np.zeros((0, 2)), ways
+
+    coords = np.column_stack([
+        _to_degrees(np.concatenate(lons), granularity, lon_offset),
+        _to_degrees(np.concatenate(lats), granularity, lat_offset),
+    ])
+
+    return coords, ways
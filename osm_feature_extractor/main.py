@@ -1,9 +1,6 @@
 import sys
 import os
 import logging
-import json
-
-from turf import feature_collection
 
 try:
     directory_path = "/".join(
@@ -15,85 +12,239 @@ except NameError:
 
 from osm_feature_extractor.utils.config_parser import get_config
 from osm_feature_extractor.utils.logger import configure_logger
-from osm_feature_extractor.feature_extraction.osm_analyzer import analyze_osm_file
+from osm_feature_extractor.utils.metrics import metrics
+from osm_feature_extractor.feature_extraction.osm_analyzer import analyze_osm_file, analyze_osm_header
+from osm_feature_extractor.feature_extraction.density_histogram import (
+    DensityHistogram,
+    get_density_histogram_path,
+)
+from osm_feature_extractor.feature_extraction.osm_locations import get_osm_file_signature
 from osm_feature_extractor.feature_augmenting.data_preparation import (
     process_base_data,
-    load_json,
+    load_polygon_properties,
+    save_json,
+    get_feature_names,
+)
+from osm_feature_extractor.feature_augmenting.base_data_cache import (
+    get_cache_key,
+    get_cache_entry_dir,
+    is_cache_entry_complete,
+    create_cache_entry,
+    touch_cache_entry,
+    evict_cache_entries,
+    POLYGON_INDEX_FILE,
+    FEATURES_FILE,
+)
+from osm_feature_extractor.feature_augmenting.polygon_index import (
+    load_polygon_index,
+    read_polygon_index,
 )
+from osm_feature_extractor.feature_augmenting.data_export import export_data, read_output
+from osm_feature_extractor.feature_augmenting.feature_accumulator import FeatureAccumulator
+from osm_feature_extractor.feature_augmenting.contribution_store import get_contribution_store_path
 from osm_feature_extractor.feature_extraction.osm_extractor_augmenter import (
     extract_features_augment,
 )
+from osm_feature_extractor.feature_extraction.osm_extractor_parallel import (
+    extract_features_parallel,
+)
+from osm_feature_extractor.feature_extraction.osm_extractor_scheduler import (
+    extract_features_batches_parallel,
+)
+from osm_feature_extractor.feature_extraction.osm_updater import update_features
+
 
+def get_base_data_cache_entry(config):
 
-def get_r_tree_name(config):
+    cache_key = get_cache_key(
+        config.input_polygons_file, config.polygons_file, config.max_polygon_vertices
+    )
+
+    return get_cache_entry_dir(config.osm_extractor_files_dir, cache_key)
 
-    input_data_path = config.input_polygons_file
 
-    if os.path.exists(input_data_path):
-        prefix = config.input_polygons_file.split('/')[-1].split('.')[0]
+def write_base_data(config, entry_dir):
+
+    process_base_data(
+        entry_dir,
+        config.input_polygons_file,
+        config.polygons_file,
+        polygon_index_path=os.path.join(entry_dir, POLYGON_INDEX_FILE),
+        max_polygon_vertices=config.max_polygon_vertices,
+    )
 
-    else:
-        prefix = 'world'
+    save_json(get_feature_names(), entry_dir, FEATURES_FILE)
 
-    r_tree_file_name = f"{prefix}_rtree"
-    r_tree_path = os.path.join(config.osm_extractor_files_dir, r_tree_file_name)
-    r_tree_file_path = r_tree_path + '.idx'
 
-    return r_tree_path, r_tree_file_path
+def get_contribution_store_name(config):
+
+    if config.contribution_store is None:
+        return None
+
+    return get_contribution_store_path(config.osm_extractor_files_dir, config.contribution_store)
 
 
 def extract_features(config):
 
     # ========================== Load & prepare input data ==============================
 
-    r_tree_path, r_tree_file_path = get_r_tree_name(config)
+    with metrics.stage("base data"):
 
-    if config.process_base_data or not os.path.exists(r_tree_file_path):
-        logging.info("Processing base data...")
+        entry_dir = get_base_data_cache_entry(config)
 
-        process_base_data(
-            config.osm_extractor_files_dir,
-            config.input_polygons_file,
-            r_tree_path,
-            config.polygons_file,
-            create_r_tree=False,
-        )
+        if config.process_base_data or not is_cache_entry_complete(entry_dir):
+            logging.info("Processing base data...")
 
-    else:
-        logging.info("Importing preprocessed base data...")
+            create_cache_entry(entry_dir, lambda tmp_dir: write_base_data(config, tmp_dir))
 
-    polygons = load_json(
-        osm_extractor_files_dir=config.osm_extractor_files_dir, file_name=config.polygons_file
-    )
+        else:
+            logging.info(f"Importing preprocessed base data from {entry_dir}...")
+
+            touch_cache_entry(entry_dir)
+
+        evict_cache_entries(config.osm_extractor_files_dir, config.base_data_cache_size)
+
+        properties = load_polygon_properties(entry_dir, config.polygons_file)
+
+        with metrics.stage("index build"):
+            polygon_index = read_polygon_index(
+                os.path.join(entry_dir, POLYGON_INDEX_FILE), config.index_node_capacity
+            )
+
+        metrics.count("polygons", len(polygon_index))
 
     # ========================= Extract features & Augment data ===============================
 
     logging.info("Processing OSM data and Augmenting base data...")
 
-    polygons = extract_features_augment(config.osm_file, polygons, r_tree_path)
+    with metrics.stage("osm parse"):
+
+        if config.max_batch_nodes is not None:
+            accumulator = extract_features_batches_parallel(
+                config.osm_file,
+                polygon_index,
+                config.workers,
+                config.max_batch_nodes,
+                config.location_index,
+                config.osm_extractor_files_dir,
+            )
+        elif config.workers > 1:
+            accumulator = extract_features_parallel(
+                config.osm_file,
+                polygon_index,
+                config.workers,
+                config.location_index,
+                config.osm_extractor_files_dir,
+                get_contribution_store_name(config),
+            )
+        else:
+            accumulator = extract_features_augment(
+                config.osm_file,
+                polygon_index,
+                config.location_index,
+                config.osm_extractor_files_dir,
+                get_contribution_store_name(config),
+            )
+
+    metrics.add_counters(accumulator.counters, stage="matching")
 
     # ========================== Export Results ===================================
 
     logging.info("Exporting data...")
 
-    polygons_collection = feature_collection(list(polygons.values()))
+    with metrics.stage("export"):
+
+        export_data(
+            properties, polygon_index, accumulator, config.output_file, config.output_format
+        )
+
+
+def update_output(config):
+
+    with metrics.stage("base data"):
+
+        logging.info(f"Loading previous output {config.previous_output_file}...")
+
+        polygons = read_output(config.previous_output_file, config.previous_output_format)
+
+        with metrics.stage("index build"):
+            polygon_index = load_polygon_index(polygons, node_capacity=config.index_node_capacity)
+
+        accumulator = FeatureAccumulator.from_polygons(polygons, polygon_index.ids)
+
+        metrics.count("polygons", len(polygon_index))
+
+    logging.info("Applying OSM changes...")
+
+    with metrics.stage("osm parse"):
+
+        accumulator = update_features(
+            config.osm_file,
+            config.change_file,
+            polygon_index,
+            accumulator,
+            config.location_index,
+            config.osm_extractor_files_dir,
+            get_contribution_store_name(config),
+        )
+
+    metrics.add_counters(accumulator.counters, stage="matching")
+
+    logging.info("Exporting data...")
+
+    with metrics.stage("export"):
 
-    with open(config.output_file, "w") as f:
-        json.dump(polygons_collection, f)
+        properties = [polygons[polygon_id]["properties"] for polygon_id in polygon_index.ids]
+
+        export_data(
+            properties, polygon_index, accumulator, config.output_file, config.output_format
+        )
+
+
+def report_metrics(config):
+    """
+    Logs the metrics of the stages of the run, and writes them to the metrics file if one was given
+
+    :param config: run configuration
+    :return: None
+    """
+
+    metrics.log_summary()
+
+    if config.metrics_file is not None:
+        metrics.save(config.metrics_file)
 
 
 def analyze_file(config):
 
     filename = config.osm_file.split('/')[-1]
 
+    if config.header_only:
+        logging.info(f"Reading {filename} OSM file header...")
+        bbox, data_blobs, data_size = analyze_osm_header(config.osm_file)
+
+        logging.info(f"\tBounds: {bbox if bbox is not None else 'not in header'}")
+
+        if data_blobs is not None:
+            logging.info(f"\tData blobs: {data_blobs}")
+            logging.info(f"\tData size: {data_size} bytes")
+
+        return
+
     logging.info(f"Analyzing {filename} OSM file...")
-    analysis = analyze_osm_file(config.osm_file)
+    histogram = DensityHistogram()
+    analysis = analyze_osm_file(config.osm_file, histogram, config.workers)
 
     logging.info(f"\tNodes: {analysis[0]}")
     logging.info(f"\tWays: {analysis[1]}")
     logging.info(f"\tBounds: {analysis[2]}")
     logging.info(f"\tCentroid: {analysis[3]}")
 
+    histogram_path = get_density_histogram_path(config.osm_extractor_files_dir, config.osm_file)
+    histogram.save(histogram_path, get_osm_file_signature(config.osm_file))
+
+    logging.info(f"\tDensity histogram: {len(histogram.keys)} cells saved in {histogram_path}")
+
 
 def main():
 
@@ -107,11 +258,16 @@ def main():
         os.makedirs(config.osm_extractor_files_dir)
 
     if config.command == "extract":
-        return extract_features(config)
+        extract_features(config)
+        return report_metrics(config)
 
     elif config.command == "analyze":
         return analyze_file(config)
 
+    elif config.command == "update":
+        update_output(config)
+        return report_metrics(config)
+
 
 if __name__ == "__main__":
     main()
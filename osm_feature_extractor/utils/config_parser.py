@@ -2,6 +2,15 @@ import argparse
 from configparser import ConfigParser
 from distutils.util import strtobool
 
+from osm_feature_extractor.feature_augmenting.data_export import OUTPUT_FORMATS
+from osm_feature_extractor.feature_augmenting.polygon_index import DEFAULT_NODE_CAPACITY, MIN_NODE_CAPACITY
+from osm_feature_extractor.feature_augmenting.polygon_tiling import MIN_POLYGON_VERTICES
+from osm_feature_extractor.feature_extraction.osm_locations import (
+    LOCATION_INDEXES,
+    FILE_LOCATION_INDEXES,
+    REUSABLE_LOCATION_INDEXES,
+)
+
 
 def _convert_booleans(config):
     converted_config = {}
@@ -30,12 +39,31 @@ def _add_extract_sub_parser(subparser, defaults):
     )
 
     parser.add_argument("--output-file", dest='output_file', help="Path to output generated feature augmented file.")
+
+    parser.add_argument(
+        "--output-format",
+        dest='output_format',
+        choices=OUTPUT_FORMATS,
+        help="Format of the output file. geojsonseq writes one GeoJSON feature per line. geoparquet, "
+             "arrow (IPC stream) and feather store the geometries as WKB and require pyarrow",
+        default='geojson',
+    )
     
     parser.add_argument(
         "--process-base-data",
         dest='process_base_data',
-        help="If base data should be loaded or processed",
-        default=True
+        help="If base data should be processed again, even if it is cached. The base data is "
+             "cached under --osm-extractor-files-dir by the content of the input polygons file",
+        default=False
+    )
+
+    parser.add_argument(
+        "--base-data-cache-size",
+        dest='base_data_cache_size',
+        type=int,
+        help="Maximum number of cached base data entries, at least 1. The least recently used ones "
+             "are removed",
+        default=5,
     )
     
     parser.add_argument(
@@ -55,8 +83,78 @@ def _add_extract_sub_parser(subparser, defaults):
     parser.add_argument(
         "--polygons-file",
         dest='polygons_file',
-        help="Name of intermediate step polygons file",
-        default='polygons.geojson',
+        help="Name of intermediate step file with the input properties of the polygons",
+        default='polygons.json',
+    )
+
+    parser.add_argument(
+        "--workers",
+        dest='workers',
+        type=int,
+        help="Number of worker processes. If larger than 1, the blobs of a PBF file are split in "
+             "ranges which are processed in parallel, with the node locations in a shared dense_file_array "
+             "--location-index",
+        default=1,
+    )
+
+    parser.add_argument(
+        "--location-index",
+        dest='location_index',
+        choices=LOCATION_INDEXES,
+        help="Type of index where the node locations are stored. sparse_file_array and dense_file_array "
+             "are stored on disk under --osm-extractor-files-dir, and dense_file_array is reused "
+             "by later runs over the same OSM file. Defaults to dense_file_array with --workers, "
+             "where it is built once and shared by all workers and is required, and with --max-batch-nodes, "
+             "and to flex_mem otherwise",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--max-polygon-vertices",
+        dest='max_polygon_vertices',
+        type=int,
+        help="If set, input polygons with more vertices are split into smaller pieces before "
+             "matching, and the features of the pieces are summed back into each polygon. "
+             f"Must be at least {MIN_POLYGON_VERTICES}",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--index-node-capacity",
+        dest='index_node_capacity',
+        type=int,
+        help="Maximum number of children of each node of the spatial index of the polygons. Smaller "
+             f"nodes test fewer candidates per query but make the tree deeper. Must be at least {MIN_NODE_CAPACITY}",
+        default=DEFAULT_NODE_CAPACITY,
+    )
+
+    parser.add_argument(
+        "--contribution-store",
+        dest='contribution_store',
+        help="Name of a SQLite file under --osm-extractor-files-dir where the contribution of every "
+             "osm object to every polygon feature is recorded. Used by update to subtract the "
+             "contributions of changed objects",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--metrics-file",
+        dest='metrics_file',
+        help="Path of a file where the time, memory and object counts of each stage of the run are "
+             "written, as a Prometheus textfile if it ends with .prom and as JSON otherwise",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--max-batch-nodes",
+        dest='max_batch_nodes',
+        type=int,
+        help="If set, the OSM file is partitioned in batches of the split_bounds grid with at most this "
+             "many nodes each, unless a single 0.01 degree cell has more, which are processed by --workers "
+             "processes in bounded memory. The partitioning requires a file --location-index. Completed "
+             "batches are checkpointed under --osm-extractor-files-dir and an interrupted run resumes "
+             "from them",
+        default=None,
     )
 
     parser.set_defaults(**defaults)
@@ -83,6 +181,112 @@ def _add_analyze_sub_parser(subparser, defaults):
         default='osm_extractor_files_dir',
     )
 
+    parser.add_argument(
+        "--workers",
+        dest='workers',
+        type=int,
+        help="Number of worker processes. If larger than 1, the blobs of a PBF file are decoded "
+             "in parallel",
+        default=1,
+    )
+
+    parser.add_argument(
+        "--header-only",
+        dest='header_only',
+        action='store_true',
+        help="Only read the bounding box from the file header and count the blobs of a PBF file, "
+             "without reading the nodes and ways",
+    )
+
+    parser.set_defaults(**defaults)
+
+
+def _add_update_sub_parser(subparser, defaults):
+
+    parser = subparser.add_parser(
+        "update", help="Updates a previous output with the changes of an OSM change file."
+    )
+
+    defaults = _convert_booleans(defaults)
+
+    parser.add_argument(
+        "--osm-file",
+        dest='osm_file',
+        help="Path to the osm file the previous output was extracted from.",
+    )
+
+    parser.add_argument(
+        "--change-file",
+        dest='change_file',
+        help="Path to the OSM change file (.osc or .osc.gz) to be applied.",
+    )
+
+    parser.add_argument(
+        "--previous-output-file",
+        dest='previous_output_file',
+        help="Path to the output of the previous extraction, in any of the output formats.",
+    )
+
+    parser.add_argument(
+        "--previous-output-format",
+        dest='previous_output_format',
+        choices=OUTPUT_FORMATS,
+        help="Format of the previous output file. Inferred from its extension if not set, and geojson "
+             "for unknown extensions",
+        default=None,
+    )
+
+    parser.add_argument("--output-file", dest='output_file', help="Path to output updated file.")
+
+    parser.add_argument(
+        "--output-format",
+        dest='output_format',
+        choices=OUTPUT_FORMATS,
+        help="Format of the output file.",
+        default='geojson',
+    )
+
+    parser.add_argument(
+        "--osm-extractor-files-dir",
+        dest='osm_extractor_files_dir',
+        help="Directory name of temp / generated extractor files",
+        default='osm_extractor_files_dir',
+    )
+
+    parser.add_argument(
+        "--location-index",
+        dest='location_index',
+        choices=LOCATION_INDEXES,
+        help="Type of index where the node locations are stored.",
+        default='flex_mem',
+    )
+
+    parser.add_argument(
+        "--index-node-capacity",
+        dest='index_node_capacity',
+        type=int,
+        help="Maximum number of children of each node of the spatial index of the polygons. Smaller "
+             f"nodes test fewer candidates per query but make the tree deeper. Must be at least {MIN_NODE_CAPACITY}",
+        default=DEFAULT_NODE_CAPACITY,
+    )
+
+    parser.add_argument(
+        "--contribution-store",
+        dest='contribution_store',
+        help="Name of a SQLite file under --osm-extractor-files-dir where the contribution of every "
+             "osm object to every polygon feature is recorded. Used by update to subtract the "
+             "contributions of changed objects",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--metrics-file",
+        dest='metrics_file',
+        help="Path of a file where the time, memory and object counts of each stage of the run are "
+             "written, as a Prometheus textfile if it ends with .prom and as JSON otherwise",
+        default=None,
+    )
+
     parser.set_defaults(**defaults)
 
 
@@ -122,6 +326,7 @@ def get_config():
 
     _add_extract_sub_parser(subparser, default_config)
     _add_analyze_sub_parser(subparser, default_config)
+    _add_update_sub_parser(subparser, default_config)
 
     config, unknown = parser.parse_known_args(remaining_argv)
 
@@ -129,7 +334,39 @@ def get_config():
             (config.osm_file is None or config.input_polygons_file is None or config.output_file is None)):
         parser.error("--osm-file, --input-polygons-file and --output-file are required if --conf-file is not specified.")
 
+    if (config.command == 'extract' and config.max_batch_nodes is not None and
+            config.contribution_store is not None):
+        parser.error("--contribution-store is not supported with --max-batch-nodes.")
+
+    if config.command == 'extract' and config.base_data_cache_size < 1:
+        parser.error("--base-data-cache-size must be at least 1.")
+
+    if (config.command == 'extract' and config.max_polygon_vertices is not None and
+            config.max_polygon_vertices < MIN_POLYGON_VERTICES):
+        parser.error(f"--max-polygon-vertices must be at least {MIN_POLYGON_VERTICES}.")
+
+    if config.command == 'extract' and config.location_index is None:
+        use_file_index = config.workers > 1 or config.max_batch_nodes is not None
+        config.location_index = "dense_file_array" if use_file_index else "flex_mem"
+
+    if (config.command == 'extract' and config.workers > 1 and config.max_batch_nodes is None and
+            config.location_index not in REUSABLE_LOCATION_INDEXES):
+        parser.error(f"--workers requires a shared --location-index: {', '.join(REUSABLE_LOCATION_INDEXES)}.")
+
+    if (config.command == 'extract' and config.max_batch_nodes is not None and
+            config.location_index not in FILE_LOCATION_INDEXES):
+        parser.error(f"--max-batch-nodes requires a file --location-index: {', '.join(FILE_LOCATION_INDEXES)}.")
+
+    if config.command in ['extract', 'update'] and config.index_node_capacity < MIN_NODE_CAPACITY:
+        parser.error(f"--index-node-capacity must be at least {MIN_NODE_CAPACITY}.")
+
     if config.command == 'analyze' and len(default_config.keys()) == 0 and config.osm_file is None:
         parser.error("--osm-file is required if --conf-file is not specified.")
 
+    if (config.command == 'update' and len(default_config.keys()) == 0 and
+            (config.osm_file is None or config.change_file is None or
+             config.previous_output_file is None or config.output_file is None)):
+        parser.error("--osm-file, --change-file, --previous-output-file and --output-file are required "
+                     "if --conf-file is not specified.")
+
     return config
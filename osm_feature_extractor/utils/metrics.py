@@ -0,0 +1,391 @@
+import json
+import logging
+import os
+import resource
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# Prefix of the names of the Prometheus metrics
+PROMETHEUS_PREFIX = "osm_feature_extractor"
+
+
+# Interval in seconds at which the RSS is sampled where the peak RSS of the process can't be reset
+RSS_SAMPLE_INTERVAL = 0.05
+
+
+def _get_cpu_time():
+
+    # Only the process itself, the time of the worker processes is merged from their own metrics
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+
+    return usage.ru_utime + usage.ru_stime
+
+
+def _read_status_kb(field):
+
+    with open("/proc/self/status", "r") as f:
+        for line in f:
+            if line.startswith(f"{field}:"):
+                return int(line.split()[1]) * 1024
+
+    raise OSError(f"{field} not found in /proc/self/status")
+
+
+class PeakRSS:
+    """
+    Peak RSS of the process since it was last reset. On Linux, the peak kept by the kernel (VmHWM)
+    is reset to the current RSS by writing 5 to /proc/self/clear_refs. Where that is not allowed,
+    the RSS is sampled every RSS_SAMPLE_INTERVAL seconds by a background thread instead, and without
+    /proc, the peak RSS of the whole process life (ru_maxrss) is used.
+
+    Attributes:
+        mode (str): one of clear_refs, sampled or lifetime
+    """
+
+    def __init__(self):
+
+        self.mode = None
+        self._peak = 0
+        self._thread = None
+
+    def _get_mode(self):
+
+        if self.mode is None:
+            try:
+                with open("/proc/self/clear_refs", "w") as f:
+                    f.write("5")
+                _read_status_kb("VmHWM")
+                self.mode = "clear_refs"
+            except OSError:
+                try:
+                    _read_status_kb("VmRSS")
+                    self.mode = "sampled"
+                except OSError:
+                    self.mode = "lifetime"
+
+        if self.mode == "sampled" and (self._thread is None or not self._thread.is_alive()):
+            # Also restarted in forked worker processes, where the thread doesn't exist
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+
+        return self.mode
+
+    def _sample(self):
+
+        while True:
+            self._peak = max(self._peak, _read_status_kb("VmRSS"))
+            time.sleep(RSS_SAMPLE_INTERVAL)
+
+    def reset(self):
+        """
+        Resets the peak RSS to the current RSS of the process
+
+        :return: None
+        """
+
+        mode = self._get_mode()
+
+        if mode == "clear_refs":
+            with open("/proc/self/clear_refs", "w") as f:
+                f.write("5")
+
+        elif mode == "sampled":
+            self._peak = _read_status_kb("VmRSS")
+
+    def read(self):
+        """
+        :return: peak RSS of the process in bytes since the last reset
+        """
+
+        mode = self._get_mode()
+
+        if mode == "clear_refs":
+            return _read_status_kb("VmHWM")
+
+        if mode == "sampled":
+            self._peak = max(self._peak, _read_status_kb("VmRSS"))
+            return self._peak
+
+        # ru_maxrss is in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class StageMetrics:
+    """
+    Metrics of a stage of a run. The times only include the time spent in the stage
+    itself, not in the stages nested in it.
+
+    Attributes:
+        calls (int): number of times the stage was entered
+        wall_time (float): wall time in seconds of the main process
+        cpu_time (float): user and system CPU time in seconds, of the main process and of the worker processes
+        max_rss (int): peak RSS in bytes reached within the stage, by the main process or by any single
+            worker process
+        counters (Counter): counts of the objects processed in the stage
+    """
+
+    def __init__(self):
+
+        self.calls = 0
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self.max_rss = 0
+        self.counters = Counter()
+
+    def to_dict(self):
+        return {
+            "calls": self.calls,
+            "wall_time": round(self.wall_time, 6),
+            "cpu_time": round(self.cpu_time, 6),
+            "max_rss": self.max_rss,
+            "counters": dict(self.counters),
+        }
+
+
+class Metrics:
+    """
+    Records the metrics of the stages of a run, in the order they are first entered.
+    Stages can be nested, and entered several times, in which case their metrics are summed.
+    The metrics of the tasks run by worker processes are recorded with record_task and added
+    to the stages of the main process with merge.
+
+    Attributes:
+        stages (dict): StageMetrics of each stage by name
+        peak_rss (PeakRSS): peak RSS of the process, reset when a stage is entered
+    """
+
+    def __init__(self):
+
+        self.stages = {}
+        self.peak_rss = PeakRSS()
+        self._stack = []
+        self._worker_stage = None
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Context manager that records the time spent in a stage
+
+        :param name: name of the stage
+        """
+
+        stage_metrics = self.stages.setdefault(name, StageMetrics())
+
+        # The peak RSS is reset for the new stage, so the peak reached so far in the enclosing one is kept
+        if self._stack:
+            self._stack[-1][1][2] = max(self._stack[-1][1][2], self.peak_rss.read())
+
+        self.peak_rss.reset()
+
+        # [wall time, cpu time, peak rss] of the nested stages
+        nested = [0.0, 0.0, 0]
+        self._stack.append((name, nested))
+
+        start_wall, start_cpu = time.perf_counter(), _get_cpu_time()
+
+        try:
+            yield stage_metrics
+        finally:
+            wall_time, cpu_time = time.perf_counter() - start_wall, _get_cpu_time() - start_cpu
+
+            self._stack.pop()
+
+            stage_metrics.calls += 1
+            stage_metrics.wall_time += wall_time - nested[0]
+            stage_metrics.cpu_time += cpu_time - nested[1]
+            max_rss = max(self.peak_rss.read(), nested[2])
+            stage_metrics.max_rss = max(stage_metrics.max_rss, max_rss)
+
+            if self._stack:
+                self._stack[-1][1][0] += wall_time
+                self._stack[-1][1][1] += cpu_time
+                self._stack[-1][1][2] = max(self._stack[-1][1][2], max_rss)
+
+    def count(self, name, value=1, stage=None):
+        """
+        Adds to a counter of a stage
+
+        :param name: name of the counter
+        :param value: value added to the counter
+        :param stage: name of the stage. The innermost stage being recorded if None
+        :return: None
+        """
+
+        if stage is None:
+            if not self._stack:
+                return
+
+            stage = self._stack[-1][0]
+
+        self.stages.setdefault(stage, StageMetrics()).counters[name] += value
+
+    def add_counters(self, counters, stage=None):
+        """
+        Adds several counters to a stage
+
+        :param counters: mapping of counter names to values
+        :param stage: name of the stage. The innermost stage being recorded if None
+        :return: None
+        """
+
+        for name, value in counters.items():
+            self.count(name, value, stage)
+
+    def record_task(self, function, *args):
+        """
+        Runs a task in a worker process forked within a stage, recording its metrics in a stage
+        with the same name, so that they can be merged into the stages of the main process
+
+        :param function: function of the task
+        :param args: arguments of the function
+        :return: (result of the function, StageMetrics of each stage recorded by the task)
+        """
+
+        if self._stack:
+            # Stage the worker process was forked in, by the first task it runs
+            self._worker_stage = self._stack[-1][0]
+            self._stack = []
+
+        if self._worker_stage is None:
+            return function(*args), {}
+
+        self.stages = {}
+
+        with self.stage(self._worker_stage):
+            result = function(*args)
+
+        return result, self.stages
+
+    def merge(self, stages):
+        """
+        Adds the metrics recorded by a task of a worker process to the stages. Only the CPU time,
+        the peak RSS and the counters are merged, since the workers run within the wall time of
+        the stages of the main process.
+
+        :param stages: StageMetrics of each stage by name, as returned by record_task
+        :return: None
+        """
+
+        for name, worker_metrics in stages.items():
+
+            stage_metrics = self.stages.setdefault(name, StageMetrics())
+
+            stage_metrics.cpu_time += worker_metrics.cpu_time
+            stage_metrics.max_rss = max(stage_metrics.max_rss, worker_metrics.max_rss)
+            stage_metrics.counters.update(worker_metrics.counters)
+
+    def to_dict(self):
+        return {name: stage_metrics.to_dict() for name, stage_metrics in self.stages.items()}
+
+    def get_summary_table(self):
+        """
+        :return: list with the lines of a table with the metrics of each stage
+        """
+
+        header = f"{'Stage':<16}{'Calls':>8}{'Wall (s)':>12}{'CPU (s)':>12}{'Max RSS (MB)':>16}  Counters"
+
+        lines = [header, "-" * len(header)]
+
+        for name, stage_metrics in self.stages.items():
+
+            counters = ", ".join(
+                f"{counter}={value}" for counter, value in sorted(stage_metrics.counters.items())
+            )
+
+            lines.append(
+                f"{name:<16}{stage_metrics.calls:>8}{stage_metrics.wall_time:>12.3f}"
+                f"{stage_metrics.cpu_time:>12.3f}{stage_metrics.max_rss / 2 ** 20:>16.1f}  {counters}"
+            )
+
+        lines.append("-" * len(header))
+        lines.append(
+            f"{'total':<16}{'':>8}{sum(s.wall_time for s in self.stages.values()):>12.3f}"
+            f"{sum(s.cpu_time for s in self.stages.values()):>12.3f}"
+            f"{max([s.max_rss for s in self.stages.values()], default=0) / 2 ** 20:>16.1f}"
+        )
+
+        return lines
+
+    def log_summary(self):
+        """
+        Logs the summary table of the metrics of each stage
+
+        :return: None
+        """
+
+        logging.info("Run metrics:")
+
+        for line in self.get_summary_table():
+            logging.info(f"\t{line}")
+
+    def to_prometheus(self):
+        """
+        :return: the metrics in the Prometheus text exposition format
+        """
+
+        gauges = [
+            ("stage_calls", "Number of times each stage was entered", "calls"),
+            ("stage_wall_seconds", "Wall time spent in each stage", "wall_time"),
+            ("stage_cpu_seconds", "CPU time spent in each stage", "cpu_time"),
+            ("stage_max_rss_bytes", "Peak RSS of a single process within each stage", "max_rss"),
+        ]
+
+        lines = []
+
+        for metric, description, attribute in gauges:
+
+            lines.append(f"# HELP {PROMETHEUS_PREFIX}_{metric} {description}")
+            lines.append(f"# TYPE {PROMETHEUS_PREFIX}_{metric} gauge")
+
+            for name, stage_metrics in self.stages.items():
+                value = getattr(stage_metrics, attribute)
+                lines.append(f'{PROMETHEUS_PREFIX}_{metric}{{stage="{name}"}} {value}')
+
+        metric = f"{PROMETHEUS_PREFIX}_stage_objects"
+
+        lines.append(f"# HELP {metric} Counts of the objects processed in each stage")
+        lines.append(f"# TYPE {metric} gauge")
+
+        for name, stage_metrics in self.stages.items():
+            for counter, value in sorted(stage_metrics.counters.items()):
+                lines.append(f'{metric}{{stage="{name}",counter="{counter}"}} {value}')
+
+        return "\n".join(lines) + "\n"
+
+    def save(self, metrics_file):
+        """
+        Writes the metrics to a Prometheus textfile if metrics_file ends with .prom,
+        and to a JSON file otherwise. The file is replaced atomically, so that it can
+        be read by a textfile collector at any time.
+
+        :param metrics_file: path of the metrics file
+        :return: None
+        """
+
+        with open(f"{metrics_file}.tmp", "w") as f:
+            if metrics_file.endswith(".prom"):
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.to_dict(), f, indent=4)
+
+        os.replace(f"{metrics_file}.tmp", metrics_file)
+
+        logging.info(f"\tMetrics written to {metrics_file}")
+
+
+metrics = Metrics()
+
+
+def record_task(function, *args):
+    """
+    Runs a task in a worker process, recording its metrics with Metrics.record_task. Being a module
+    function, it can be passed to a process pool along with the function of the task.
+
+    :param function: function of the task
+    :param args: arguments of the function
+    :return: (result of the function, StageMetrics of each stage recorded by the task)
+    """
+
+    return metrics.record_task(function, *args)
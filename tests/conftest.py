@@ -0,0 +1,297 @@
+import json
+import sys
+
+import numpy as np
+import osmium
+import pytest
+from osmium.osm.mutable import Node, Way
+from shapely.geometry import shape
+
+from osm_feature_extractor import main as cli
+from osm_feature_extractor.feature_augmenting.data_export import read_output
+
+# [west, south, east, north] of the synthetic data
+BBOX = (-1.0, 50.0, -0.6, 50.3)
+
+# Number of cells of the polygon grid in each direction
+GRID_CELLS = (6, 5)
+
+NODE_TAGS = [
+    {"amenity": "cafe"},
+    {"amenity": "school"},
+    {"shop": "bakery"},
+    {"highway": "bus_stop"},
+    {"tourism": "hotel"},
+]
+
+LINE_TAGS = [{"highway": "primary"}, {"highway": "residential"}, {"railway": "rail"}]
+
+AREA_TAGS = [{"building": "house"}, {"landuse": "residential"}, {"leisure": "park"}]
+
+
+def make_osm_data(seed=0, nodes=3000, ways=600):
+    """
+    Builds the objects of a synthetic osm file, with tagged and untagged nodes, lines and
+    closed areas, some of them crossing the cells of the polygon grid
+
+    :return: (dict with the [version, (lon, lat), tags] of each node, dict with the
+        [version, node ids, tags] of each way)
+    """
+
+    rng = np.random.default_rng(seed)
+    west, south, east, north = BBOX
+
+    osm_nodes = {}
+
+    for node_id, (lon, lat) in enumerate(rng.uniform([west, south], [east, north], size=(nodes, 2)), 1):
+        tags = NODE_TAGS[rng.integers(len(NODE_TAGS))] if rng.random() < 0.3 else {}
+        osm_nodes[node_id] = [1, (round(lon, 7), round(lat, 7)), tags]
+
+    osm_ways = {}
+    node_id = nodes + 1
+
+    for way_id in range(1, ways + 1):
+
+        start = rng.uniform([west + 0.02, south + 0.02], [east - 0.02, north - 0.02])
+
+        if rng.random() < 0.4:
+            side = rng.uniform(0.002, 0.02)
+            points = start + np.array([[0, 0], [side, 0], [side, side], [0, side]])
+            tags = AREA_TAGS[rng.integers(len(AREA_TAGS))]
+        else:
+            points = start + np.cumsum(rng.normal(0, 0.01, size=(rng.integers(2, 8), 2)), axis=0)
+            tags = LINE_TAGS[rng.integers(len(LINE_TAGS))]
+
+        node_ids = []
+
+        for lon, lat in np.clip(points, [west, south], [east, north]):
+            osm_nodes[node_id] = [1, (round(lon, 7), round(lat, 7)), {}]
+            node_ids.append(node_id)
+            node_id += 1
+
+        if "highway" not in tags and "railway" not in tags:
+            node_ids.append(node_ids[0])
+
+        osm_ways[way_id] = [1, node_ids, tags]
+
+    return osm_nodes, osm_ways
+
+
+def write_osm_file(path, osm_nodes, osm_ways):
+
+    writer = osmium.SimpleWriter(str(path))
+
+    try:
+        for node_id in sorted(osm_nodes):
+            version, location, tags = osm_nodes[node_id]
+            writer.add_node(Node(id=node_id, version=version, location=location, tags=tags))
+
+        for way_id in sorted(osm_ways):
+            version, node_ids, tags = osm_ways[way_id]
+            writer.add_way(Way(id=way_id, version=version, nodes=node_ids, tags=tags))
+    finally:
+        writer.close()
+
+
+def _node_xml(node_id, version, location, tags):
+
+    tags_xml = "".join(f'<tag k="{key}" v="{value}"/>' for key, value in tags.items())
+
+    return f'<node id="{node_id}" version="{version}" lon="{location[0]:.7f}" lat="{location[1]:.7f}">{tags_xml}</node>'
+
+
+def _way_xml(way_id, version, node_ids, tags):
+
+    nodes_xml = "".join(f'<nd ref="{node_id}"/>' for node_id in node_ids)
+    tags_xml = "".join(f'<tag k="{key}" v="{value}"/>' for key, value in tags.items())
+
+    return f'<way id="{way_id}" version="{version}">{nodes_xml}{tags_xml}</way>'
+
+
+def make_changes(osm_nodes, osm_ways, seed=1):
+    """
+    Applies random changes to copies of the osm objects: tagged nodes are moved, retagged,
+    deleted and created, untagged way nodes are moved, and ways are retagged and deleted
+
+    :return: (changed nodes, changed ways, osmChange XML document)
+    """
+
+    rng = np.random.default_rng(seed)
+
+    nodes = {node_id: list(node) for node_id, node in osm_nodes.items()}
+    ways = {way_id: list(way) for way_id, way in osm_ways.items()}
+
+    operations = {"create": [], "modify": [], "delete": []}
+
+    tagged = [node_id for node_id, node in nodes.items() if node[2]]
+    way_nodes = sorted({node_id for way in ways.values() for node_id in way[1]})
+
+    for node_id in rng.choice(tagged, 60, replace=False).tolist():
+        version, (lon, lat), tags = nodes[node_id]
+        location = (round(lon + rng.uniform(-0.05, 0.05), 7), round(lat + rng.uniform(-0.05, 0.05), 7))
+        nodes[node_id] = [version + 1, location, NODE_TAGS[rng.integers(len(NODE_TAGS))]]
+        operations["modify"].append(_node_xml(node_id, *nodes[node_id]))
+
+    for node_id in rng.choice([i for i in tagged if nodes[i][0] == 1], 30, replace=False).tolist():
+        version, location, _ = nodes.pop(node_id)
+        operations["delete"].append(_node_xml(node_id, version + 1, location, {}))
+
+    for node_id in rng.choice(way_nodes, 80, replace=False).tolist():
+        version, (lon, lat), tags = nodes[node_id]
+        nodes[node_id] = [version + 1, (round(lon + rng.uniform(-0.01, 0.01), 7), lat), tags]
+        operations["modify"].append(_node_xml(node_id, *nodes[node_id]))
+
+    new_id = max(nodes) + 1
+
+    for lon, lat in rng.uniform(BBOX[:2], BBOX[2:], size=(40, 2)):
+        nodes[new_id] = [1, (round(lon, 7), round(lat, 7)), {"shop": "bakery"}]
+        operations["create"].append(_node_xml(new_id, *nodes[new_id]))
+        new_id += 1
+
+    way_ids = sorted(ways)
+
+    for way_id in rng.choice(way_ids, 50, replace=False).tolist():
+        version, node_ids, _ = ways[way_id]
+        tags = LINE_TAGS[0] if node_ids[0] != node_ids[-1] else AREA_TAGS[0]
+        ways[way_id] = [version + 1, node_ids, tags]
+        operations["modify"].append(_way_xml(way_id, *ways[way_id]))
+
+    for way_id in rng.choice([i for i in way_ids if ways[i][0] == 1], 30, replace=False).tolist():
+        version = ways.pop(way_id)[0]
+        operations["delete"].append(f'<way id="{way_id}" version="{version + 1}"/>')
+
+    document = "\n".join(
+        ['<osmChange version="0.6">']
+        + [f"<{operation}>{''.join(objects)}</{operation}>" for operation, objects in operations.items()]
+        + ["</osmChange>"]
+    )
+
+    return nodes, ways, document
+
+
+def write_polygon_grid(path):
+
+    west, south, east, north = BBOX
+    xs = np.linspace(west, east, GRID_CELLS[0] + 1).tolist()
+    ys = np.linspace(south, north, GRID_CELLS[1] + 1).tolist()
+
+    features = [
+        {
+            "type": "Feature",
+            "id": f"{i}_{j}",
+            "properties": {"name": f"cell {i} {j}"},
+            "geometry": {
+                "type": "Polygon",
+                "coordinates": [[
+                    [xs[i], ys[j]], [xs[i + 1], ys[j]], [xs[i + 1], ys[j + 1]], [xs[i], ys[j + 1]], [xs[i], ys[j]]
+                ]],
+            },
+        }
+        for i in range(GRID_CELLS[0])
+        for j in range(GRID_CELLS[1])
+    ]
+
+    with open(path, "w") as f:
+        json.dump({"type": "FeatureCollection", "features": features}, f)
+
+
+@pytest.fixture(scope="session")
+def osm_data(tmp_path_factory):
+    """
+    Synthetic osm file, the same file with a change file applied, the change file and a grid of polygons
+
+    :return: dict with the paths of the files
+    """
+
+    data_dir = tmp_path_factory.mktemp("osm_data")
+
+    osm_nodes, osm_ways = make_osm_data()
+    changed_nodes, changed_ways, change_document = make_changes(osm_nodes, osm_ways)
+
+    paths = {
+        "osm_file": data_dir / "synthetic.osm.pbf",
+        "changed_osm_file": data_dir / "changed.osm.pbf",
+        "change_file": data_dir / "changes.osc",
+        "polygons_file": data_dir / "grid.geojson",
+    }
+
+    write_osm_file(paths["osm_file"], osm_nodes, osm_ways)
+    write_osm_file(paths["changed_osm_file"], changed_nodes, changed_ways)
+    paths["change_file"].write_text(change_document)
+    write_polygon_grid(paths["polygons_file"])
+
+    return {name: str(path) for name, path in paths.items()}
+
+
+def run_cli(monkeypatch, *args):
+    """
+    Runs the command line interface with the given arguments
+
+    :return: None
+    """
+
+    monkeypatch.setattr(sys, "argv", ["osm_feature_extractor", *map(str, args)])
+
+    cli.main()
+
+
+def extract(monkeypatch, osm_data, files_dir, output_file, *args, osm_file=None):
+    """
+    Runs extract over the synthetic data and reads its output
+
+    :return: dict with the output features by id
+    """
+
+    run_cli(
+        monkeypatch,
+        "extract",
+        "--osm-file", osm_file or osm_data["osm_file"],
+        "--input-polygons-file", osm_data["polygons_file"],
+        "--output-file", output_file,
+        "--osm-extractor-files-dir", files_dir,
+        *args,
+    )
+
+    return read_output(str(output_file))
+
+
+def assert_same_features(features, expected, rel=1e-9, abs=1e-6):
+    """
+    Checks that two outputs have the same polygons with the same properties, comparing
+    the floating point features with a relative and an absolute tolerance
+    """
+
+    assert features.keys() == expected.keys()
+
+    for polygon_id, feature in features.items():
+
+        properties = feature["properties"]
+        expected_properties = expected[polygon_id]["properties"]
+
+        assert properties.keys() == expected_properties.keys()
+        assert shape(feature["geometry"]).equals(shape(expected[polygon_id]["geometry"]))
+
+        for key, value in properties.items():
+            if isinstance(value, float):
+                assert value == pytest.approx(expected_properties[key], rel=rel, abs=abs), (polygon_id, key)
+            else:
+                assert value == expected_properties[key], (polygon_id, key)
+
+
+@pytest.fixture(scope="session")
+def baseline_dir(tmp_path_factory):
+    return tmp_path_factory.mktemp("baseline")
+
+
+@pytest.fixture(scope="session")
+def baseline(osm_data, baseline_dir):
+    """
+    Output of a single process extraction of the synthetic data, which the other modes are compared to
+
+    :return: dict with the output features by id
+    """
+
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        return extract(
+            monkeypatch, osm_data, baseline_dir / "files", baseline_dir / "baseline.geojson"
+        )
@@ -0,0 +1,43 @@
+import os
+
+import pytest
+
+from osm_feature_extractor.feature_augmenting.base_data_cache import CACHE_DIR_NAME, get_cache_key
+
+from conftest import extract, run_cli
+
+
+def test_cache_key_depends_on_the_options_of_the_entry(osm_data):
+
+    polygons_file = osm_data["polygons_file"]
+
+    key = get_cache_key(polygons_file, "polygons.json")
+
+    assert get_cache_key(polygons_file, "polygons.json") == key
+    assert get_cache_key(polygons_file, "other_polygons.json") != key
+    assert get_cache_key(polygons_file, "polygons.json", 1000) != key
+
+
+def test_polygons_file_names_get_their_own_entries(monkeypatch, tmp_path, osm_data, baseline):
+
+    for polygons_file in ["polygons.json", "other_polygons.json"]:
+        features = extract(
+            monkeypatch, osm_data, tmp_path / "files", tmp_path / "output.geojson", "--polygons-file", polygons_file
+        )
+
+        assert features.keys() == baseline.keys()
+
+    assert len(os.listdir(tmp_path / "files" / CACHE_DIR_NAME)) == 2
+
+
+def test_base_data_cache_size_must_be_positive(monkeypatch, tmp_path, osm_data):
+
+    with pytest.raises(SystemExit):
+        run_cli(
+            monkeypatch,
+            "extract",
+            "--osm-file", osm_data["osm_file"],
+            "--input-polygons-file", osm_data["polygons_file"],
+            "--output-file", tmp_path / "output.geojson",
+            "--base-data-cache-size", 0,
+        )
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from osm_feature_extractor.feature_augmenting.contribution_store import ContributionStore
+from osm_feature_extractor.feature_augmenting.features_table import feature_names
+
+
+@pytest.fixture
+def store(tmp_path):
+
+    store = ContributionStore(str(tmp_path / "contributions.db"))
+    store.reset(["a", "b", "c"])
+
+    yield store
+
+    store.close()
+
+
+def test_pop_returns_and_removes_the_contributions(store):
+
+    store.write("node", np.array([1, 1, 2]), np.array([1, 1, 3]), np.array([0, 2, 1]), np.array([0, 4, 0]),
+                np.array([1.0, 2.0, 3.0]))
+    store.write("way", np.array([1]), np.array([2]), np.array([1]), np.array([5]), np.array([7.5]))
+
+    assert store.get_versions("node", [1, 2, 3]) == {1: 1, 2: 3}
+
+    rows, columns, values = store.pop("node", [1])
+
+    assert sorted(zip(rows.tolist(), columns.tolist(), values.tolist())) == [(0, 0, 1.0), (2, 4, 2.0)]
+    assert store.get_versions("node", [1, 2]) == {2: 3}
+    assert store.get_versions("way", [1]) == {1: 2}
+
+    rows, columns, values = store.pop("node", [5])
+
+    assert len(rows) == len(columns) == len(values) == 0
+
+
+def test_polygon_contributions_are_queried_by_id(store):
+
+    store.write("way", np.array([7]), np.array([1]), np.array([1]), np.array([3]), np.array([12.5]))
+
+    assert store.get_polygon_contributions("b") == [("way", 7, 1, feature_names[3], 12.5)]
+    assert store.get_polygon_contributions("a") == []
+
+
+def test_check_polygons(store):
+
+    store.check_polygons(["a", "b", "c"])
+
+    with pytest.raises(ValueError):
+        store.check_polygons(["a", "c", "b"])
+
+
+def test_changed_objects_are_kept_until_reset(store):
+
+    store.write_changed_objects(
+        {1: (2, (0.5, 1.5)), 2: (3, None)},
+        {10: (2, {"highway": "primary"}, [1, 3]), 11: (4, None, None)},
+    )
+
+    assert store.get_changed_nodes() == {1: (0.5, 1.5), 2: None}
+    assert store.get_changed_ways() == {10: (2, {"highway": "primary"}, [1, 3]), 11: None}
+
+    store.reset(["a"])
+
+    assert store.get_changed_nodes() == {}
+    assert store.get_changed_ways() == {}
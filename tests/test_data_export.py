@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+import shapely
+
+from osm_feature_extractor.feature_augmenting.data_export import (
+    OUTPUT_FORMATS,
+    export_data,
+    get_output_format,
+    iter_features,
+    read_output,
+)
+from osm_feature_extractor.feature_augmenting.feature_accumulator import FeatureAccumulator
+from osm_feature_extractor.feature_augmenting.polygon_index import build_polygon_index
+
+from conftest import assert_same_features
+from test_extract import OUTPUT_EXTENSIONS
+
+
+@pytest.mark.parametrize(
+    "output_file, output_format",
+    [
+        ("out.geojson", "geojson"),
+        ("out.json", "geojson"),
+        ("out.geojsonl", "geojsonseq"),
+        ("dir.v1/out.PARQUET", "geoparquet"),
+        ("out.arrow", "arrow"),
+        ("out.feather", "feather"),
+        ("out.csv", "csv"),
+        ("out", "geojson"),
+    ],
+)
+def test_get_output_format(output_file, output_format):
+    assert get_output_format(output_file) == output_format
+
+
+def make_export_data():
+
+    polygon_index = build_polygon_index(
+        ["10", "11", "12"], [shapely.box(0, 0, 1, 1), shapely.box(1, 0, 2, 1), shapely.box(0, 1, 1, 2)]
+    )
+
+    accumulator = FeatureAccumulator(len(polygon_index))
+    length_feature = next(feature for feature in accumulator.features if feature.endswith("_length"))
+    count_feature = next(feature for feature in accumulator.features if feature.endswith("_count"))
+
+    accumulator.add(
+        np.array([0, 0, 2]),
+        np.array([accumulator.columns[length_feature], accumulator.columns[count_feature], 0]),
+        np.array([12.34, 3.0, 1.0]),
+    )
+
+    # The input properties have an id of their own, and a value missing from one of the polygons
+    properties = [{"id": "a", "name": "first"}, {"id": "b"}, {"id": "c", "name": "third"}]
+
+    return properties, polygon_index, accumulator
+
+
+@pytest.mark.parametrize("output_format", OUTPUT_FORMATS)
+def test_read_output_reads_every_format(tmp_path, output_format):
+
+    if output_format in ["geoparquet", "arrow", "feather"]:
+        pytest.importorskip("pyarrow")
+
+    properties, polygon_index, accumulator = make_export_data()
+    output_file = str(tmp_path / f"output.{OUTPUT_EXTENSIONS[output_format]}")
+
+    export_data(properties, polygon_index, accumulator, output_file, output_format)
+
+    expected = {
+        feature["id"]: feature for feature in iter_features(properties, polygon_index, accumulator)
+    }
+
+    features = read_output(output_file)
+
+    assert_same_features(features, expected)
+    assert features["11"]["properties"]["id"] == "b"
+    assert "name" not in features["11"]["properties"]
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from osm_feature_extractor.feature_extraction.density_histogram import (
+    DensityHistogram,
+    count_shard_nodes,
+    split_bounds_by_density,
+)
+
+
+def make_clustered_coords(seed=0):
+
+    rng = np.random.default_rng(seed)
+
+    # A dense city, a smaller town and sparse nodes around them
+    return np.concatenate([
+        rng.normal([2.35, 48.85], 0.05, size=(60000, 2)),
+        rng.normal([4.8, 45.75], 0.03, size=(20000, 2)),
+        rng.uniform([-1.0, 43.0], [8.0, 51.0], size=(20000, 2)),
+    ])
+
+
+def test_histogram_blocks_merge_into_the_same_cells():
+
+    coords = make_clustered_coords()
+
+    histogram = DensityHistogram()
+    histogram.add(coords)
+
+    blocks = DensityHistogram()
+    for block in np.array_split(coords, 7):
+        other = DensityHistogram()
+        other.add(block)
+        blocks.merge(other)
+
+    for cells, block_cells in zip(histogram.get_cells(), blocks.get_cells()):
+        np.testing.assert_array_equal(cells, block_cells)
+
+    np.testing.assert_array_equal(histogram.bbox, blocks.bbox)
+    assert histogram.total == blocks.total == len(coords)
+
+
+@pytest.mark.parametrize("max_nodes_box", [5000, 20000])
+def test_split_bounds_by_density_bounds_the_shard_nodes(max_nodes_box):
+
+    histogram = DensityHistogram()
+    histogram.add(make_clustered_coords())
+
+    xy_divisions = split_bounds_by_density(histogram, max_nodes_box)
+
+    shard_nodes = count_shard_nodes(histogram, xy_divisions)
+
+    assert shard_nodes.sum() == histogram.total
+    assert shard_nodes.max() <= max_nodes_box
+
+    x_divisions, y_divisions = xy_divisions
+
+    assert np.all(np.diff(x_divisions) > 0)
+    assert all(np.all(np.diff(column_divisions) > 0) for column_divisions in y_divisions)
+    assert x_divisions[0] == histogram.bbox[0] and x_divisions[-1] == histogram.bbox[2]
+
+
+def test_only_single_cells_can_exceed_max_nodes_box():
+
+    histogram = DensityHistogram()
+    histogram.add(np.concatenate([np.full((3000, 2), [10.005, 20.005]), make_clustered_coords()[:5000]]))
+
+    shard_nodes = count_shard_nodes(histogram, split_bounds_by_density(histogram, 1000))
+
+    assert shard_nodes.max() == 3000
+    assert np.sort(shard_nodes)[-2] <= 1000
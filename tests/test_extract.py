@@ -0,0 +1,126 @@
+import pytest
+
+from osm_feature_extractor.feature_augmenting.data_export import OUTPUT_FORMATS, read_output
+
+from conftest import assert_same_features, extract, run_cli
+
+# Extension of the output file of each format, from which update infers the format
+OUTPUT_EXTENSIONS = {
+    "geojson": "geojson",
+    "geojsonseq": "geojsonl",
+    "geoparquet": "parquet",
+    "arrow": "arrow",
+    "feather": "feather",
+    "csv": "csv",
+}
+
+
+def test_baseline_counts_all_objects(osm_data, baseline):
+
+    # Every synthetic polygon has objects, and the cells tile the bounding box of the nodes
+    assert all(feature["properties"]["updated"] for feature in baseline.values())
+    assert sum(feature["properties"]["shop_food_count"] for feature in baseline.values()) > 0
+
+
+def test_workers_match_single_process(monkeypatch, tmp_path, osm_data, baseline):
+
+    features = extract(monkeypatch, osm_data, tmp_path / "files", tmp_path / "output.geojson", "--workers", 3)
+
+    assert_same_features(features, baseline)
+
+
+@pytest.mark.parametrize("max_batch_nodes", [2000, 500])
+def test_batches_match_single_process(monkeypatch, tmp_path, osm_data, baseline, max_batch_nodes):
+
+    features = extract(
+        monkeypatch,
+        osm_data,
+        tmp_path / "files",
+        tmp_path / "output.geojson",
+        "--max-batch-nodes", max_batch_nodes,
+        "--workers", 2,
+    )
+
+    # The ways that cross the batch borders are split in pieces, and the length or area of each
+    # piece is rounded to centimeters, so the sums can differ from the ones of the whole ways
+    assert_same_features(features, baseline, rel=1e-6, abs=0.05)
+
+
+def test_tiled_polygons_match_single_process(monkeypatch, tmp_path, osm_data, baseline):
+
+    features = extract(
+        monkeypatch, osm_data, tmp_path / "files", tmp_path / "output.geojson", "--max-polygon-vertices", 5
+    )
+
+    assert_same_features(features, baseline, rel=1e-6)
+
+
+@pytest.mark.parametrize("output_format", OUTPUT_FORMATS)
+def test_export_round_trip(monkeypatch, tmp_path, osm_data, baseline, output_format):
+
+    if output_format in ["geoparquet", "arrow", "feather"]:
+        pytest.importorskip("pyarrow")
+
+    output_file = tmp_path / f"output.{OUTPUT_EXTENSIONS[output_format]}"
+
+    features = extract(
+        monkeypatch, osm_data, tmp_path / "files", output_file, "--output-format", output_format
+    )
+
+    assert_same_features(features, baseline)
+
+
+def test_update_matches_fresh_extract(monkeypatch, tmp_path, osm_data, baseline_dir, baseline):
+
+    run_cli(
+        monkeypatch,
+        "update",
+        "--osm-file", osm_data["osm_file"],
+        "--change-file", osm_data["change_file"],
+        "--previous-output-file", baseline_dir / "baseline.geojson",
+        "--output-file", tmp_path / "updated.geojson",
+        "--osm-extractor-files-dir", tmp_path / "files",
+    )
+
+    expected = extract(
+        monkeypatch,
+        osm_data,
+        tmp_path / "files",
+        tmp_path / "expected.geojson",
+        osm_file=osm_data["changed_osm_file"],
+    )
+
+    assert_same_features(read_output(str(tmp_path / "updated.geojson")), expected, rel=1e-6)
+
+
+def test_update_with_contribution_store_matches_fresh_extract(monkeypatch, tmp_path, osm_data):
+
+    extract(
+        monkeypatch,
+        osm_data,
+        tmp_path / "files",
+        tmp_path / "output.parquet",
+        "--output-format", "geoparquet",
+        "--contribution-store", "contributions.db",
+    )
+
+    run_cli(
+        monkeypatch,
+        "update",
+        "--osm-file", osm_data["osm_file"],
+        "--change-file", osm_data["change_file"],
+        "--previous-output-file", tmp_path / "output.parquet",
+        "--output-file", tmp_path / "updated.geojson",
+        "--osm-extractor-files-dir", tmp_path / "files",
+        "--contribution-store", "contributions.db",
+    )
+
+    expected = extract(
+        monkeypatch,
+        osm_data,
+        tmp_path / "expected_files",
+        tmp_path / "expected.geojson",
+        osm_file=osm_data["changed_osm_file"],
+    )
+
+    assert_same_features(read_output(str(tmp_path / "updated.geojson")), expected, rel=1e-6)
@@ -0,0 +1,95 @@
+import numpy as np
+
+from osm_feature_extractor.feature_augmenting.feature_accumulator import (
+    FeatureAccumulator,
+    expand_pairs,
+    map_columns,
+)
+
+
+def test_add_accumulates_repeated_pairs():
+
+    accumulator = FeatureAccumulator(3)
+
+    accumulator.add(np.array([0, 0, 2]), np.array([1, 1, 0]), np.array([1.5, 2.0, 3.0]))
+
+    assert accumulator.values[0, 1] == 3.5
+    assert accumulator.values[2, 0] == 3.0
+    assert accumulator.updated.tolist() == [True, False, True]
+
+
+def test_partial_sums_merge_into_the_same_values():
+
+    accumulator = FeatureAccumulator(4)
+    accumulator.add(np.array([1, 3]), np.array([0, 2]), np.array([1.0, 2.0]))
+    accumulator.counters["node_contains"] += 2
+
+    merged = FeatureAccumulator(4)
+    merged.merge_partial_sums(*accumulator.get_partial_sums())
+    merged.merge_partial_sums(*accumulator.get_partial_sums())
+
+    np.testing.assert_array_equal(merged.values, 2 * accumulator.values)
+    np.testing.assert_array_equal(merged.updated, accumulator.updated)
+    assert merged.counters["node_contains"] == 4
+
+
+def test_iter_properties_converts_counts_to_int():
+
+    accumulator = FeatureAccumulator(1)
+    count_feature = next(feature for feature in accumulator.features if feature.endswith("_count"))
+    other_feature = next(feature for feature in accumulator.features if not feature.endswith("_count"))
+
+    accumulator.add(
+        np.array([0, 0]),
+        np.array([accumulator.columns[count_feature], accumulator.columns[other_feature]]),
+        np.array([2.0, 1.25]),
+    )
+
+    properties = next(accumulator.iter_properties())
+
+    assert properties[count_feature] == 2 and isinstance(properties[count_feature], int)
+    assert properties[other_feature] == 1.25
+    assert properties["updated"] is True
+
+
+def test_from_polygons_reads_the_output_features():
+
+    accumulator = FeatureAccumulator(2)
+    length_feature = next(feature for feature in accumulator.features if feature.endswith("_length"))
+
+    accumulator.add(np.array([0, 1]), np.array([0, accumulator.columns[length_feature]]), np.array([4.0, 2.5]))
+
+    polygons = {polygon_id: {"properties": {}} for polygon_id in ["a", "b"]}
+    polygons = accumulator.to_polygons(polygons, ["a", "b"])
+
+    restored = FeatureAccumulator.from_polygons(polygons, ["a", "b"])
+
+    np.testing.assert_array_equal(restored.values, accumulator.values)
+    np.testing.assert_array_equal(restored.updated, accumulator.updated)
+
+
+def test_expand_pairs_repeats_the_columns_of_each_object():
+
+    # Object 0 has columns [4, 5], object 1 has no columns and object 2 has column [7]
+    column_offsets = np.array([0, 2, 2, 3])
+    columns = np.array([4, 5, 7])
+
+    rows, pair_columns, values = expand_pairs(
+        np.array([0, 2, 0, 1]), np.array([10, 11, 12, 13]), np.array([1.0, 2.0, 3.0, 4.0]), column_offsets, columns
+    )
+
+    assert rows.tolist() == [10, 10, 11, 12, 12]
+    assert pair_columns.tolist() == [4, 5, 7, 4, 5]
+    assert values.tolist() == [1.0, 1.0, 2.0, 3.0, 3.0]
+
+
+def test_map_columns_drops_the_unmapped_columns():
+
+    column_offsets = np.array([0, 2, 3, 5])
+    columns = np.array([0, 1, 2, 0, 2])
+    column_mapping = np.array([5, -1, 6])
+
+    mapped_offsets, mapped_columns = map_columns(column_offsets, columns, column_mapping)
+
+    assert mapped_offsets.tolist() == [0, 1, 2, 4]
+    assert mapped_columns.tolist() == [5, 6, 5, 6]
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+import shapely
+
+from osm_feature_extractor.feature_augmenting.geodesy import (
+    EARTH_RADIUS,
+    haversine_lengths,
+    lines_lengths,
+    polygons_areas,
+    ring_areas,
+)
+
+
+def test_haversine_lengths_of_meridian_and_equator_degrees():
+
+    coords = np.array([[0.0, 0.0], [1.0, 0.0], [10.0, 10.0], [10.0, 11.0], [10.0, 12.0]])
+
+    lengths = haversine_lengths(coords, np.array([0, 2, 5]))
+
+    degree = 2 * np.pi * EARTH_RADIUS / 360
+
+    np.testing.assert_allclose(lengths, [degree, 2 * degree])
+
+
+def test_ring_areas_of_a_lat_lon_box():
+
+    west, south, east, north = 10.0, 40.0, 12.0, 41.0
+    box = [[west, south], [east, south], [east, north], [west, north], [west, south]]
+    triangle = box[:3] + [box[0]]
+    line = [[west, south], [east, north]]
+
+    areas = ring_areas(np.array(box + triangle + line), np.array([0, 5, 9, 11]))
+
+    expected = EARTH_RADIUS ** 2 * np.radians(east - west) * (np.sin(np.radians(north)) - np.sin(np.radians(south)))
+
+    assert areas[0] == pytest.approx(expected, rel=1e-9)
+    assert areas[1] == pytest.approx(expected / 2, rel=0.01)
+    assert areas[2] == 0
+
+
+def test_lengths_and_areas_are_nan_for_other_geometry_types():
+
+    line = shapely.LineString([(0, 0), (0, 1)])
+    multi_line = shapely.MultiLineString([[(0, 0), (0, 1)], [(1, 0), (1, 1)]])
+    polygon = shapely.box(0, 0, 1, 1)
+    geometries = np.array([line, multi_line, polygon, shapely.Point(0, 0), shapely.LineString()], dtype=object)
+
+    lengths = lines_lengths(geometries)
+    areas = polygons_areas(geometries)
+
+    assert lengths[1] == pytest.approx(2 * lengths[0])
+    assert np.isnan(lengths[2:]).all()
+    assert np.isnan(areas[[0, 1, 3, 4]]).all()
+    assert areas[2] > 0
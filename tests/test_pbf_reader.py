@@ -0,0 +1,169 @@
+import lzma
+import struct
+
+import numpy as np
+import osmium
+import pytest
+
+from osm_feature_extractor.feature_extraction.osm_extractor_augmenter import get_object_counter
+from osm_feature_extractor.feature_extraction.pbf_reader import (
+    UnsupportedBlobError,
+    count_pbf_objects,
+    decode_block_locations,
+    is_pbf_file,
+    read_blob,
+    read_blob_index,
+    read_raw_blobs,
+)
+
+
+class LocationHandler(osmium.SimpleHandler):
+
+    def __init__(self):
+        osmium.SimpleHandler.__init__(self)
+        self.locations = []
+        self.ways = 0
+
+    def node(self, n):
+        self.locations.append((n.location.lon, n.location.lat))
+
+    def way(self, w):
+        self.ways += 1
+
+
+def encode_varint(value):
+
+    encoded = bytearray()
+
+    while value >= 0x80:
+        encoded.append(value & 0x7F | 0x80)
+        value >>= 7
+
+    encoded.append(value)
+
+    return bytes(encoded)
+
+
+def encode_field(field_number, value):
+
+    if isinstance(value, bytes):
+        return encode_varint(field_number << 3 | 2) + encode_varint(len(value)) + value
+
+    return encode_varint(field_number << 3) + encode_varint(value)
+
+
+def write_lzma_pbf(osm_file, path):
+    """
+    Rewrites a PBF file with the data of its blobs compressed with lzma instead of zlib
+    """
+
+    with open(osm_file, "rb") as f, open(path, "wb") as out:
+        for blob in read_blob_index(osm_file):
+            data = read_blob(f, blob)
+
+            blob_data = encode_field(2, len(data)) + encode_field(4, lzma.compress(data))
+            blob_header = encode_field(1, blob.type.encode()) + encode_field(3, len(blob_data))
+
+            out.write(struct.pack(">I", len(blob_header)) + blob_header + blob_data)
+
+
+def read_locations(osm_file):
+
+    handler = LocationHandler()
+    handler.apply_file(osm_file)
+
+    return np.array(handler.locations), handler.ways
+
+
+def test_blob_index_covers_the_file(osm_data):
+
+    blobs = read_blob_index(osm_data["osm_file"])
+
+    with open(osm_data["osm_file"], "rb") as f:
+        file_size = len(f.read())
+
+    assert blobs[0].type == "OSMHeader"
+    assert all(blob.type == "OSMData" for blob in blobs[1:])
+    assert sum(4 + blob.header_size + blob.data_size for blob in blobs) == file_size
+
+
+def test_is_pbf_file(osm_data):
+
+    assert is_pbf_file(osm_data["osm_file"])
+    assert not is_pbf_file(osm_data["change_file"])
+
+
+def test_decoded_locations_match_osmium(osm_data):
+
+    blobs = read_blob_index(osm_data["osm_file"])
+
+    coords, ways = [], 0
+
+    with open(osm_data["osm_file"], "rb") as f:
+        for blob in blobs[1:]:
+            block_coords, block_ways = decode_block_locations(read_blob(f, blob))
+            coords.append(block_coords)
+            ways += block_ways
+
+    expected_coords, expected_ways = read_locations(osm_data["osm_file"])
+
+    np.testing.assert_array_equal(np.concatenate(coords), expected_coords)
+    assert ways == expected_ways
+
+
+def test_count_pbf_objects_matches_osmium(osm_data):
+
+    blobs = read_blob_index(osm_data["osm_file"])
+
+    with open(osm_data["osm_file"], "rb") as f:
+        nodes, ways = count_pbf_objects(f, blobs)
+
+    expected_coords, expected_ways = read_locations(osm_data["osm_file"])
+
+    assert (nodes, ways) == (len(expected_coords), expected_ways)
+
+
+def test_raw_blob_ranges_are_readable_pbf(osm_data, tmp_path):
+
+    blobs = read_blob_index(osm_data["osm_file"])
+
+    with open(osm_data["osm_file"], "rb") as f:
+        header = read_raw_blobs(f, blobs[:1])
+        ranges = [read_raw_blobs(f, blobs[:1] + [blob]) for blob in blobs[1:]]
+
+    coords, ways = [], 0
+
+    for i, buffer in enumerate(ranges):
+        assert buffer.startswith(header)
+
+        range_file = tmp_path / f"range_{i}.osm.pbf"
+        range_file.write_bytes(buffer)
+
+        range_coords, range_ways = read_locations(str(range_file))
+        coords.append(range_coords.reshape(-1, 2))
+        ways += range_ways
+
+    expected_coords, expected_ways = read_locations(osm_data["osm_file"])
+
+    np.testing.assert_array_equal(np.concatenate(coords), expected_coords)
+    assert ways == expected_ways
+
+
+def test_unsupported_compression_falls_back_to_osmium_counting(osm_data, tmp_path):
+
+    lzma_file = str(tmp_path / "lzma.osm.pbf")
+    write_lzma_pbf(osm_data["osm_file"], lzma_file)
+
+    blobs = read_blob_index(lzma_file)
+
+    assert is_pbf_file(lzma_file)
+    assert [blob.type for blob in blobs] == [blob.type for blob in read_blob_index(osm_data["osm_file"])]
+
+    with open(lzma_file, "rb") as f:
+        with pytest.raises(UnsupportedBlobError):
+            read_blob(f, blobs[1])
+
+    object_counter, counter_handlers = get_object_counter(lzma_file)
+
+    assert counter_handlers == [object_counter]
+    assert (object_counter.nodes_counter, object_counter.ways_counter) == (0, 0)
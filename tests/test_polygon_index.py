@@ -0,0 +1,61 @@
+import numpy as np
+import shapely
+
+from osm_feature_extractor.feature_augmenting.polygon_index import build_polygon_index
+
+
+def make_polygons():
+
+    # A detailed polygon, which is tiled, next to a simple one that shares its east edge
+    circle = shapely.Point(0, 0).buffer(1, quad_segs=64)
+
+    return ["circle", "box"], [circle, shapely.box(1, -1, 2, 1)]
+
+
+def match_points(polygon_index, coords):
+
+    point_idxs, piece_idxs = polygon_index.query_points(coords)
+
+    return sorted(zip(point_idxs.tolist(), polygon_index.parents[piece_idxs].tolist()))
+
+
+def test_tiled_polygons_match_the_points_of_the_whole_polygons():
+
+    ids, geometries = make_polygons()
+
+    rng = np.random.default_rng(0)
+
+    # Random points, and points on the edges between the pieces of the tiled polygon and on its corners
+    coords = np.concatenate([
+        rng.uniform(-1.5, 2.5, size=(2000, 2)),
+        np.column_stack([np.zeros(21), np.linspace(-1, 1, 21)]),
+        np.column_stack([np.linspace(-1, 1, 21), np.zeros(21)]),
+        np.column_stack([np.full(21, 0.5), np.linspace(-1, 1, 21)]),
+        [[0.0, 0.0], [0.5, 0.5], [-0.5, -0.5], [1.0, 0.0]],
+    ])
+
+    polygon_index = build_polygon_index(ids, geometries)
+    tiled_index = build_polygon_index(ids, geometries, max_vertices=20)
+
+    assert tiled_index.is_tiled and len(tiled_index.pieces) > 4
+
+    expected = match_points(polygon_index, coords)
+
+    assert match_points(tiled_index, coords) == expected
+
+    # Every point of the internal edges of the circle is matched to it once
+    matched_edge_points = [point for point, parent in expected if parent == 0 and point >= 2000]
+
+    assert len(matched_edge_points) == len(set(matched_edge_points))
+    assert {2000 + 10, 2000 + 21 + 10, 2000 + 63, 2000 + 64} <= set(matched_edge_points)
+
+
+def test_points_on_the_outer_border_are_not_matched():
+
+    ids, geometries = make_polygons()
+
+    tiled_index = build_polygon_index(ids, geometries, max_vertices=20)
+
+    coords = np.array([[1.0, 0.0], [0.0, 1.0], [2.0, 0.5]])
+
+    assert match_points(tiled_index, coords) == []
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+import shapely
+
+from osm_feature_extractor.feature_augmenting.polygon_tiling import tile_polygon, tile_polygons
+
+
+def make_star(points=200, radius=1.0):
+
+    angles = np.linspace(0, 2 * np.pi, 2 * points, endpoint=False)
+    radii = np.where(np.arange(2 * points) % 2 == 0, radius, radius / 2)
+
+    return shapely.Polygon(np.column_stack([radii * np.cos(angles), radii * np.sin(angles)]))
+
+
+def assert_covers(pieces, polygon):
+
+    assert sum(piece.area for piece in pieces) == pytest.approx(polygon.area, rel=1e-9)
+    assert shapely.union_all(pieces).symmetric_difference(polygon).area == pytest.approx(0, abs=1e-9)
+
+
+@pytest.mark.parametrize("max_vertices", [20, 100])
+def test_pieces_have_at_most_max_vertices_and_cover_the_polygon(max_vertices):
+
+    star = make_star()
+
+    pieces = tile_polygon(star, max_vertices)
+
+    assert len(pieces) > 1
+    assert shapely.get_num_coordinates(np.array(pieces, dtype=object)).max() <= max_vertices
+    assert_covers(pieces, star)
+
+
+def test_pieces_that_splits_dont_reduce_stop_being_split():
+
+    star = make_star()
+
+    # The pieces with the tips of the star have the tip, two crossings of the quadrant borders
+    # and the corners of the quadrant at any depth, so they can't be split down to 5 vertices
+    pieces = tile_polygon(star, 5)
+
+    assert len(pieces) < 10 * len(star.exterior.coords)
+    assert_covers(pieces, star)
+
+
+def test_small_polygons_are_kept_whole():
+
+    box = shapely.box(0, 0, 1, 1)
+
+    pieces, parents = tile_polygons(np.array([box, make_star(), box], dtype=object), 50)
+
+    assert pieces[0] is box and pieces[-1] is box
+    assert parents[0] == 0 and parents[-1] == 2
+    assert (parents[1:-1] == 1).all() and len(pieces) > 3